@@ -0,0 +1,70 @@
+#!/usr/bin/env python
+
+"""Micro-benchmark of :class:`zensols.util.Hasher` with the default and binary
+encodings of large data, which is run from this directory with::
+
+    PYTHONPATH=../../src ./hasher.py
+
+"""
+
+from typing import Any
+import sys
+import time
+import tempfile
+from pathlib import Path
+from zensols.util import Hasher
+
+try:
+    import numpy as np
+except ModuleNotFoundError:
+    np = None
+
+N = 1_000_000
+
+
+def bench(name: str, data: Any, binary: bool):
+    best: float = None
+    for _ in range(3):
+        t0: float = time.perf_counter()
+        hasher = Hasher(binary=binary)
+        hasher.update(data)
+        hasher()
+        dur: float = time.perf_counter() - t0
+        best = dur if best is None else min(best, dur)
+    mode: str = 'binary' if binary else 'default'
+    print(f'{name:>16} ({mode:>7}): {best * 1e3:9.2f} ms')
+
+
+def bench_file(path: Path):
+    best: float = None
+    for _ in range(3):
+        t0: float = time.perf_counter()
+        hasher = Hasher()
+        hasher.update_file(path)
+        hasher()
+        dur: float = time.perf_counter() - t0
+        best = dur if best is None else min(best, dur)
+    mbs: float = path.stat().st_size / best / (1 << 20)
+    print(f'{"file":>16} ({"chunked":>7}): {best * 1e3:9.2f} ms ' +
+          f'({mbs:.0f} MB/s)')
+
+
+def main():
+    print(f'python {sys.version.split()[0]}, best of 3, {N} elements')
+    floats = [i / 7 for i in range(N)]
+    ints = list(range(N))
+    data = bytes(8 * N)
+    for binary in (False, True):
+        bench('float list', floats, binary)
+        bench('int list', ints, binary)
+        bench('bytes', data, binary)
+        if np is not None:
+            bench('ndarray float64', np.arange(N, dtype=np.float64), binary)
+    with tempfile.TemporaryDirectory() as d:
+        path = Path(d) / 'data.bin'
+        path.write_bytes(bytes(64 * N))
+        bench_file(path)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,58 @@
+#!/usr/bin/env python
+
+"""Micro-benchmark of the per-access cost of properties cached with
+:class:`zensols.persist.persisted`, which is run from this directory with::
+
+    PYTHONPATH=../../src ./persisted.py
+
+"""
+
+import sys
+from timeit import Timer
+from zensols.persist import (
+    PersistableContainer, persisted, persisted_property
+)
+
+N = 1_000_000
+
+
+class Plain(object):
+    def __init__(self):
+        self.value = 1
+
+
+class Property(PersistableContainer):
+    @property
+    @persisted('_value')
+    def value(self):
+        return 1
+
+
+class GlobalProperty(PersistableContainer):
+    @property
+    @persisted('_value', cache_global=True)
+    def value(self):
+        return 1
+
+
+class FastProperty(PersistableContainer):
+    @persisted_property('_value')
+    def value(self):
+        return 1
+
+
+def bench(cls: type):
+    inst = cls()
+    inst.value
+    best: float = min(Timer('inst.value', globals=locals()).repeat(5, N))
+    print(f'{cls.__name__:>15}: {best / N * 1e9:7.1f} ns/access')
+
+
+def main():
+    print(f'python {sys.version.split()[0]}, best of 5 x {N} accesses')
+    for cls in (Plain, Property, GlobalProperty, FastProperty):
+        bench(cls)
+
+
+if __name__ == '__main__':
+    main()
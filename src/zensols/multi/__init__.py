@@ -3,5 +3,9 @@
 """
 __author__ = 'Paul Landes'
 
+from .journal import *
+from .transport import *
+from .metrics import *
 from .stash import *
 from .factory import *
+from .broker import *
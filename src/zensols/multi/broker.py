@@ -0,0 +1,278 @@
+"""A multi-processor that distributes chunks to workers on other hosts through
+a queue broker.
+
+"""
+__author__ = 'Paul Landes'
+
+from typing import Any, List, Iterable, Callable, Union, ClassVar
+from dataclasses import dataclass, field
+import logging
+import queue
+import time as tm
+from multiprocessing import Process, current_process
+from multiprocessing.managers import BaseManager
+from zensols.util import APIError
+from zensols.util.time import time
+from .metrics import ChunkStats
+from .stash import ChunkProcessor, MultiProcessor
+
+logger = logging.getLogger(__name__)
+
+_TASKS: queue.Queue = None
+_RESULTS: queue.Queue = None
+
+
+def _get_tasks() -> queue.Queue:
+    global _TASKS
+    if _TASKS is None:
+        _TASKS = queue.Queue()
+    return _TASKS
+
+
+def _get_results() -> queue.Queue:
+    global _RESULTS
+    if _RESULTS is None:
+        _RESULTS = queue.Queue()
+    return _RESULTS
+
+
+class ChunkBroker(BaseManager):
+    """Serves the queue of chunks to process and the queue of their results
+    from the process started by :meth:`start`.
+
+    """
+    pass
+
+
+ChunkBroker.register('tasks', callable=_get_tasks)
+ChunkBroker.register('results', callable=_get_results)
+
+
+def _to_authkey(authkey: Union[str, bytes]) -> bytes:
+    if authkey is None:
+        return bytes(current_process().authkey)
+    return authkey.encode() if isinstance(authkey, str) else authkey
+
+
+@dataclass
+class BrokerWorker(object):
+    """Processes chunks taken from the broker of a
+    :class:`.BrokerMultiProcessor` until the work is done.  To add workers on
+    other hosts, which must have access to the paths of the application
+    configuration and stash (i.e. NFS), run::
+
+        BrokerWorker('build-host', 50000, 'secret').run()
+
+    with the :obj:`host`, :obj:`port` and :obj:`authkey` of the
+    :class:`.BrokerMultiProcessor`.  Each chunk is processed by a stash
+    created by the worker's own
+    :class:`~zensols.config.importfac.ImportConfigFactory`.
+
+    """
+    host: str = field()
+    """The host of the broker."""
+
+    port: int = field()
+    """The port of the broker."""
+
+    authkey: Union[str, bytes] = field(default=None, repr=False)
+    """The shared secret of the broker, which defaults to the key of the
+    (parent) process.
+
+    """
+    wait: float = field(default=None)
+    """The number of seconds to retry connecting to a broker not yet started,
+    which allows workers to be started before the work.
+
+    """
+    def _connect(self) -> ChunkBroker:
+        broker = ChunkBroker(address=(self.host, self.port),
+                             authkey=_to_authkey(self.authkey))
+        deadline: float = tm.monotonic() + (self.wait or 0)
+        while True:
+            try:
+                broker.connect()
+                return broker
+            except ConnectionRefusedError:
+                if tm.monotonic() >= deadline:
+                    raise
+                tm.sleep(0.2)
+
+    def run(self) -> int:
+        """Process chunks until the broker has no more work.
+
+        :return: the number of chunks processed
+
+        """
+        broker: ChunkBroker = self._connect()
+        tasks: queue.Queue = broker.tasks()
+        results: queue.Queue = broker.results()
+        cnt: int = 0
+        while True:
+            try:
+                processor: ChunkProcessor = tasks.get()
+            except (EOFError, ConnectionError):
+                # the broker shut down
+                break
+            if processor is None:
+                # let the other workers know the work is done
+                tasks.put(None)
+                break
+            res: Union[ChunkStats, BaseException]
+            try:
+                res = MultiProcessor._process_work(processor)
+            except Exception as e:
+                logger.error(f'could not process chunk {processor.chunk_id}: ' +
+                             f'{e}', exc_info=True)
+                res = e
+            results.put(res)
+            cnt += 1
+        if logger.isEnabledFor(logging.INFO):
+            logger.info(f'worker processed {cnt} chunks')
+        return cnt
+
+
+@dataclass
+class BrokerMultiProcessor(MultiProcessor):
+    """Publishes chunks to a queue broker from which worker processes on this
+    and other hosts take them (see :class:`.BrokerWorker`).  This scales the
+    work beyond the cores of one machine when the stash's delegate path is
+    shared by the hosts.  The broker is a :mod:`multiprocessing.managers`
+    server that listens on :obj:`host` and :obj:`port` while the work is done.
+
+    Like :class:`.StreamingPoolMultiProcessor`, at most :obj:`window` chunks
+    are published but not yet completed at a time.
+
+    Chunks in flight on a worker that is lost (i.e. killed or disconnected) are
+    not re-queued.  The work fails when a worker started by this processor
+    exits abnormally, and otherwise, when no chunk completes in
+    :obj:`timeout` seconds, such as when no remote worker connects.
+
+    """
+    _POLL_SECONDS: ClassVar[float] = 1.
+    """The number of seconds between checks of the local workers while waiting
+    for a chunk to complete.
+
+    """
+    host: str = field(default='127.0.0.1')
+    """The interface on which the broker listens, which should be set to an
+    interface reachable by other hosts to use remote workers.
+
+    """
+    port: int = field(default=0)
+    """The port on which the broker listens, or 0 to use any free port (only
+    useful without remote workers).
+
+    """
+    authkey: Union[str, bytes] = field(default=None, repr=False)
+    """The shared secret used to authenticate workers, which defaults to the
+    key of this process.  This must be set to use remote workers.
+
+    """
+    local_workers: int = field(default=None)
+    """The number of worker processes to start on this host, which defaults to
+    the stash's number of workers.
+
+    """
+    window: int = field(default=None)
+    """The maximum number of published chunks not yet completed, which
+    defaults to twice the stash's number of workers.
+
+    """
+    timeout: float = field(default=600)
+    """The number of seconds to wait for any chunk to complete before giving
+    up, or ``None`` to wait indefinitely.
+
+    """
+    def _get_result(self, results: queue.Queue, procs: List[Process],
+                    inflight: int) -> Union[ChunkStats, BaseException]:
+        """Wait for the result of the next completed chunk.
+
+        :raises APIError: if a local worker exited abnormally or no chunk
+                          completed in :obj:`timeout` seconds
+
+        """
+        deadline: float = None
+        if self.timeout is not None:
+            deadline = tm.monotonic() + self.timeout
+        while True:
+            wait: float = self._POLL_SECONDS
+            if deadline is not None:
+                wait = max(0, min(wait, deadline - tm.monotonic()))
+            try:
+                return results.get(timeout=wait)
+            except queue.Empty:
+                pass
+            proc: Process
+            for proc in procs:
+                if proc.exitcode not in {None, 0}:
+                    raise APIError(
+                        f'{self.name}: worker {proc.name} exited with ' +
+                        f'{proc.exitcode} with {inflight} chunks in flight')
+            if deadline is not None and tm.monotonic() >= deadline:
+                raise APIError(f'{self.name}: no chunk completed in ' +
+                               f'{self.timeout}s with {inflight} in flight')
+
+    def _publish(self, tasks: queue.Queue, results: queue.Queue,
+                 data: Iterable[ChunkProcessor], window: int,
+                 procs: List[Process]) -> List[int]:
+        cnts: List[int] = []
+        inflight: int = 0
+
+        def wait():
+            nonlocal inflight
+            res: Union[ChunkStats, BaseException] = self._get_result(
+                results, procs, inflight)
+            inflight -= 1
+            if isinstance(res, BaseException):
+                raise res
+            cnts.append(self._receive(res))
+
+        processor: ChunkProcessor
+        for processor in data:
+            while inflight >= window:
+                wait()
+            tasks.put(processor)
+            inflight += 1
+        while inflight > 0:
+            wait()
+        return cnts
+
+    def _invoke_work(self, workers: int, chunk_size: int,
+                     data: Iterable[Any], fn: Callable) -> int:
+        authkey: bytes = _to_authkey(self.authkey)
+        broker = ChunkBroker(address=(self.host, self.port), authkey=authkey)
+        broker.start()
+        host, port = broker.address
+        if logger.isEnabledFor(logging.INFO):
+            logger.info(f'{self.name}: broker listening on {host}:{port}')
+        procs: List[Process] = []
+        try:
+            tasks: queue.Queue = broker.tasks()
+            results: queue.Queue = broker.results()
+            n_local: int = workers if self.local_workers is None \
+                else self.local_workers
+            worker = BrokerWorker(host, port, authkey)
+            i: int
+            for i in range(n_local):
+                proc = Process(target=worker.run, daemon=True,
+                               name=f'{self.name}-worker-{i}')
+                proc.start()
+                procs.append(proc)
+            window: int = self.window
+            if window is None:
+                window = 2 * workers
+            with time('processed chunks'):
+                cnts: List[int] = self._publish(
+                    tasks, results, data, window, procs)
+            # tell the workers there is no more work
+            tasks.put(None)
+            proc: Process
+            for proc in procs:
+                proc.join()
+            return cnts
+        finally:
+            for proc in procs:
+                if proc.is_alive():
+                    proc.terminate()
+            broker.shutdown()
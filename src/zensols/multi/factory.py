@@ -3,10 +3,12 @@
 """
 __author__ = 'Paul Landes'
 
-from typing import Iterable, List, Tuple, Set, Any, Union, Type
+from typing import Iterable, List, Tuple, Dict, Set, Any, Union, Type
 from dataclasses import dataclass, field
 import os
 import logging
+import collections.abc
+from pathlib import Path
 from zensols.util import Failure
 from zensols.config import Configurable
 from zensols.persist import Stash, PreemptiveStash, PrimeableStash
@@ -42,6 +44,22 @@ class MultiProcessDefaultStash(MultiProcessStash):
     processor_class: Type[MultiProcessor] = field(default=PoolMultiProcessor)
     """The class of the processor to use for the handling of the work."""
 
+    processor_params: Dict[str, Any] = field(default=None)
+    """The keyword arguments given to the initializer of
+    :obj:`processor_class`.
+
+    """
+    checkpoint_path: Path = field(default=None)
+    """The file of the journal used to resume work where it stopped, or
+    ``None`` to not keep a journal.
+
+    """
+    metrics_path: Path = field(default=None)
+    """The JSON or CSV file to which the statistics of the processed chunks
+    are written, or ``None`` to not write them.
+
+    """
+
 
 @dataclass(init=False)
 class MultiProcessFactoryStash(MultiProcessDefaultStash):
@@ -144,9 +162,11 @@ class MultiProcessRobustStash(MultiProcessFactoryStash):
         self._set_has_data(False)
 
     def _get_missing_keys(self) -> Iterable[Any]:
-        fkeys: Set[str] = set(self.factory.keys())
-        dkeys: Set[str] = set(self.delegate.keys())
-        return fkeys - dkeys
+        dkeys: Iterable[str] = self.delegate.keys()
+        if not isinstance(dkeys, collections.abc.Set):
+            dkeys = set(dkeys)
+        # the set-like keys of indexed delegates are used as is
+        return tuple(filter(lambda k: k not in dkeys, self.factory.keys()))
 
     def _create_data(self) -> Iterable[Any]:
         return self._get_missing_keys()
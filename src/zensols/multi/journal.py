@@ -0,0 +1,162 @@
+"""A checkpoint journal of the chunks processed by a multi-process stash.
+
+"""
+__author__ = 'Paul Landes'
+
+from typing import Any, Dict, List, Tuple, Iterable
+from dataclasses import dataclass, field
+import logging
+import os
+import json
+import bisect
+from pathlib import Path
+
+logger = logging.getLogger(__name__)
+
+
+@dataclass
+class ChunkJournal(object):
+    """An append only journal that records the chunks of data assigned to, and
+    completed by, the processes of a
+    :class:`~zensols.multi.stash.MultiProcessStash`.  Each chunk's data is
+    identified by the ranges of its indexes in the data created by
+    :meth:`~zensols.multi.stash.MultiProcessStash._create_data`, so the work
+    can be resumed where it stopped by skipping the data of completed chunks.
+    This requires the data to be created in the same order each time.
+
+    Each record is a line of JSON written with one call to ``write`` in append
+    mode, which is atomic for lines of this size, and then synchronized to
+    disk.  This allows child processes to record the completion of their
+    chunks in the same file.  A line truncated by a killed process is ignored
+    when the journal is read.
+
+    """
+    path: Path = field()
+    """The journal file."""
+
+    def _append(self, rec: Dict[str, Any]):
+        line: bytes = (json.dumps(rec) + '\n').encode()
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        fd: int = os.open(self.path, os.O_RDWR | os.O_APPEND | os.O_CREAT,
+                          0o666)
+        try:
+            size: int = os.fstat(fd).st_size
+            if size > 0 and os.pread(fd, 1, size - 1) != b'\n':
+                # end the line truncated by a killed process
+                line = b'\n' + line
+            os.write(fd, line)
+            os.fsync(fd)
+        finally:
+            os.close(fd)
+
+    def _records(self) -> Iterable[Dict[str, Any]]:
+        if self.path.is_file():
+            with open(self.path) as f:
+                line: str
+                for line in f:
+                    try:
+                        yield json.loads(line)
+                    except json.JSONDecodeError:
+                        if logger.isEnabledFor(logging.WARNING):
+                            logger.warning(
+                                f'skipping bad journal record: {line!r}')
+
+    @staticmethod
+    def to_ranges(indexes: Iterable[int]) -> List[Tuple[int, int]]:
+        """Compress ascending indexes in to ``(start, end)`` ranges that include
+        ``start`` and exclude ``end``.
+
+        """
+        ranges: List[List[int]] = []
+        idx: int
+        for idx in indexes:
+            if len(ranges) > 0 and ranges[-1][1] == idx:
+                ranges[-1][1] = idx + 1
+            else:
+                ranges.append([idx, idx + 1])
+        return list(map(tuple, ranges))
+
+    def assign(self, chunk_id: int, ranges: List[Tuple[int, int]]):
+        """Record that a chunk was created and will be sent to a process."""
+        self._append({'event': 'assign', 'chunk': chunk_id,
+                      'pid': os.getpid(), 'ranges': ranges})
+
+    def complete(self, chunk_id: int, ranges: List[Tuple[int, int]],
+                 items: int):
+        """Record that the items of a chunk were persisted."""
+        self._append({'event': 'complete', 'chunk': chunk_id,
+                      'pid': os.getpid(), 'ranges': ranges, 'items': items})
+
+    def finish(self):
+        """Record that all chunks were processed."""
+        self._append({'event': 'finish'})
+
+    @property
+    def exists(self) -> bool:
+        """Whether the journal has been started."""
+        return self.path.is_file()
+
+    @property
+    def is_finished(self) -> bool:
+        """Whether all chunks were processed."""
+        return any(map(lambda r: r.get('event') == 'finish', self._records()))
+
+    @property
+    def in_flight(self) -> Tuple[int, ...]:
+        """The IDs of chunks assigned but not completed in the last run."""
+        chunks: Dict[int, None] = {}
+        rec: Dict[str, Any]
+        for rec in self._records():
+            event: str = rec.get('event')
+            if event == 'assign':
+                chunks[rec['chunk']] = None
+            elif event == 'complete':
+                chunks.pop(rec['chunk'], None)
+            elif event == 'resume':
+                chunks.clear()
+        return tuple(chunks.keys())
+
+    def resume(self) -> 'CompletedIndexes':
+        """Record that the work is resumed and return the indexes of the
+        completed data.
+
+        """
+        ranges: List[Tuple[int, int]] = []
+        rec: Dict[str, Any]
+        for rec in self._records():
+            if rec.get('event') == 'complete':
+                ranges.extend(map(tuple, rec['ranges']))
+        completed = CompletedIndexes(ranges)
+        if logger.isEnabledFor(logging.INFO):
+            logger.info(f'resuming with {len(completed)} completed items ' +
+                        f'and chunks {self.in_flight} in flight')
+        self._append({'event': 'resume', 'pid': os.getpid()})
+        return completed
+
+    def clear(self):
+        """Remove the journal file."""
+        self.path.unlink(missing_ok=True)
+
+
+class CompletedIndexes(object):
+    """The indexes of completed data as merged ranges.
+
+    """
+    def __init__(self, ranges: Iterable[Tuple[int, int]]):
+        merged: List[List[int]] = []
+        start: int
+        end: int
+        for start, end in sorted(ranges):
+            if len(merged) > 0 and start <= merged[-1][1]:
+                merged[-1][1] = max(merged[-1][1], end)
+            else:
+                merged.append([start, end])
+        self._starts: List[int] = list(map(lambda r: r[0], merged))
+        self._ends: List[int] = list(map(lambda r: r[1], merged))
+
+    def __contains__(self, idx: int) -> bool:
+        i: int = bisect.bisect_right(self._starts, idx) - 1
+        return i >= 0 and idx < self._ends[i]
+
+    def __len__(self) -> int:
+        return sum(map(lambda s, e: e - s, self._starts, self._ends))
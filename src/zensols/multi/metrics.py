@@ -0,0 +1,237 @@
+"""Statistics of the chunks processed by a multi-process stash.
+
+"""
+__author__ = 'Paul Landes'
+
+from typing import Any, Dict, List, Tuple, Optional
+from dataclasses import dataclass, field
+import logging
+import sys
+import os
+import csv
+import threading
+import time as tm
+from pathlib import Path
+from zensols.config import Dictable
+
+logger = logging.getLogger(__name__)
+
+
+def _max_rss() -> Optional[int]:
+    """Return the peak resident set size of the current process in bytes, or
+    ``None`` if not available on this platform.
+
+    """
+    try:
+        import resource
+    except ModuleNotFoundError:
+        return None
+    rss: int = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # kilobytes on Linux, but bytes on macOS
+    return rss if sys.platform == 'darwin' else rss * 1024
+
+
+def available_memory() -> Optional[int]:
+    """Return the memory in bytes available to start new processes without
+    swapping, or ``None`` if not available on this platform.
+
+    """
+    try:
+        with open('/proc/meminfo') as f:
+            line: str
+            for line in f:
+                if line.startswith('MemAvailable:'):
+                    return int(line.split()[1]) * 1024
+    except OSError:
+        pass
+    try:
+        return os.sysconf('SC_AVPHYS_PAGES') * os.sysconf('SC_PAGE_SIZE')
+    except (ValueError, OSError, AttributeError):
+        return None
+
+
+@dataclass
+class ChunkStats(Dictable):
+    """The statistics of processing a chunk, which are measured by the worker
+    that processed it.
+
+    """
+    _DICTABLE_ATTRIBUTES = ('worker', 'duration', 'throughput')
+
+    chunk_id: int = field()
+    """The ID of the chunk."""
+
+    pid: int = field()
+    """The ID of the process that processed the chunk."""
+
+    thread: str = field()
+    """The name of the thread that processed the chunk."""
+
+    start: float = field()
+    """When processing the chunk started in seconds since the epoch."""
+
+    end: float = field()
+    """When processing the chunk ended in seconds since the epoch."""
+
+    items: int = field(default=None)
+    """The number of items processed."""
+
+    max_rss: int = field(default=None)
+    """The peak resident set size of the process in bytes when processing the
+    chunk ended, or ``None`` if not available on the platform.
+
+    """
+    result: Any = field(default=None, repr=False)
+    """The result of :meth:`.ChunkProcessor.process`, which is removed when
+    received by the parent.
+
+    """
+    @classmethod
+    def measure(cls, processor: Any, stash: Any = None) -> 'ChunkStats':
+        """Process a chunk and measure it.
+
+        :param processor: the :class:`.ChunkProcessor` of the chunk
+
+        :param stash: given to :meth:`.ChunkProcessor.process`
+
+        """
+        start: float = tm.time()
+        res: Any = processor.process(stash)
+        return cls(processor.chunk_id, os.getpid(),
+                   threading.current_thread().name, start, tm.time(),
+                   max_rss=_max_rss(), result=res)
+
+    @property
+    def worker(self) -> str:
+        """Identifies the process and thread that processed the chunk."""
+        return f'{self.pid}:{self.thread}'
+
+    @property
+    def duration(self) -> float:
+        """The number of seconds it took to process the chunk."""
+        return self.end - self.start
+
+    @property
+    def throughput(self) -> float:
+        """The number of items processed per second."""
+        dur: float = self.duration
+        return 0. if dur == 0 or self.items is None else self.items / dur
+
+
+@dataclass
+class WorkerStats(Dictable):
+    """The statistics of the chunks processed by a worker.
+
+    """
+    worker: str = field()
+    """Identifies the process and thread (see :obj:`.ChunkStats.worker`)."""
+
+    chunks: int = field()
+    """The number of chunks processed."""
+
+    items: int = field()
+    """The number of items processed."""
+
+    busy: float = field()
+    """The number of seconds spent processing chunks."""
+
+    idle: float = field()
+    """The number of seconds of the work not spent processing chunks."""
+
+    max_rss: int = field()
+    """The peak resident set size of the worker's process in bytes."""
+
+
+@dataclass
+class MultiProcessStats(Dictable):
+    """The statistics of the chunks processed in one invocation of the work of
+    a :class:`.MultiProcessStash`, which are available as its ``stats``
+    attribute.  Use :meth:`write_report` to save them as JSON or CSV.
+
+    """
+    _DICTABLE_ATTRIBUTES = ('items', 'duration', 'throughput', 'worker_stats')
+    _CSV_COLUMNS = ('chunk_id', 'worker', 'pid', 'thread', 'start', 'end',
+                    'duration', 'items', 'throughput', 'max_rss')
+
+    name: str = field()
+    """The name of the stash."""
+
+    workers: int = field()
+    """The number of workers."""
+
+    chunk_size: int = field()
+    """The (maximum) size of each chunk."""
+
+    start: float = field(default_factory=tm.time)
+    """When the work started in seconds since the epoch."""
+
+    end: float = field(default=None)
+    """When the work ended in seconds since the epoch."""
+
+    chunks: List[ChunkStats] = field(default_factory=list)
+    """The statistics of each chunk in the order they were received."""
+
+    @property
+    def items(self) -> int:
+        """The number of items processed."""
+        return sum(map(lambda c: c.items, self.chunks))
+
+    @property
+    def duration(self) -> float:
+        """The number of seconds it took to do the work."""
+        end: float = tm.time() if self.end is None else self.end
+        return end - self.start
+
+    @property
+    def throughput(self) -> float:
+        """The number of items processed per second."""
+        dur: float = self.duration
+        return 0. if dur == 0 else self.items / dur
+
+    @property
+    def worker_stats(self) -> Tuple[WorkerStats, ...]:
+        """The statistics of each worker.  Idle time is the duration of all the
+        work less the worker's busy time, so it includes the time to start the
+        worker.
+
+        """
+        by_worker: Dict[str, List[ChunkStats]] = {}
+        chunk: ChunkStats
+        for chunk in self.chunks:
+            by_worker.setdefault(chunk.worker, []).append(chunk)
+        dur: float = self.duration
+        wstats: List[WorkerStats] = []
+        worker: str
+        chunks: List[ChunkStats]
+        for worker, chunks in by_worker.items():
+            busy: float = sum(map(lambda c: c.duration, chunks))
+            rss: List[int] = list(filter(
+                lambda r: r is not None, map(lambda c: c.max_rss, chunks)))
+            wstats.append(WorkerStats(
+                worker=worker,
+                chunks=len(chunks),
+                items=sum(map(lambda c: c.items, chunks)),
+                busy=busy,
+                idle=max(0., dur - busy),
+                max_rss=max(rss) if len(rss) > 0 else None))
+        return tuple(wstats)
+
+    def write_report(self, path: Path):
+        """Write the statistics to a file.  If the file has a ``.csv``
+        extension, a row for each chunk is written as CSV, otherwise all the
+        statistics are written as JSON.
+
+        """
+        path.parent.mkdir(parents=True, exist_ok=True)
+        with open(path, 'w', newline='') as f:
+            if path.suffix == '.csv':
+                writer = csv.writer(f)
+                writer.writerow(self._CSV_COLUMNS)
+                chunk: ChunkStats
+                for chunk in self.chunks:
+                    writer.writerow(map(lambda c: getattr(chunk, c),
+                                        self._CSV_COLUMNS))
+            else:
+                self.asjson(writer=f, indent=4)
+        if logger.isEnabledFor(logging.INFO):
+            logger.info(f'wrote multi-process stats to {path}')
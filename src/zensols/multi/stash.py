@@ -3,18 +3,36 @@
 """
 __author__ = 'Paul Landes'
 
-from typing import Iterable, List, Any, Tuple, Callable, Union, Type
+from typing import (
+    Iterable, Iterator, List, Dict, Set, Any, Tuple, Callable, Union, Type,
+    ClassVar, Optional
+)
 from abc import ABCMeta, abstractmethod
 from dataclasses import dataclass, field
+import dataclasses
 import sys
 import os
+from pathlib import Path
 import logging
 import math
+import operator
+import time as tm
+import itertools as it
+import asyncio
+from queue import Queue
+from concurrent.futures import ThreadPoolExecutor
 from multiprocessing import Pool
+from multiprocessing.util import Finalize
+from zensols.util import APIError
 from zensols.util.time import time
 from zensols.config import Configurable, ConfigFactory, ImportConfigFactory
-from zensols.persist import PrimablePreemptiveStash, chunks, Deallocatable
+from zensols.persist import (
+    PrimablePreemptiveStash, chunks, split_chunks, Deallocatable
+)
 from zensols.cli import LogConfigurator
+from .journal import ChunkJournal, CompletedIndexes
+from .transport import SharedMemoryResult
+from .metrics import ChunkStats, MultiProcessStats, available_memory
 
 logger = logging.getLogger(__name__)
 
@@ -24,9 +42,15 @@ class ChunkProcessor(object):
     """Represents a chunk of work created by the parent and processed on the
     child.
 
+    """
+    _WORKER_STASHES: ClassVar[Dict[str, Tuple[ImportConfigFactory, Any]]] = {}
+    """The factory and stash by name created once by each worker process with
+    :meth:`init_worker`.
+
     """
     config: Configurable = field()
-    """The application context configuration used to create the parent stash.
+    """The application context configuration used to create the parent stash,
+    or ``None`` to use the stash created by :meth:`init_worker`.
 
     """
     name: str = field()
@@ -40,6 +64,24 @@ class ChunkProcessor(object):
     data: object = field()
     """The data created by the parent to be processed."""
 
+    journal: ChunkJournal = field(default=None)
+    """Records the completion of the chunk when not ``None``."""
+
+    ranges: List[Tuple[int, int]] = field(default=None)
+    """The ranges of indexes of :obj:`data` in the data created by the parent,
+    which are recorded in the :obj:`journal`.
+
+    """
+    shared_memory: bool = field(default=False)
+    """Whether to return the items in shared memory to be persisted by the
+    parent rather than persisting them with the child stash's delegate.
+
+    """
+    def _complete(self, cnt: int):
+        """Called after the items of the chunk are persisted."""
+        if self.journal is not None:
+            self.journal.complete(self.chunk_id, self.ranges, cnt)
+
     def _create_stash(self) -> Tuple[ImportConfigFactory, Any]:
         fac = ImportConfigFactory(self.config)
         with time(f'factory inst {self.name} for chunk {self.chunk_id}',
@@ -48,28 +90,89 @@ class ChunkProcessor(object):
             inst.is_child = True
             return fac, inst
 
-    def process(self) -> int:
+    @staticmethod
+    def init_worker(config: Configurable, name: str):
+        """Create the factory and stash in a worker process, which are used by
+        the chunk processors without a :obj:`config` this process receives.
+        This is used as the :class:`multiprocessing.Pool` initializer.
+
+        """
+        proc = ChunkProcessor(config, name, -1, None)
+        factory, stash = proc._create_stash()
+        proc.config_factory = factory
+        stash._init_child(proc)
+        ChunkProcessor._WORKER_STASHES[name] = (factory, stash)
+        Finalize(None, ChunkProcessor._deallocate_worker, args=(name,),
+                 exitpriority=10)
+
+    @staticmethod
+    def _deallocate_worker(name: str):
+        factory, stash = ChunkProcessor._WORKER_STASHES.pop(name)
+        Deallocatable._try_deallocate(stash)
+        Deallocatable._try_deallocate(factory)
+
+    def detach(self) -> 'ChunkProcessor':
+        """Return a copy without the configuration, which is processed by the
+        stash created in :meth:`init_worker`.
+
+        """
+        return dataclasses.replace(self, config=None)
+
+    def process(self, stash: Any = None) -> \
+            Union[int, SharedMemoryResult]:
         """Create the stash used to process the data, then persisted in the
         stash.
 
+        :param stash: the stash used to process the data rather than creating
+                      it from the configuration, which is used by processors
+                      that do the work in the parent process
+
+        :return: the number of items processed, or the items in shared memory
+                 if :obj:`shared_memory` is ``True``
+
         """
-        factory, stash = self._create_stash()
+        worker: Tuple[ImportConfigFactory, Any] = None
+        if stash is not None:
+            worker = (None, stash)
+        elif self.config is None:
+            worker = self._WORKER_STASHES.get(self.name)
+            if worker is None:
+                raise APIError(
+                    f'No worker stash {self.name} for chunk {self.chunk_id}')
+            factory, stash = worker
+        else:
+            factory, stash = self._create_stash()
+            self.config_factory = factory
+            stash._init_child(self)
         cnt = 0
-        self.config_factory = factory
-        stash._init_child(self)
         if logger.isEnabledFor(logging.INFO):
             logger.info(f'processing chunk {self.chunk_id} ' +
                         f'with stash {stash.__class__}')
-        with time('processed {cnt} items for chunk {self.chunk_id}'):
-            for i, (id, inst) in enumerate(stash._process(self.data)):
+
+        def items() -> Iterable[Tuple[str, Any]]:
+            nonlocal cnt
+            for id, inst in stash._process(self.data):
                 if logger.isEnabledFor(logging.DEBUG):
                     logger.debug(f'dumping {id} -> {inst.__class__}')
-                stash.delegate.dump(id, inst)
+                yield (id, inst)
+                # the delegate has persisted the item when the next is asked
                 Deallocatable._try_deallocate(inst)
                 cnt += 1
-        Deallocatable._try_deallocate(stash)
-        Deallocatable._try_deallocate(factory)
-        return cnt
+
+        res: Union[int, SharedMemoryResult]
+        if self.shared_memory:
+            with time('shared {cnt} items for chunk {self.chunk_id}'):
+                res = SharedMemoryResult.create(
+                    items(), self.chunk_id, self.ranges)
+        else:
+            with time('processed {cnt} items for chunk {self.chunk_id}'):
+                stash.delegate.dump_many(items())
+            self._complete(cnt)
+            res = cnt
+        if worker is None:
+            Deallocatable._try_deallocate(stash)
+            Deallocatable._try_deallocate(factory)
+        return res
 
     def __str__(self):
         data = self.data
@@ -89,29 +192,122 @@ class MultiProcessor(object, metaclass=ABCMeta):
     is to be processed is needed.
 
     .. automethod:: _process_work
+    .. automethod:: _create_chunks
 
     """
     name: str = field()
     """The name of the multi-processor."""
 
+    stash: 'MultiProcessStash' = field(default=None, init=False, repr=False)
+    """The (parent) stash that invokes the work, which is set by
+    :class:`.MultiProcessStash` before the work is invoked.
+
+    """
+    stats: MultiProcessStats = field(default=None, init=False, repr=False)
+    """The statistics of the last invocation of :meth:`invoke_work`."""
+
+    data_size: int = field(default=None, init=False, repr=False)
+    """The number of items of data to process, or ``None`` if not known, which
+    is set by :class:`.MultiProcessStash` before the work is invoked.
+
+    """
+    split_evenly: bool = field(default=False, init=False, repr=False)
+    """Whether to split data of a known :obj:`data_size` evenly across the
+    workers, which is set by :class:`.MultiProcessStash` when its
+    ``chunk_size`` is 0.
+
+    """
+    def _create_chunks(self, data: Iterable[Any], chunk_size: int,
+                       workers: int) -> Iterable[List[Any]]:
+        """Group the data created by the stash in to the chunks given to each
+        :class:`.ChunkProcessor`.  The chunks are created lazily as the
+        returned iterable is consumed by :meth:`_invoke_work`.  When
+        :obj:`split_evenly` is set, the :obj:`data_size` is known and there is
+        no more data than one chunk per worker, the data is split evenly across
+        the workers.
+
+        :param data: the data created by
+                     :meth:`.MultiProcessStash._create_data`
+
+        :param chunk_size: the size of each chunk
+
+        :param workers: the number of processes doing the work
+
+        """
+        size: int = self.data_size
+        if self.split_evenly and size is not None and \
+                size <= chunk_size * workers:
+            return split_chunks(data, size, max(1, min(workers, size)))
+        return chunks(data, chunk_size)
+
     @staticmethod
-    def _process_work(processor: ChunkProcessor) -> int:
+    def _process_work(processor: ChunkProcessor) -> ChunkStats:
         """Process a chunk of data in the child process that was created by the
         parent process.
 
+        :return: the statistics of the chunk with the result of
+                 :meth:`.ChunkProcessor.process`
+
         """
         if logger.isEnabledFor(logging.DEBUG):
             logger.info(f'processing processor {processor}')
         with time(f'processed processor {processor}'):
-            return processor.process()
+            return ChunkStats.measure(processor)
+
+    def _receive(self, result: Union[int, SharedMemoryResult, ChunkStats]) \
+            -> int:
+        """Add the statistics of a processed chunk to :obj:`stats`, and persist
+        the items a child process returned in shared memory with the delegate
+        of :obj:`stash`.
+
+        :param result: the result of :meth:`_process_work`
+
+        :return: the number of items processed by the child
+
+        """
+        stats: ChunkStats = None
+        if isinstance(result, ChunkStats):
+            stats, result = result, result.result
+            stats.result = None
+        if isinstance(result, SharedMemoryResult):
+            stash: MultiProcessStash = self.stash
+            stash.delegate.dump_many(result.load())
+            cnt: int = len(result)
+            journal: ChunkJournal = stash.journal
+            if journal is not None and result.ranges is not None:
+                journal.complete(result.chunk_id, result.ranges, cnt)
+            result = cnt
+        if stats is not None:
+            stats.items = result
+            if self.stats is not None:
+                self.stats.chunks.append(stats)
+        return result
+
+    def _cap_workers(self, workers: int) -> int:
+        """Return the number of workers to use given the number requested by
+        the stash.
+
+        """
+        return workers
 
     def invoke_work(self, workers: int, chunk_size: int,
                     data: Iterable[Any]) -> int:
         fn: Callable = self.__class__._process_work
+        workers = self._cap_workers(workers)
         if logger.isEnabledFor(logging.INFO):
             logger.info(f'{self.name}: spawning work in {type(self)} with ' +
                         f'chunk size {chunk_size} across {workers} workers')
-        return self._invoke_work(workers, chunk_size, data, fn)
+        stats = MultiProcessStats(self.name, workers, chunk_size)
+        self.stats = stats
+        try:
+            return self._invoke_work(workers, chunk_size, data, fn)
+        finally:
+            stats.end = tm.time()
+            if logger.isEnabledFor(logging.INFO):
+                logger.info(f'{self.name}: processed {stats.items} items in ' +
+                            f'{len(stats.chunks)} chunks in ' +
+                            f'{stats.duration:.2f}s ' +
+                            f'({stats.throughput:.2f} items/s)')
 
     @abstractmethod
     def _invoke_work(self, workers: int, chunk_size: int,
@@ -119,28 +315,316 @@ class MultiProcessor(object, metaclass=ABCMeta):
         pass
 
 
+@dataclass
 class PoolMultiProcessor(MultiProcessor):
     """Uses :class:`multiprocessing.Pool` to fork/exec processes to do the work.
 
     """
+    reuse_stash: bool = field(default=False)
+    """Whether each pool process creates the application configuration factory
+    and stash once, and uses them for all the chunks it processes.
+    Otherwise, they are created for each chunk, and the configuration is
+    pickled with each chunk.  When ``True``,
+    :meth:`.MultiProcessStash._init_child` is called once for each process.
+
+    """
+    shared_memory: bool = field(default=False)
+    """Whether the child processes return their items to the parent in shared
+    memory (see :class:`.SharedMemoryResult`) to be persisted by the parent
+    stash's delegate.  This is useful for delegates that keep items in the
+    memory of the parent process, such as a
+    :class:`~zensols.persist.DictionaryStash`.
+
+    """
+    maxtasksperchild: int = field(default=None)
+    """The number of chunks a worker process processes before it is replaced by
+    a new process, or ``None`` to keep the processes for all the work.  This
+    frees memory leaked by processing chunks, such as by C extensions or caches
+    of objects created by the application context.
+
+    """
+    worker_memory: int = field(default=None)
+    """The number of bytes of memory each worker process is expected to use.
+    When set, the number of workers is limited to the memory available when
+    the work is started divided by this number.
+
+    """
+    def _cap_workers(self, workers: int) -> int:
+        if self.worker_memory is not None and workers > 1:
+            avail: int = available_memory()
+            if avail is not None:
+                cap: int = max(1, avail // self.worker_memory)
+                if cap < workers:
+                    if logger.isEnabledFor(logging.INFO):
+                        logger.info(
+                            f'{self.name}: limiting {workers} workers to ' +
+                            f'{cap} given {avail} bytes of available memory')
+                    workers = cap
+        return workers
+
+    def _create_pool(self, workers: int, initializer: Callable = None,
+                     initargs: Tuple[Any, ...] = ()) -> Pool:
+        """Create the pool of worker processes, which is recreated with the
+        same arguments by :meth:`_recycle_pool`.
+
+        """
+        self._pool_args = (workers, initializer, initargs)
+        return Pool(workers, initializer=initializer, initargs=initargs,
+                    maxtasksperchild=self.maxtasksperchild)
+
+    def _recycle_pool(self, pool: Pool) -> Pool:
+        """Wait for the workers of ``pool`` to exit after their work is done
+        and return a new pool with new worker processes.
+
+        """
+        pool.close()
+        pool.join()
+        return self._create_pool(*self._pool_args)
+
+    def _share_memory(self, processor: ChunkProcessor) -> ChunkProcessor:
+        processor.shared_memory = True
+        return processor
+
     def _invoke_pool(self, pool: Pool, fn: Callable, data: iter) -> List[int]:
         if pool is None:
-            return tuple(map(fn, data))
+            return tuple(map(self._receive, map(fn, data)))
+        elif self.shared_memory:
+            # persist each chunk's items as it completes
+            return list(map(self._receive, pool.imap(fn, data)))
         else:
-            return pool.map(fn, data)
+            # send chunks one at a time to count them as tasks per child
+            chunksize: int = None if self.maxtasksperchild is None else 1
+            return list(map(self._receive,
+                            pool.map(fn, data, chunksize=chunksize)))
+
+    def _invoke_reuse(self, workers: int, fn: Callable,
+                      data: Iterable[ChunkProcessor]) -> List[int]:
+        data = iter(data)
+        first: ChunkProcessor = next(data, None)
+        if first is None:
+            return []
+        data = map(ChunkProcessor.detach, it.chain((first,), data))
+        with self._create_pool(workers, ChunkProcessor.init_worker,
+                               (first.config, first.name)) as p:
+            with time('processed chunks'):
+                cnt = self._invoke_pool(p, fn, data)
+            # let the workers exit to deallocate their stashes
+            p.close()
+            p.join()
+        return cnt
 
     def _invoke_work(self, workers: int, chunk_size: int,
                      data: Iterable[Any], fn: Callable) -> int:
+        if self.shared_memory:
+            data = map(self._share_memory, data)
         if workers == 1:
             with time('processed singleton chunk'):
                 cnt = self._invoke_pool(None, fn, data)
+        elif self.reuse_stash:
+            cnt = self._invoke_reuse(workers, fn, data)
         else:
-            with Pool(workers) as p:
+            with self._create_pool(workers) as p:
                 with time('processed chunks'):
                     cnt = self._invoke_pool(p, fn, data)
         return cnt
 
 
+@dataclass
+class StreamingPoolMultiProcessor(PoolMultiProcessor):
+    """Like :class:`.PoolMultiProcessor`, but chunks are created and sent to
+    the pool only as others complete rather than all at once.  At most
+    :obj:`window` chunks are queued or processed at a time, so the memory of
+    the parent process stays flat regardless of how much data
+    :meth:`.MultiProcessStash._create_data` generates (given a non-zero
+    chunk size).  Progress is logged as each chunk completes.
+
+    .. automethod:: _chunk_complete
+
+    """
+    window: int = field(default=None)
+    """The maximum number of chunks in flight, which defaults to twice the
+    number of workers.
+
+    """
+    max_worker_rss: int = field(default=None)
+    """The peak resident set size in bytes of a worker process after which
+    the pool is recycled, or ``None`` to not recycle by memory.  When a worker
+    reports more, no more chunks are sent until those in flight complete, and
+    then the processes are replaced with a new pool.
+
+    """
+    def _chunk_complete(self, completed: int, items: int):
+        """Called in the parent process after each chunk completes.
+
+        :param completed: the number of chunks completed so far
+
+        :param items: the number of items processed so far
+
+        """
+        if logger.isEnabledFor(logging.INFO):
+            logger.info(f'{self.name}: completed {completed} chunks ' +
+                        f'with {items} items')
+
+    def _invoke_pool(self, pool: Pool, fn: Callable, data: iter) -> List[int]:
+        if pool is None:
+            return super()._invoke_pool(pool, fn, data)
+        window: int = self.window
+        if window is None:
+            window = 2 * self._workers
+        results: Queue = Queue()
+        cnts: List[int] = []
+        items: int = 0
+        inflight: int = 0
+        max_rss: int = self.max_worker_rss
+        recycle: bool = False
+        # pools created by recycling, which are not managed by the caller
+        created: List[Pool] = []
+
+        def wait():
+            nonlocal items, inflight, recycle
+            res: Union[ChunkStats, BaseException] = results.get()
+            inflight -= 1
+            if isinstance(res, BaseException):
+                raise res
+            if max_rss is not None and isinstance(res, ChunkStats) and \
+                    res.max_rss is not None and res.max_rss > max_rss:
+                if logger.isEnabledFor(logging.INFO):
+                    logger.info(f'{self.name}: worker {res.worker} RSS ' +
+                                f'{res.max_rss} exceeds {max_rss}')
+                recycle = True
+            res = self._receive(res)
+            cnts.append(res)
+            items += res
+            self._chunk_complete(len(cnts), items)
+
+        try:
+            for processor in data:
+                while inflight >= window:
+                    wait()
+                if recycle:
+                    while inflight > 0:
+                        wait()
+                    if logger.isEnabledFor(logging.INFO):
+                        logger.info(f'{self.name}: recycling worker processes')
+                    pool = self._recycle_pool(pool)
+                    created.append(pool)
+                    recycle = False
+                pool.apply_async(fn, (processor,), callback=results.put,
+                                 error_callback=results.put)
+                inflight += 1
+            while inflight > 0:
+                wait()
+            if len(created) > 0:
+                # let the workers of the last pool exit to deallocate
+                pool.close()
+                pool.join()
+        finally:
+            for pool in created:
+                pool.terminate()
+        return cnts
+
+    def _invoke_work(self, workers: int, chunk_size: int,
+                     data: Iterable[Any], fn: Callable) -> int:
+        self._workers = workers
+        return super()._invoke_work(workers, chunk_size, data, fn)
+
+
+@dataclass
+class AdaptivePoolMultiProcessor(StreamingPoolMultiProcessor):
+    """Like :class:`.StreamingPoolMultiProcessor`, but the size of each chunk
+    is chosen as it is created rather than fixed, which shortens the time the
+    pool waits on the last (slowest) workers when items vary in processing
+    time.  The stash's ``chunk_size`` is used as the largest chunk size.
+
+    Chunks start at :obj:`min_chunk_size` and grow (no more than doubling each
+    time) or shrink so each takes about :obj:`target_seconds` given the rate
+    items are processed per worker so far.  When the size of the data is known
+    (such as a stash ``chunk_size`` of 0), chunks are also limited by guided
+    self-scheduling, which is the number of items left divided by
+    :obj:`guide_factor` times the number of workers.  This makes chunks
+    smaller as the work runs out so workers finish at about the same time.
+
+    """
+    min_chunk_size: int = field(default=1)
+    """The smallest chunk size, which is also the size of the first chunks."""
+
+    target_seconds: float = field(default=2.)
+    """The number of seconds each chunk should take to process."""
+
+    guide_factor: float = field(default=2.)
+    """The number of chunks per worker of the remaining items used in guided
+    self-scheduling.
+
+    """
+    timer: Callable[[], float] = field(default=tm.monotonic)
+    """Returns the current time in seconds."""
+
+    def __post_init__(self):
+        self._start: float = None
+        self._items: int = 0
+
+    def _chunk_complete(self, completed: int, items: int):
+        self._items = items
+        super()._chunk_complete(completed, items)
+
+    def _next_chunk_size(self, last: int, max_size: int, workers: int,
+                         remaining: int) -> int:
+        """Return the size of the next chunk.
+
+        :param last: the size of the last chunk created
+
+        :param max_size: the largest chunk size
+
+        :param workers: the number of processes doing the work
+
+        :param remaining: the number of items left to chunk or ``None`` if not
+                          known
+
+        """
+        size: float = max_size
+        if self._items > 0:
+            elapsed: float = self.timer() - self._start
+            # seconds to process an item by each (busy) worker
+            per_item: float = (elapsed * workers) / self._items
+            if per_item > 0:
+                size = min(size, self.target_seconds / per_item)
+            size = min(size, 2 * last)
+        else:
+            size = self.min_chunk_size
+        if remaining is not None:
+            size = min(size, remaining / (self.guide_factor * workers))
+        return max(self.min_chunk_size, math.ceil(size))
+
+    def _create_chunks(self, data: Iterable[Any], chunk_size: int,
+                       workers: int) -> Iterable[List[Any]]:
+        if workers == 1:
+            return super()._create_chunks(data, chunk_size, workers)
+        return self._adapt_chunks(data, chunk_size, workers)
+
+    def _adapt_chunks(self, data: Iterable[Any], chunk_size: int,
+                      workers: int) -> Iterable[List[Any]]:
+        remaining: int = self.data_size
+        if remaining is None and hasattr(data, '__len__'):
+            remaining = len(data)
+        data = iter(data)
+        size: int = self.min_chunk_size
+        while True:
+            size = self._next_chunk_size(size, chunk_size, workers, remaining)
+            chunk: List[Any] = list(it.islice(data, size))
+            if len(chunk) == 0:
+                break
+            if remaining is not None:
+                remaining -= len(chunk)
+            if logger.isEnabledFor(logging.DEBUG):
+                logger.debug(f'{self.name}: created chunk of size {len(chunk)}')
+            yield chunk
+
+    def _invoke_pool(self, pool: Pool, fn: Callable, data: iter) -> List[int]:
+        self._start = self.timer()
+        self._items = 0
+        return super()._invoke_pool(pool, fn, data)
+
+
 class SingleMultiProcessor(PoolMultiProcessor):
     """Does all work in the current process.
 
@@ -150,6 +634,115 @@ class SingleMultiProcessor(PoolMultiProcessor):
         return super()._invoke_work(1, chunk_size, data, fn)
 
 
+@dataclass
+class ThreadPoolMultiProcessor(MultiProcessor):
+    """Processes chunks in a pool of threads in the current process rather
+    than forking processes.  This is better suited to I/O bound stashes, such
+    as those that read remote mounted files or call a server, since the
+    processes need not be forked nor the application context recreated.
+
+    All chunks are processed by the parent stash, so its
+    :meth:`~.MultiProcessStash._process` and the ``dump_many`` method of its
+    delegate must be thread safe.
+
+    """
+    def _process_chunk(self, processor: ChunkProcessor) -> ChunkStats:
+        with time(f'processed processor {processor}'):
+            return ChunkStats.measure(processor, self.stash)
+
+    def _invoke_work(self, workers: int, chunk_size: int,
+                     data: Iterable[Any], fn: Callable) -> int:
+        with ThreadPoolExecutor(workers, thread_name_prefix=self.name) as ex:
+            with time('processed chunks'):
+                return list(map(self._receive,
+                                ex.map(self._process_chunk, data)))
+
+
+@dataclass
+class AsyncioMultiProcessor(MultiProcessor):
+    """Processes chunks as :mod:`asyncio` tasks in the current process, with at
+    most the number of workers processed at once.  Each chunk is created only
+    when another completes, so the chunks are not all held in memory.  Like
+    :class:`.ThreadPoolMultiProcessor`, the parent stash processes all chunks.
+
+    If the stash has a ``_process_async`` method, it is used to process each
+    chunk.  It takes the same parameter and yields the same ``(key, data)``
+    tuples as :meth:`~.MultiProcessStash._process`, but is an asynchronous
+    generator so the I/O of all chunks overlaps in one thread.  Otherwise,
+    :meth:`~.MultiProcessStash._process` is called in a thread for each chunk.
+    In both cases, the delegate persists the items in a thread.
+
+    When the work is invoked from a running event loop, such as in a Jupyter
+    notebook, the chunks are processed by an event loop in a new thread.
+
+    """
+    async def _process_chunk(self, processor: ChunkProcessor,
+                             executor: ThreadPoolExecutor) -> ChunkStats:
+        loop: asyncio.AbstractEventLoop = asyncio.get_running_loop()
+        stash: MultiProcessStash = self.stash
+        process: Callable = getattr(stash, '_process_async', None)
+        if process is None:
+            return await loop.run_in_executor(
+                executor, ChunkStats.measure, processor, stash)
+        start: float = tm.time()
+        if logger.isEnabledFor(logging.INFO):
+            logger.info(f'processing chunk {processor.chunk_id} ' +
+                        f'with stash {stash.__class__}')
+        items: List[Tuple[str, Any]] = []
+        item: Tuple[str, Any]
+        async for item in process(processor.data):
+            items.append(item)
+        await loop.run_in_executor(
+            executor, stash.delegate.dump_many, items)
+        processor._complete(len(items))
+        for _, inst in items:
+            Deallocatable._try_deallocate(inst)
+        return ChunkStats(processor.chunk_id, os.getpid(),
+                          f'task-{processor.chunk_id}', start, tm.time(),
+                          result=len(items))
+
+    async def _invoke_async(self, workers: int,
+                            data: Iterable[ChunkProcessor]) -> List[int]:
+        results: List[int] = []
+        pending: Set[asyncio.Task] = set()
+        chunks: Iterator[ChunkProcessor] = iter(data)
+        with ThreadPoolExecutor(workers, thread_name_prefix=self.name) as ex:
+            try:
+                while True:
+                    # create the next chunks only as tasks complete so at most
+                    # the number of workers are in memory at once
+                    processor: ChunkProcessor
+                    for processor in it.islice(chunks, workers - len(pending)):
+                        pending.add(asyncio.create_task(
+                            self._process_chunk(processor, ex)))
+                    if len(pending) == 0:
+                        break
+                    done: Set[asyncio.Task]
+                    done, pending = await asyncio.wait(
+                        pending, return_when=asyncio.FIRST_COMPLETED)
+                    task: asyncio.Task
+                    for task in done:
+                        results.append(self._receive(task.result()))
+            finally:
+                for task in pending:
+                    task.cancel()
+        return results
+
+    def _invoke_work(self, workers: int, chunk_size: int,
+                     data: Iterable[Any], fn: Callable) -> int:
+        with time('processed chunks'):
+            try:
+                asyncio.get_running_loop()
+            except RuntimeError:
+                return asyncio.run(self._invoke_async(workers, data))
+            # called from a running event loop (i.e. Jupyter), and only one
+            # loop can run in each thread
+            with ThreadPoolExecutor(
+                    1, thread_name_prefix=f'{self.name}-loop') as ex:
+                return ex.submit(
+                    asyncio.run, self._invoke_async(workers, data)).result()
+
+
 @dataclass
 class MultiProcessStash(PrimablePreemptiveStash, metaclass=ABCMeta):
     """A stash that forks processes to process data in a distributed fashion.
@@ -176,6 +769,7 @@ class MultiProcessStash(PrimablePreemptiveStash, metaclass=ABCMeta):
 
     .. document private functions
     .. automethod:: _create_data
+    .. automethod:: _data_size
     .. automethod:: _process
     .. automethod:: _create_chunk_processor
 
@@ -200,7 +794,11 @@ class MultiProcessStash(PrimablePreemptiveStash, metaclass=ABCMeta):
     in some cases the child process will get a chunk of data smaller than this
     (the last) but never more; if this number is 0, then evenly divide the work
     so that each worker takes the largets amount of work to minimize the number
-    of chunks (in this case the data is tupleized).
+    of chunks.  The data is tupleized in this case only if its size is not
+    given by :meth:`_data_size` or its length (see
+    :func:`operator.length_hint`).
+    This is the largest chunk size when using an
+    :class:`.AdaptivePoolMultiProcessor`.
 
     """
     workers: Union[int, float] = field()
@@ -214,15 +812,58 @@ class MultiProcessStash(PrimablePreemptiveStash, metaclass=ABCMeta):
 
     """
     processor_class: Type[MultiProcessor] = field(init=False)
-    """The class of the processor to use for the handling of the work."""
+    """The class of the processor to use for the handling of the work, such as
+    :class:`.ThreadPoolMultiProcessor` for I/O bound work.
+
+    """
+
+    processor_params: Dict[str, Any] = field(init=False)
+    """The keyword arguments given to the initializer of
+    :obj:`processor_class`, such as the ``window`` of a
+    :class:`.StreamingPoolMultiProcessor`.
+
+    """
+    checkpoint_path: Path = field(init=False)
+    """The file of the :class:`.ChunkJournal` used to resume work where it
+    stopped, or ``None`` to not keep a journal.  When the journal shows
+    unfinished work and the delegate has data, :meth:`prime` processes only
+    the data of chunks that were not completed.  This requires
+    :meth:`_create_data` to create data in the same order each time.
+
+    """
+    metrics_path: Path = field(init=False)
+    """The file to which the :obj:`stats` are written after the work is done
+    (see :meth:`.MultiProcessStats.write_report`), or ``None`` to not write
+    them.
 
+    """
     def __post_init__(self):
         super().__post_init__()
         self.is_child = False
+        # sub classes like `MultiProcessDefaultStash` add these as fields,
+        # which will already be set by the time this is called
         if not hasattr(self, 'processor_class'):
-            # sub classes like `MultiProcessDefaultStash` add this as a field,
-            # which will already be set by the time this is called
             self.processor_class: Type[MultiProcessor] = None
+        if not hasattr(self, 'processor_params'):
+            self.processor_params: Dict[str, Any] = None
+        if not hasattr(self, 'checkpoint_path'):
+            self.checkpoint_path: Path = None
+        if not hasattr(self, 'metrics_path'):
+            self.metrics_path: Path = None
+        self.stats: MultiProcessStats = None
+        """The statistics of the chunks processed by the last invocation of
+        the work in this process, or ``None`` if no work was done.
+
+        """
+
+    @property
+    def journal(self) -> ChunkJournal:
+        """The checkpoint journal, or ``None`` if :obj:`checkpoint_path` is not
+        set.
+
+        """
+        if self.checkpoint_path is not None:
+            return ChunkJournal(self.checkpoint_path)
 
     @abstractmethod
     def _create_data(self) -> Iterable[Any]:
@@ -235,6 +876,16 @@ class MultiProcessStash(PrimablePreemptiveStash, metaclass=ABCMeta):
         """
         pass
 
+    def _data_size(self) -> Optional[int]:
+        """Return the number of items :meth:`_create_data` creates without
+        creating them, or ``None`` if not known.  This is used to evenly divide
+        the work when :obj:`chunk_size` is 0 and the data has no length, such
+        as keys generated from a large listing or database cursor, so the data
+        is chunked as it is created rather than tupleized first.
+
+        """
+        return None
+
     @abstractmethod
     def _process(self, chunk: List[Any]) -> Iterable[Tuple[str, Any]]:
         """Process a chunk of data, each created by ``_create_data`` as a group
@@ -291,16 +942,43 @@ class MultiProcessStash(PrimablePreemptiveStash, metaclass=ABCMeta):
             self._debug(f'creating chunk processor for id {chunk_id}')
         return ChunkProcessor(self.config, self.name, chunk_id, data)
 
-    def _spawn_work(self) -> int:
+    def _create_journaled_processors(
+            self, journal: ChunkJournal,
+            chunks: Iterable[List[Tuple[int, Any]]]) -> \
+            Iterable[ChunkProcessor]:
+        """Create chunk processors that record their chunks in the journal.
+
+        :param chunks: chunks of data paired with their index
+
+        """
+        chunk_id: int
+        chunk: List[Tuple[int, Any]]
+        for chunk_id, chunk in enumerate(chunks):
+            ranges: List[Tuple[int, int]] = journal.to_ranges(
+                map(lambda t: t[0], chunk))
+            proc: ChunkProcessor = self._create_chunk_processor(
+                chunk_id, list(map(lambda t: t[1], chunk)))
+            proc.journal = journal
+            proc.ranges = ranges
+            journal.assign(chunk_id, ranges)
+            yield proc
+
+    def _spawn_work(self, resume: bool = False) -> int:
         """Chunks and invokes a multiprocessing pool to invokes processing on
         the children.
 
+        :param resume: whether to skip the data of chunks completed in the
+                       :obj:`journal`
+
         """
         multi_proc: MultiProcessor
+        params: Dict[str, Any] = self.processor_params
+        params = {} if params is None else params
         if self.processor_class is None:
-            multi_proc = PoolMultiProcessor(self.name)
+            multi_proc = PoolMultiProcessor(self.name, **params)
         else:
-            multi_proc = self.processor_class(self.name)
+            multi_proc = self.processor_class(self.name, **params)
+        multi_proc.stash = self
         chunk_size, workers = self.chunk_size, self.workers
         if workers <= 0:
             workers = os.cpu_count() + workers
@@ -311,13 +989,50 @@ class MultiProcessStash(PrimablePreemptiveStash, metaclass=ABCMeta):
             if logger.isEnabledFor(logging.DEBUG):
                 logger.debug(f'calculating as {percent} of ' +
                              f'total {avail}: {workers}')
+        journal: ChunkJournal = self.journal
+        completed: CompletedIndexes = None
         data = self._create_data()
+        size: int = self._data_size()
+        if size is None:
+            size = operator.length_hint(data, -1)
+            size = None if size < 0 else size
+        if journal is not None:
+            # pair data with its index to identify it in the journal
+            if resume:
+                completed = journal.resume()
+                data = filter(lambda t: t[0] not in completed,
+                              enumerate(data))
+                if size is not None:
+                    size = max(0, size - len(completed))
+            else:
+                journal.clear()
+                data = enumerate(data)
+        multi_proc.split_evenly = chunk_size == 0
         if chunk_size == 0:
-            data = tuple(data)
-            chunk_size = math.ceil(len(data) / workers)
-        data = map(lambda x: self._create_chunk_processor(*x),
-                   enumerate(chunks(data, chunk_size)))
-        return multi_proc.invoke_work(workers, chunk_size, data)
+            if size is None:
+                if logger.isEnabledFor(logging.INFO):
+                    logger.info(f'{self.name}: creating all data to size ' +
+                                'chunks since its size is not known')
+                data = tuple(data)
+                size = len(data)
+            chunk_size = max(1, math.ceil(size / workers))
+        multi_proc.data_size = size
+        chunked: Iterable[List[Any]] = multi_proc._create_chunks(
+            data, chunk_size, workers)
+        if journal is None:
+            data = map(lambda x: self._create_chunk_processor(*x),
+                       enumerate(chunked))
+        else:
+            data = self._create_journaled_processors(journal, chunked)
+        try:
+            cnt = multi_proc.invoke_work(workers, chunk_size, data)
+        finally:
+            self.stats = multi_proc.stats
+            if self.metrics_path is not None and self.stats is not None:
+                self.stats.write_report(self.metrics_path)
+        if journal is not None:
+            journal.finish()
+        return cnt
 
     def prime(self):
         """If the delegate stash data does not exist, use this implementation to
@@ -328,9 +1043,23 @@ class MultiProcessStash(PrimablePreemptiveStash, metaclass=ABCMeta):
         if logger.isEnabledFor(logging.DEBUG):
             self._debug(f'multi prime, is child: {self.is_child}')
         has_data = self.has_data
+        journal: ChunkJournal = self.journal
+        # resume unfinished work, but start over if the data was removed
+        resume: bool = has_data and journal is not None and \
+            journal.exists and not journal.is_finished
         if logger.isEnabledFor(logging.DEBUG):
-            self._debug(f'has data: {has_data}')
-        if not has_data:
-            with time('completed work in {self.__class__.__name__}'):
-                self._spawn_work()
-            self._reset_has_data()
+            self._debug(f'has data: {has_data}, resume: {resume}')
+        if not has_data or resume:
+            try:
+                with time('completed work in {self.__class__.__name__}'):
+                    self._spawn_work(resume)
+            finally:
+                # recompute after failures so the work is resumed rather than
+                # started over
+                self._reset_has_data()
+
+    def clear(self):
+        super().clear()
+        journal: ChunkJournal = self.journal
+        if journal is not None:
+            journal.clear()
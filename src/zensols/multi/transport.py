@@ -0,0 +1,162 @@
+"""Transport of items from child processes to the parent in shared memory.
+
+"""
+__author__ = 'Paul Landes'
+
+from typing import Any, List, Tuple, Iterable, ClassVar
+from dataclasses import dataclass, field
+import logging
+import pickle
+import mmap
+from pathlib import Path
+from multiprocessing import resource_tracker
+from multiprocessing.shared_memory import SharedMemory
+
+logger = logging.getLogger(__name__)
+
+
+@dataclass
+class SharedMemoryResult(object):
+    """The items of a chunk pickled by a child process in to a
+    :class:`multiprocessing.shared_memory.SharedMemory` segment, which is
+    returned to the parent in place of the count of items.  Only the name of
+    the segment and the offsets of the items are pickled through the pool.
+
+    Items are pickled with protocol 5, so the data of contiguous buffers, such
+    as Numpy arrays, are written out-of-band and are views of the segment in
+    the parent rather than copies (where POSIX shared memory is mounted at
+    ``/dev/shm``).  The segment is removed by the parent when the items are
+    loaded, and its memory is freed when the loaded items are no longer
+    referenced.  A segment is left in shared memory if the parent exits before
+    loading it.
+
+    """
+    ALIGNMENT: ClassVar[int] = 64
+    """The byte alignment of the data in the segment."""
+
+    SHM_PATH: ClassVar[Path] = Path('/dev/shm')
+    """Where segments are mapped as files when it exists, which allows them to
+    be unlinked while in use.
+
+    """
+    name: str = field()
+    """The name of the segment, or ``None`` for a chunk with no items."""
+
+    entries: Tuple[Tuple[str, int, int, Tuple[Tuple[int, int], ...]], ...] = \
+        field()
+    """The key, offset and length of each item's pickle data, and the offset
+    and length of each of its out-of-band buffers.
+
+    """
+    chunk_id: int = field(default=None)
+    """The ID of the chunk with the items."""
+
+    ranges: List[Tuple[int, int]] = field(default=None)
+    """The ranges of indexes of the chunk's data recorded in a
+    :class:`~zensols.multi.journal.ChunkJournal`.
+
+    """
+    @classmethod
+    def _align(cls, n: int) -> int:
+        return -(-n // cls.ALIGNMENT) * cls.ALIGNMENT
+
+    @staticmethod
+    def _create_segment(size: int) -> SharedMemory:
+        try:
+            return SharedMemory(create=True, size=size, track=False)
+        except TypeError:
+            # before Python 3.13, keep the child's resource tracker from
+            # removing the segment before the parent loads it
+            shm = SharedMemory(create=True, size=size)
+            resource_tracker.unregister(shm._name, 'shared_memory')
+            return shm
+
+    @classmethod
+    def create(cls, items: Iterable[Tuple[str, Any]], chunk_id: int = None,
+               ranges: List[Tuple[int, int]] = None) -> \
+            'SharedMemoryResult':
+        """Pickle items in to a new shared memory segment.
+
+        :param items: the ``(key, item)`` tuples to pickle
+
+        :param chunk_id: the ID of the chunk with the items
+
+        :param ranges: the ranges of indexes of the chunk's data
+
+        """
+        entries: List[Tuple[str, int, int, Tuple[Tuple[int, int], ...]]] = []
+        payloads: List[Tuple[bytes, List[memoryview]]] = []
+        size: int = 0
+        name: str
+        inst: Any
+        for name, inst in items:
+            bufs: List[pickle.PickleBuffer] = []
+            data: bytes = pickle.dumps(
+                inst, protocol=5, buffer_callback=bufs.append)
+            raws: List[memoryview] = list(map(lambda b: b.raw(), bufs))
+            offset: int = size
+            size = cls._align(size + len(data))
+            boffs: List[Tuple[int, int]] = []
+            raw: memoryview
+            for raw in raws:
+                boffs.append((size, raw.nbytes))
+                size = cls._align(size + raw.nbytes)
+            entries.append((name, offset, len(data), tuple(boffs)))
+            payloads.append((data, raws))
+        if len(entries) == 0:
+            return cls(None, (), chunk_id, ranges)
+        shm: SharedMemory = cls._create_segment(size)
+        try:
+            buf: memoryview = shm.buf
+            entry: Tuple[str, int, int, Tuple[Tuple[int, int], ...]]
+            for entry, (data, raws) in zip(entries, payloads):
+                buf[entry[1]:entry[1] + entry[2]] = data
+                for (boff, blen), raw in zip(entry[3], raws):
+                    buf[boff:boff + blen] = raw
+            del buf
+        except BaseException:
+            shm.close()
+            shm.unlink()
+            raise
+        shm.close()
+        if logger.isEnabledFor(logging.DEBUG):
+            logger.debug(f'wrote {len(entries)} items ({size} bytes) to ' +
+                         f'shared memory {shm.name}')
+        return cls(shm.name, tuple(entries), chunk_id, ranges)
+
+    def _map(self) -> memoryview:
+        """Map and remove the segment."""
+        path: Path = self.SHM_PATH / self.name
+        if path.is_file():
+            with open(path, 'r+b') as f:
+                mm = mmap.mmap(f.fileno(), 0)
+            path.unlink()
+            return memoryview(mm)
+        shm = SharedMemory(self.name)
+        try:
+            # copy since the segment can not be closed while it has views
+            return memoryview(bytearray(shm.buf))
+        finally:
+            shm.close()
+            shm.unlink()
+
+    def load(self) -> Iterable[Tuple[str, Any]]:
+        """Map and remove the segment, and return the unpickled ``(key,
+        item)`` tuples.  This can be called only once.
+
+        """
+        if self.name is None:
+            return iter(())
+        buf: memoryview = self._map()
+
+        def load_entry(entry: Tuple[str, int, int, Tuple[Tuple[int, int]]]):
+            name, offset, length, boffs = entry
+            bufs: List[memoryview] = list(
+                map(lambda t: buf[t[0]:t[0] + t[1]], boffs))
+            return (name, pickle.loads(buf[offset:offset + length],
+                                       buffers=bufs))
+
+        return map(load_entry, self.entries)
+
+    def __len__(self) -> int:
+        return len(self.entries)
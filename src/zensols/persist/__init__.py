@@ -7,8 +7,14 @@ __author__ = 'Paul Landes'
 
 from .dealloc import *
 from .annotation import *
+from .codec import *
 from .domain import *
 from .stash import *
+from .cache import *
+from .index import *
+from .shard import *
+from .packed import *
 from .composite import *
 from .shelve import *
+from .sqlite import *
 from .zip import *
@@ -3,10 +3,15 @@
 """
 __author__ = 'Paul Landes'
 
-from typing import Union, Any, Dict, Type, Tuple, ClassVar
+from typing import (
+    Union, Any, Dict, Type, Tuple, List, ClassVar, Iterable, Optional
+)
 import logging
 import sys
 import re
+import inspect
+from numbers import Number
+from collections import OrderedDict
 from copy import copy
 import pickle
 import string
@@ -15,11 +20,17 @@ from datetime import datetime
 import os
 from pathlib import Path
 from zensols.util import APIError
+from zensols.util.lock import FileLock
+from zensols.util.hasher import Hasher
+from zensols.util.std import atomicwrite
 import zensols.util.time as time
 from . import Deallocatable
 
 logger = logging.getLogger(__name__)
 
+_MISSING = object()
+"""Indicates an attribute does not exist."""
+
 
 class PersistableError(APIError):
     """Thrown for any persistable API error"""
@@ -142,6 +153,14 @@ class PersistedWork(Deallocatable):
     If it can't find it after all of this it invokes function ``worker`` to
     create the data and then pickles it to the disk.
 
+    The file is written only after the data is created, and then atomically
+    (see :class:`~zensols.util.std.atomicwrite`) while holding a lock on a
+    ``.<file name>.lock`` file in the same directory, which is removed when the
+    lock is released.  Processes that create
+    the same work keep the file written by the first to finish.  With
+    ``single_flight``, the lock is held while the data is created so the other
+    processes wait and then load the file rather than create the same data.
+
     This class is a callable itself, which is invoked to get or create the
     work.
 
@@ -154,7 +173,8 @@ class PersistedWork(Deallocatable):
                  cache_global: bool = False, transient: bool = False,
                  initial_value: Any = None, mkdir: bool = False,
                  deallocate_recursive: bool = False,
-                 recover_empty: bool = False):
+                 recover_empty: bool = False, codec: Any = None,
+                 single_flight: bool = False):
         """Create an instance of the class.
 
         :param path: if type of :class:`pathlib.Path` then use disk storage to
@@ -182,8 +202,18 @@ class PersistedWork(Deallocatable):
 
         :param recover_empty: if ``True`` and a ``path`` points to a zero size
                               file, treat it as data that has not yet been
-                              generated; this is useful when a previous
-                              exception was raised leaving a zero byte file
+                              generated; this is only needed for zero byte
+                              files left by versions that did not write files
+                              atomically
+
+        :param codec: the :class:`.Codec` used to read and write the file
+                      when ``path`` is a :class:`pathlib.Path`, or ``None`` to
+                      use :mod:`pickle`
+
+        :param single_flight: if ``True`` and ``path`` is a
+                              :class:`pathlib.Path`, only one process at a
+                              time creates the data while the others wait to
+                              load it
 
         """
         super().__init__()
@@ -208,6 +238,23 @@ class PersistedWork(Deallocatable):
         self.mkdir = mkdir
         self.deallocate_recursive = deallocate_recursive
         self.recover_empty = recover_empty
+        self.codec = codec
+        self.single_flight = single_flight
+        self.fast_attribute: str = None
+        """The name of the owner's attribute with the value set by
+        :class:`.persisted_property`, or ``None`` if not used.
+
+        """
+        self.lock_wait_time: float = None
+        """The number of seconds the last ``single_flight`` creation waited
+        for the lock.
+
+        """
+        self.lock_hold_time: float = None
+        """The number of seconds the last ``single_flight`` creation held the
+        lock.
+
+        """
 
     def _info(self, msg, *args):
         if logger.isEnabledFor(logging.INFO):
@@ -243,8 +290,14 @@ class PersistedWork(Deallocatable):
             if logger.isEnabledFor(logging.DEBUG):
                 logger.debug('removing instance var: {}'.format(vname))
             delattr(self.owner, vname)
+        self._clear_fast_attribute()
         self.clear_global()
 
+    def _clear_fast_attribute(self):
+        """Remove the value set on the owner by a persisted property."""
+        if self.fast_attribute is not None and self.owner is not None:
+            getattr(self.owner, '__dict__', {}).pop(self.fast_attribute, None)
+
     def deallocate(self):
         super().deallocate()
         vname = self.varname
@@ -252,6 +305,7 @@ class PersistedWork(Deallocatable):
             obj = getattr(self.owner, vname)
             self._try_deallocate(obj, self.deallocate_recursive)
             delattr(self.owner, vname)
+        self._clear_fast_attribute()
         self.clear_global()
         self.owner = None
 
@@ -263,24 +317,94 @@ class PersistedWork(Deallocatable):
                 (tm.time() - t0), self.path))
         return obj
 
+    @property
+    def _lock(self) -> FileLock:
+        """The lock held while writing the file."""
+        return FileLock(self.path.parent / f'.{self.path.name}.lock',
+                        remove=True)
+
+    def _is_saved(self) -> bool:
+        """Whether the file has the data."""
+        saved: bool = self.path.is_file()
+        if saved and self.recover_empty and self.path.stat().st_size == 0:
+            saved = False
+        return saved
+
+    def _load(self) -> Any:
+        """Load the data from the file."""
+        if logger.isEnabledFor(logging.INFO):
+            self._info(f'loading work from {self.path}')
+        with open(self.path, 'rb') as f:
+            try:
+                if self.codec is None:
+                    return pickle.load(f)
+                else:
+                    return self.codec.load(f)
+            except EOFError as e:
+                raise PersistableError(f'Can not read: {self.path}') from e
+
+    def _write(self, obj: Any):
+        """Atomically write the data to the file, which must be called with the
+        lock held.
+
+        """
+        with atomicwrite(self.path, 'wb') as f:
+            if self.codec is None:
+                pickle.dump(obj, f)
+            else:
+                self.codec.dump(obj, f)
+        if logger.isEnabledFor(logging.INFO):
+            self._info(f'wrote: {self.path}')
+
+    def _save(self, obj: Any):
+        """Atomically write the data to the file unless another process has
+        already done so.
+
+        """
+        with self._lock:
+            if self._is_saved():
+                if logger.isEnabledFor(logging.INFO):
+                    self._info(f'keeping work saved by another process: ' +
+                               f'{self.path}')
+            else:
+                self._write(obj)
+
+    def _create_single_flight(self, *argv, **kwargs) -> Any:
+        """Create and write the data while holding the lock, or load it if
+        another process wrote it while waiting for the lock.
+
+        """
+        lock: FileLock = self._lock
+        lock.acquire()
+        t0: float = tm.time()
+        try:
+            if self._is_saved():
+                if logger.isEnabledFor(logging.INFO):
+                    self._info('loading work saved by another process ' +
+                               f'after waiting {lock.wait_time:.2f}s')
+                return self._load()
+            obj: Any = self._do_work(*argv, **kwargs)
+            self._write(obj)
+            return obj
+        finally:
+            lock.release()
+            self.lock_wait_time = lock.wait_time
+            self.lock_hold_time = tm.time() - t0
+            if logger.isEnabledFor(logging.INFO):
+                self._info(f'held lock {lock.path} for ' +
+                           f'{self.lock_hold_time:.2f}s after waiting ' +
+                           f'{self.lock_wait_time:.2f}s')
+
     def _load_or_create(self, *argv, **kwargs):
         """Invoke the file system operations to get the data, or create work.
 
         If the file does not exist, calling ``__do_work__`` and save it.
         """
-        load_file: bool = self.path.is_file()
+        load_file: bool = self._is_saved()
         if logger.isEnabledFor(logging.DEBUG):
             logger.debug(f'{self.varname}: load_file: {load_file}')
-        if load_file and self.recover_empty and self.path.stat().st_size == 0:
-            load_file = False
         if load_file:
-            if logger.isEnabledFor(logging.INFO):
-                self._info(f'loading work from {self.path}')
-            with open(self.path, 'rb') as f:
-                try:
-                    obj = pickle.load(f)
-                except EOFError as e:
-                    raise PersistableError(f'Can not read: {self.path}') from e
+            obj = self._load()
         else:
             if logger.isEnabledFor(logging.INFO):
                 self._info(f'saving work to {self.path}')
@@ -289,11 +413,11 @@ class PersistedWork(Deallocatable):
             if not self.path.parent.is_dir():
                 raise PersistableError(
                     f'Parent directory does not exist: {self.path.parent}')
-            with open(self.path, 'wb') as f:
+            if self.single_flight:
+                obj = self._create_single_flight(*argv, **kwargs)
+            else:
                 obj = self._do_work(*argv, **kwargs)
-                pickle.dump(obj, f)
-            if logger.isEnabledFor(logging.INFO):
-                self._info(f'wrote: {self.path}')
+                self._save(obj)
         return obj
 
     def set(self, obj):
@@ -309,6 +433,10 @@ class PersistedWork(Deallocatable):
             raise PersistableError(
                 f'Owner is not set for persistable: {vname}')
         setattr(self.owner, vname, obj)
+        if self.fast_attribute is not None:
+            odict: Dict[str, Any] = getattr(self.owner, '__dict__', None)
+            if odict is not None and self.fast_attribute in odict:
+                odict[self.fast_attribute] = obj
         if self.cache_global:
             if vname not in globals():
                 globals()[vname] = obj
@@ -342,18 +470,18 @@ class PersistedWork(Deallocatable):
 
         """
         vname = self.varname
-        obj = None
+        owner = self.owner
+        obj = None if owner is None else getattr(owner, vname, None)
+        if obj is not None and not self.cache_global:
+            # already set on the owner
+            return obj
         if logger.isEnabledFor(logging.DEBUG):
-            logger.debug(f'{vname}: call')
-        if self.owner is not None and hasattr(self.owner, vname):
-            if logger.isEnabledFor(logging.DEBUG):
-                logger.debug('found in instance')
-            obj = getattr(self.owner, vname)
+            logger.debug(f'{vname}: call, found in instance: ' +
+                         f'{obj is not None}')
         if obj is None and self.cache_global:
-            if vname in globals():
-                if logger.isEnabledFor(logging.DEBUG):
-                    logger.debug('found in globals')
-                obj = globals()[vname]
+            obj = globals().get(vname)
+            if obj is not None and logger.isEnabledFor(logging.DEBUG):
+                logger.debug('found in globals')
         if obj is None:
             if self.use_disk:
                 obj = self._load_or_create(*argv, **kwargs)
@@ -395,6 +523,175 @@ class PersistedWork(Deallocatable):
         return self.__str__()
 
 
+class KeyedPersistedWork(PersistedWork):
+    """Like :class:`.PersistedWork`, but caches a value for each combination
+    of arguments given to the worker rather than one value for all calls.  The
+    arguments (less the owner) are hashed with :class:`~zensols.util.Hasher`
+    in to a key used to cache the value in memory on the owner (or globally)
+    and in a :class:`.DirectoryStash` in the ``path`` directory when it is a
+    :class:`~pathlib.Path`.
+
+    Only the :obj:`cache_size` most recently used values are kept in memory.
+    Arguments must be a :class:`str`, number (including Numpy scalars),
+    :class:`~pathlib.Path`, ``None``, buffer (such as :class:`bytes` and Numpy
+    arrays) or a ``dict`` or iterable of these.  Buffers are hashed by their
+    raw data (see :obj:`.Hasher.binary`).  Iterators and generators are not
+    allowed since the key would consume them.  Like :class:`.PersistedWork`,
+    ``None`` return values are not cached.
+
+    """
+    _SOURCE_KEY: ClassVar[str] = '_source'
+    """The key of the digest of the worker's source code in the stash."""
+
+    def __init__(self, *args, cache_size: int = 128,
+                 track_source: bool = False, **kwargs):
+        """Create an instance of the class.  The parameters are the same as
+        :class:`.PersistedWork` with the addition of the following.
+
+        :param cache_size: the maximum number of values kept in memory
+
+        :param track_source: if ``True``, clear the values persisted by a
+                             worker with different source code
+
+        """
+        super().__init__(*args, **kwargs)
+        self.cache_size = cache_size
+        self.track_source = track_source
+        self._stash = None
+
+    def _update_key(self, hasher: Hasher, data: Any):
+        # tag values with their type and length so different arguments can
+        # not have the same encoding
+        if isinstance(data, dict):
+            hasher.update(f'd{len(data)}:')
+            for k, v in sorted(data.items(), key=lambda t: str(t[0])):
+                self._update_key(hasher, k)
+                self._update_key(hasher, v)
+        elif data is None or isinstance(data, (str, Number, Path)):
+            s: str = str(data)
+            hasher.update(f'{type(data).__name__}{len(s)}:')
+            hasher.update(s)
+        elif isinstance(data, (bytes, bytearray, memoryview)) or \
+            (type(data).__module__ == 'numpy' and
+             hasattr(data, 'dtype') and not data.dtype.hasobject):
+            # the binary encoding tags the data with its length or shape
+            hasher.update(data)
+        elif isinstance(data, (set, frozenset)):
+            # iteration order depends on the hash seed of the process, so
+            # hash the sorted digests of the elements
+            digests: List[bytes] = []
+            for v in data:
+                ehasher = Hasher(binary=True)
+                self._update_key(ehasher, v)
+                digests.append(ehasher(output_bytes=True))
+            hasher.update(f's{len(data)}:')
+            for digest in sorted(digests):
+                hasher.update(digest)
+        elif isinstance(data, Iterable):
+            if iter(data) is data:
+                raise PersistableError(
+                    f'{self.varname}: can not key an argument that can only ' +
+                    f'be iterated once: {type(data)}')
+            data = tuple(data)
+            hasher.update(f'i{len(data)}:')
+            for v in data:
+                self._update_key(hasher, v)
+        else:
+            raise PersistableError(
+                f'{self.varname}: can not key argument of type {type(data)}')
+
+    def _create_key(self, argv: Tuple[Any, ...],
+                    kwargs: Dict[str, Any]) -> str:
+        """Return the key of the values cached for the arguments."""
+        hasher = Hasher(binary=True)
+        self._update_key(hasher, (argv, kwargs))
+        return hasher()
+
+    def _source_digest(self) -> str:
+        hasher = Hasher()
+        try:
+            hasher.update(inspect.getsource(self.worker))
+        except (OSError, TypeError):
+            hasher.update(str(self.worker.__code__.co_code))
+        return hasher()
+
+    def _get_stash(self) -> Optional['Stash']:
+        """Return the stash that persists the values, or ``None`` if they are
+        only kept in memory.
+
+        """
+        if self._stash is None and self.use_disk:
+            from .stash import DirectoryStash
+            params: Dict[str, Any] = {}
+            if self.codec is not None:
+                params['codec'] = self.codec
+            if not self.mkdir and not self.path.parent.is_dir():
+                raise PersistableError(
+                    f'Parent directory does not exist: {self.path.parent}')
+            stash = DirectoryStash(self.path, **params)
+            if self.track_source and self.worker is not None:
+                digest: str = self._source_digest()
+                if stash.load(self._SOURCE_KEY) != digest:
+                    if logger.isEnabledFor(logging.INFO):
+                        self._info('worker source changed, clearing ' +
+                                   f'{self.path}')
+                    stash.clear()
+                    stash.dump(self._SOURCE_KEY, digest)
+            self._stash = stash
+        return self._stash
+
+    def _get_cache(self) -> OrderedDict:
+        vname: str = self.varname
+        cache: OrderedDict = None
+        if self.cache_global:
+            cache = globals().get(vname)
+        elif self.owner is not None:
+            cache = getattr(self.owner, vname, None)
+        if cache is None:
+            cache = OrderedDict()
+            self.set(cache)
+        return cache
+
+    def clear(self):
+        """Clear the data of all arguments in memory and in the stash."""
+        if self.use_disk:
+            self._stash = None
+            from .stash import DirectoryStash
+            DirectoryStash(self.path).clear()
+        super().clear()
+
+    def __getstate__(self) -> Dict[str, Any]:
+        d = super().__getstate__()
+        d['_stash'] = None
+        return d
+
+    def __call__(self, *argv, **kwargs):
+        """Return the cached data for the arguments, or create and cache it
+        if it does not yet exist.
+
+        """
+        key: str = self._create_key(argv[1:], kwargs)
+        cache: OrderedDict = self._get_cache()
+        obj: Any = cache.get(key)
+        if obj is not None:
+            cache.move_to_end(key)
+            return obj
+        stash = self._get_stash()
+        if stash is not None:
+            obj = stash.load(key)
+            if obj is not None and logger.isEnabledFor(logging.DEBUG):
+                logger.debug(f'{self.varname}: loaded {key} from stash')
+        if obj is None:
+            obj = self._do_work(*argv, **kwargs)
+            if obj is not None and stash is not None:
+                stash.dump(key, obj)
+        if obj is not None:
+            cache[key] = obj
+            while len(cache) > self.cache_size:
+                cache.popitem(last=False)
+        return obj
+
+
 class PersistableContainerMetadata(object):
     """Provides metadata about :class:`.PersistedWork` definitions in the class.
 
@@ -466,6 +763,7 @@ class PersistableContainer(Deallocatable):
         if logger.isEnabledFor(logging.DEBUG):
             logger.debug(f'get state for {self.__class__}')
         removes = set()
+        fast_removes = set()
         tran_attribute_name = '_PERSITABLE_TRANSIENT_ATTRIBUTES'
         remove_attribute_name = '_PERSITABLE_REMOVE_ATTRIBUTES'
         prop_attribute_name = '_PERSITABLE_PROPERTIES'
@@ -492,6 +790,13 @@ class PersistableContainer(Deallocatable):
             if isinstance(v, PersistedWork):
                 if v.transient:
                     removes.add(v.varname)
+                    fast_attr: str = getattr(v, 'fast_attribute', None)
+                    if fast_attr is not None:
+                        # removed rather than set to None so the descriptor
+                        # recreates the value
+                        fast_removes.add(fast_attr)
+        for k in fast_removes:
+            state.pop(k, None)
         for k in removes:
             if logger.isEnabledFor(logging.DEBUG):
                 logger.debug(f'removed persistable attribute: {k}')
@@ -556,12 +861,23 @@ class persisted(object):
             def counter(self):
                 return tuple(range(5))
 
+    Methods with parameters are cached for each combination of arguments with
+    ``keyed=True`` (see :class:`.KeyedPersistedWork`), in which case ``path``
+    is a directory::
+
+        class SomeClass(object):
+            @persisted('_squares', Path('squares'), keyed=True)
+            def square(self, n: int):
+                return n * n
+
     """
     def __init__(self, name: str, path: Path = None,
                  cache_global: bool = False, transient: bool = False,
                  allocation_track: bool = True, mkdir: bool = False,
                  deallocate_recursive: bool = False,
-                 recover_empty: bool = False):
+                 recover_empty: bool = False, codec: Any = None,
+                 keyed: bool = False, cache_size: int = 128,
+                 track_source: bool = False, single_flight: bool = False):
         """Initialize.
 
         :param name: the name of the attribute on the instance to set with the
@@ -593,6 +909,22 @@ class persisted(object):
                               generated; this is useful when a previous
                               exception was raised leaving a zero byte file
 
+        :param codec: the :class:`.Codec` used to read and write ``path``, or
+                      ``None`` to use :mod:`pickle`
+
+        :param keyed: if ``True``, cache a value for each combination of the
+                      method's arguments with a :class:`.KeyedPersistedWork`
+
+        :param cache_size: the maximum number of values of a keyed method kept
+                           in memory
+
+        :param track_source: if ``True``, clear the values persisted by a keyed
+                             method when its source code changes
+
+        :param single_flight: if ``True``, only one process at a time creates
+                              the data of ``path`` while the others wait to
+                              load it (see :class:`.PersistedWork`)
+
         """
         super().__init__()
         if logger.isEnabledFor(logging.DEBUG):
@@ -606,6 +938,11 @@ class persisted(object):
         self.mkdir = mkdir
         self.deallocate_recursive = deallocate_recursive
         self.recover_empty = recover_empty
+        self.codec = codec
+        self.keyed = keyed
+        self.cache_size = cache_size
+        self.track_source = track_source
+        self.single_flight = single_flight
 
     def __call__(self, fn):
         if logger.isEnabledFor(logging.DEBUG):
@@ -617,20 +954,28 @@ class persisted(object):
             if logger.isEnabledFor(logging.DEBUG):
                 logger.debug(f'wrap: {fn}:{self.attr_name}:{self.path}:' +
                              f'{self.cache_global}')
-            pwork: PersistedWork
-            if hasattr(inst, self.attr_name):
-                pwork = getattr(inst, self.attr_name)
-            else:
+            pwork: PersistedWork = getattr(inst, self.attr_name, _MISSING)
+            if pwork is _MISSING:
                 if self.path is None:
                     path = self.attr_name
                 else:
                     path = Path(self.path)
-                pwork = PersistedWork(
+                params: Dict[str, Any] = {}
+                cls: Type[PersistedWork] = PersistedWork
+                if self.keyed:
+                    cls = KeyedPersistedWork
+                    params.update(cache_size=self.cache_size,
+                                  track_source=self.track_source)
+                else:
+                    params.update(single_flight=self.single_flight)
+                pwork = cls(
                     path, owner=inst, cache_global=self.cache_global,
                     transient=self.transient,
                     mkdir=self.mkdir,
                     deallocate_recursive=self.deallocate_recursive,
-                    recover_empty=self.recover_empty)
+                    recover_empty=self.recover_empty,
+                    codec=self.codec,
+                    **params)
                 setattr(inst, self.attr_name, pwork)
                 if not self.allocation_track:
                     pwork._mark_deallocated()
@@ -648,6 +993,47 @@ class persisted(object):
         return wrapped
 
 
+class persisted_property(persisted):
+    """Like decorating a method with ``@property`` and :class:`.persisted`,
+    but the value is also set in the instance's ``__dict__`` with the name of
+    the property after it is first accessed.  Since this is a non-data
+    descriptor (like :class:`functools.cached_property`), subsequent access is
+    a plain attribute lookup rather than a call through the
+    :class:`.PersistedWork`.  Clearing or deallocating the work removes the
+    value so the next access uses the work again.  The value is not kept when
+    the instance has no ``__dict__`` (i.e. uses ``__slots__``).
+
+    For example::
+
+        class SomeClass(PersistableContainer):
+            @persisted_property('_counter', Path('tmp.dat'))
+            def counter(self):
+                return tuple(range(5))
+
+    """
+    def __call__(self, fn):
+        if self.keyed:
+            raise PersistableError(
+                f'Keyed work can not be a property: {self.attr_name}')
+        self._wrapped = super().__call__(fn)
+        self._name = fn.__name__
+        self.__doc__ = fn.__doc__
+        return self
+
+    def __set_name__(self, owner: Type, name: str):
+        self._name = name
+
+    def __get__(self, inst: Any, owner: Type = None) -> Any:
+        if inst is None:
+            return self
+        obj: Any = self._wrapped(inst)
+        odict: Dict[str, Any] = getattr(inst, '__dict__', None)
+        if obj is not None and odict is not None:
+            getattr(inst, self.attr_name).fast_attribute = self._name
+            odict[self._name] = obj
+        return obj
+
+
 # resource/sql
 class resource(object):
     """This annotation uses a template pattern to (de)allocate resources.  For
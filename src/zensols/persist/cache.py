@@ -0,0 +1,562 @@
+"""Thread safe in memory cache stashes bounded by item count and memory, and a
+two tier memory and disk cache.
+
+"""
+__author__ = 'Paul Landes'
+
+from typing import Any, Dict, List, Tuple, Set, Iterable, Callable, Optional
+from dataclasses import dataclass, field
+from abc import ABCMeta, abstractmethod
+import logging
+import sys
+import os
+import threading
+import time as tm
+from queue import Queue
+from collections import OrderedDict
+from . import PersistableError, Deallocatable, Stash, DelegateStash
+
+logger = logging.getLogger(__name__)
+
+
+def sizeof(inst: Any) -> int:
+    """Return the approximate memory used by ``inst`` in bytes.  This is the
+    ``nbytes`` attribute of arrays and tensors when available, otherwise
+    :func:`sys.getsizeof`, which does not include referenced objects.
+
+    """
+    nbytes: Any = getattr(inst, 'nbytes', None)
+    if isinstance(nbytes, int):
+        return nbytes
+    return sys.getsizeof(inst)
+
+
+@dataclass
+class CacheStats(object):
+    """Counts of cache activity of a :class:`.BoundedCacheStash`.
+
+    """
+    hits: int = field(default=0)
+    """The number of loads of cached items."""
+
+    misses: int = field(default=0)
+    """The number of loads of items that were not cached."""
+
+    evictions: int = field(default=0)
+    """The number of items removed to stay within the cache's bounds."""
+
+    expirations: int = field(default=0)
+    """The number of items removed because they outlived their time to live.
+
+    """
+    @property
+    def hit_ratio(self) -> float:
+        """The portion of loads that were cache hits."""
+        total: int = self.hits + self.misses
+        return 0. if total == 0 else self.hits / total
+
+    def reset(self):
+        """Set all counts to zero."""
+        self.hits = self.misses = self.evictions = self.expirations = 0
+
+    def __str__(self) -> str:
+        return (f'hits: {self.hits}, misses: {self.misses}, ' +
+                f'evictions: {self.evictions}, ' +
+                f'expirations: {self.expirations}, ' +
+                f'ratio: {self.hit_ratio:.3f}')
+
+
+@dataclass
+class BoundedCacheStash(Stash, metaclass=ABCMeta):
+    """An in memory cache that removes items when it holds more than
+    :obj:`maxsize` items or :obj:`maxbytes` bytes as measured by
+    :obj:`sizer`.  Which items are removed is determined by the subclass's
+    policy.  All methods are thread safe.
+
+    Use it as the ``cache_stash`` of a :class:`.CacheStash` to bound the
+    memory used to cache a (factory) stash, for example::
+
+        stash = CacheStash(delegate=factory_stash,
+                           cache_stash=LFUCacheStash(maxbytes=1 << 30))
+
+    .. document private functions
+    .. automethod:: _access
+    .. automethod:: _add
+    .. automethod:: _remove
+    .. automethod:: _victim
+
+    """
+    maxsize: int = field(default=None)
+    """The maximum number of items, or ``None`` for no limit."""
+
+    maxbytes: int = field(default=None)
+    """The maximum number of bytes of all items as measured by :obj:`sizer`,
+    or ``None`` for no limit.
+
+    """
+    sizer: Callable[[Any], int] = field(default=sizeof)
+    """Returns the size of an item in bytes, which is only used with
+    :obj:`maxbytes`.
+
+    """
+    eviction_callback: Callable[[str, Any], None] = field(default=None)
+    """Called with the key and item of each evicted or expired item after it
+    has been removed.
+
+    """
+    def __post_init__(self):
+        if self.maxsize is not None and self.maxsize < 1:
+            raise PersistableError(f'Bad cache max size: {self.maxsize}')
+        self.stats = CacheStats()
+        self._lock = threading.RLock()
+        self._data: Dict[str, Any] = {}
+        self._sizes: Dict[str, int] = {}
+        self._nbytes: int = 0
+
+    @property
+    def nbytes(self) -> int:
+        """The size of the cached items as measured by :obj:`sizer`."""
+        return self._nbytes
+
+    @abstractmethod
+    def _access(self, name: str):
+        """Record a cache hit of ``name``."""
+        pass
+
+    @abstractmethod
+    def _add(self, name: str):
+        """Record ``name`` was added to the cache."""
+        pass
+
+    @abstractmethod
+    def _remove(self, name: str):
+        """Record ``name`` was removed from the cache."""
+        pass
+
+    @abstractmethod
+    def _victim(self) -> str:
+        """Return the key of the next item to remove to stay in bounds."""
+        pass
+
+    def _is_expired(self, name: str) -> bool:
+        return False
+
+    def _pop(self, name: str) -> Any:
+        self._remove(name)
+        self._nbytes -= self._sizes.pop(name)
+        return self._data.pop(name)
+
+    def _over(self) -> bool:
+        return (self.maxsize is not None and
+                len(self._data) > self.maxsize) or \
+            (self.maxbytes is not None and self._nbytes > self.maxbytes)
+
+    def _purge(self) -> List[Tuple[str, Any]]:
+        """Remove expired items.  This must be called with the lock held."""
+        return []
+
+    def _notify(self, removed: List[Tuple[str, Any]]):
+        cb: Callable[[str, Any], None] = self.eviction_callback
+        if cb is not None:
+            name: str
+            inst: Any
+            for name, inst in removed:
+                cb(name, inst)
+
+    def load(self, name: str) -> Any:
+        removed: List[Tuple[str, Any]] = []
+        inst: Any = None
+        with self._lock:
+            if name in self._data:
+                if self._is_expired(name):
+                    removed.append((name, self._pop(name)))
+                    self.stats.expirations += 1
+                else:
+                    self._access(name)
+                    inst = self._data[name]
+            if inst is None:
+                self.stats.misses += 1
+            else:
+                self.stats.hits += 1
+        self._notify(removed)
+        return inst
+
+    def get(self, name: str, default: Any = None) -> Any:
+        inst: Any = self.load(name)
+        return default if inst is None else inst
+
+    def exists(self, name: str) -> bool:
+        with self._lock:
+            return name in self._data and not self._is_expired(name)
+
+    def dump(self, name: str, inst: Any):
+        self._notify(self._put(name, inst))
+
+    def dump_many(self, items: Iterable[Tuple[str, Any]]):
+        name: str
+        inst: Any
+        for name, inst in items:
+            self._notify(self._put(name, inst))
+
+    def _put(self, name: str, inst: Any) -> List[Tuple[str, Any]]:
+        """Add an item and return those removed to make room for it."""
+        removed: List[Tuple[str, Any]] = []
+        size: int = 0 if self.maxbytes is None else self.sizer(inst)
+        with self._lock:
+            if name in self._data:
+                self._pop(name)
+            if self.maxbytes is not None and size > self.maxbytes:
+                # never cache an item that does not fit in the cache
+                self.stats.evictions += 1
+                return [(name, inst)]
+            self._data[name] = inst
+            self._sizes[name] = size
+            self._nbytes += size
+            self._add(name)
+            removed.extend(self._purge())
+            while self._over():
+                victim: str = self._victim()
+                removed.append((victim, self._pop(victim)))
+                self.stats.evictions += 1
+        if logger.isEnabledFor(logging.DEBUG) and len(removed) > 0:
+            self._debug(f'evicted {len(removed)} items')
+        return removed
+
+    def delete(self, name: str = None):
+        if name is None:
+            self.clear()
+        else:
+            with self._lock:
+                if name in self._data:
+                    self._pop(name)
+
+    def keys(self) -> Iterable[str]:
+        with self._lock:
+            removed: List[Tuple[str, Any]] = self._purge()
+            keys: Tuple[str, ...] = tuple(self._data.keys())
+        self._notify(removed)
+        return keys
+
+    def clear(self):
+        with self._lock:
+            name: str
+            for name in tuple(self._data.keys()):
+                self._pop(name)
+
+    def __len__(self) -> int:
+        return len(self.keys())
+
+
+@dataclass
+class BoundedLRUCacheStash(BoundedCacheStash):
+    """Evicts the least recently used items first.
+
+    """
+    def __post_init__(self):
+        super().__post_init__()
+        self._order: Dict[str, None] = OrderedDict()
+
+    def _access(self, name: str):
+        self._order.move_to_end(name)
+
+    def _add(self, name: str):
+        self._order[name] = None
+
+    def _remove(self, name: str):
+        del self._order[name]
+
+    def _victim(self) -> str:
+        return next(iter(self._order))
+
+
+@dataclass
+class LFUCacheStash(BoundedCacheStash):
+    """Evicts the least frequently used items first, and of those, the least
+    recently used.  Each operation takes constant time.
+
+    """
+    def __post_init__(self):
+        super().__post_init__()
+        # key -> use count
+        self._counts: Dict[str, int] = {}
+        # use count -> keys with that count in least recently used order
+        self._buckets: Dict[int, Dict[str, None]] = {}
+        # the use counts with buckets as a circular doubly linked list in
+        # ascending order with sentinel 0 so the least count is always known
+        self._next: Dict[int, int] = {0: 0}
+        self._prev: Dict[int, int] = {0: 0}
+
+    def _bucket_add(self, name: str, count: int, prev: int):
+        """Add ``name`` to the bucket of ``count``, which is linked after
+        ``prev`` when created.
+
+        """
+        self._counts[name] = count
+        bucket: Dict[str, None] = self._buckets.get(count)
+        if bucket is None:
+            bucket = OrderedDict()
+            self._buckets[count] = bucket
+            nxt: int = self._next[prev]
+            self._next[prev] = count
+            self._prev[count] = prev
+            self._next[count] = nxt
+            self._prev[nxt] = count
+        bucket[name] = None
+
+    def _bucket_remove(self, name: str, count: int):
+        """Remove ``name`` from the bucket of ``count``, which is unlinked when
+        it becomes empty.
+
+        """
+        bucket: Dict[str, None] = self._buckets[count]
+        del bucket[name]
+        if len(bucket) == 0:
+            del self._buckets[count]
+            prev: int = self._prev.pop(count)
+            nxt: int = self._next.pop(count)
+            self._next[prev] = nxt
+            self._prev[nxt] = prev
+
+    def _access(self, name: str):
+        count: int = self._counts[name]
+        self._bucket_add(name, count + 1, count)
+        self._bucket_remove(name, count)
+
+    def _add(self, name: str):
+        self._bucket_add(name, 1, 0)
+
+    def _remove(self, name: str):
+        self._bucket_remove(name, self._counts.pop(name))
+
+    def _victim(self) -> str:
+        return next(iter(self._buckets[self._next[0]]))
+
+
+@dataclass
+class TTLCacheStash(BoundedLRUCacheStash):
+    """Removes items :obj:`ttl` seconds after they were dumped, and like
+    :class:`.BoundedLRUCacheStash`, evicts the least recently used items to
+    stay within its bounds.
+
+    """
+    ttl: float = field(default=60.)
+    """The number of seconds an item is kept after it is dumped."""
+
+    timer: Callable[[], float] = field(default=tm.monotonic)
+    """Returns the current time in seconds."""
+
+    def __post_init__(self):
+        super().__post_init__()
+        # key -> expiration time in insertion (and thus expiration) order
+        self._expires: Dict[str, float] = OrderedDict()
+
+    def _add(self, name: str):
+        super()._add(name)
+        self._expires[name] = self.timer() + self.ttl
+
+    def _remove(self, name: str):
+        super()._remove(name)
+        del self._expires[name]
+
+    def _is_expired(self, name: str) -> bool:
+        return self._expires[name] <= self.timer()
+
+    def _purge(self) -> List[Tuple[str, Any]]:
+        removed: List[Tuple[str, Any]] = []
+        now: float = self.timer()
+        name: Optional[str] = next(iter(self._expires), None)
+        while name is not None and self._expires[name] <= now:
+            removed.append((name, self._pop(name)))
+            self.stats.expirations += 1
+            name = next(iter(self._expires), None)
+        return removed
+
+
+@dataclass
+class TieredCacheStash(DelegateStash, Deallocatable):
+    """A two tier cache with a bounded in memory :obj:`memory` tier over a
+    (usually disk based) :obj:`delegate` tier.  Items loaded from the delegate
+    are promoted to the memory tier, and items evicted from memory are only
+    available from the delegate.
+
+    Items are written to both tiers on :meth:`dump`.  When :obj:`write_behind`
+    is ``True``, the write to the delegate is done by a background thread
+    rather than the caller.  Items waiting to be written (*dirty* items) are
+    always available to :meth:`load`, even after eviction from memory.  Use
+    :meth:`flush` to wait until all dirty items are written, which is also done
+    by :meth:`close` and :meth:`deallocate`.  Items the background thread could
+    not write stay dirty and are retried by each :meth:`flush`, which raises an
+    error until they are written.
+
+    """
+    memory: BoundedCacheStash = field(
+        default_factory=lambda: BoundedLRUCacheStash(maxsize=1000))
+    """The bounded in memory tier."""
+
+    write_behind: bool = field(default=False)
+    """Whether to write to the :obj:`delegate` on a background thread."""
+
+    def __post_init__(self):
+        super().__post_init__()
+        self._lock = threading.RLock()
+        # serializes writes and deletes to the delegate
+        self._io_lock = threading.Lock()
+        self._reset_writer()
+
+    def _reset_writer(self):
+        self._pid: int = os.getpid()
+        self._dirty: Dict[str, Any] = {}
+        # dirty items the background thread could not write
+        self._failed: Set[str] = set()
+        self._queue: Queue = Queue()
+        self._writer: Optional[threading.Thread] = None
+        self._error: Optional[Exception] = None
+
+    def _assert_writer(self):
+        if self._pid != os.getpid():
+            # the parent's thread and dirty items are not ours after a fork
+            self._reset_writer()
+        if self._writer is None:
+            self._writer = threading.Thread(
+                target=self._write_dirty, daemon=True,
+                name=f'{self.__class__.__name__}-writer')
+            self._writer.start()
+
+    def _write_dirty(self):
+        """The background thread that writes dirty items to the delegate."""
+        queue: Queue = self._queue
+        while True:
+            name: Optional[str] = queue.get()
+            try:
+                if name is None:
+                    break
+                with self._io_lock:
+                    with self._lock:
+                        inst: Any = self._dirty.get(name)
+                    if inst is not None:
+                        self.delegate.dump(name, inst)
+                        with self._lock:
+                            if self._dirty.get(name) is inst:
+                                del self._dirty[name]
+                            elif name in self._dirty:
+                                # dumped again while it was being written
+                                queue.put(name)
+            except Exception as e:
+                logger.error(f'could not write {name}: {e}', exc_info=True)
+                with self._lock:
+                    self._failed.add(name)
+                    self._error = e
+            finally:
+                queue.task_done()
+
+    def load(self, name: str) -> Any:
+        inst: Any = self.memory.load(name)
+        if inst is None:
+            with self._lock:
+                inst = self._dirty.get(name)
+            if inst is None:
+                inst = self.delegate.load(name)
+            if inst is not None:
+                if logger.isEnabledFor(logging.DEBUG):
+                    self._debug(f'promoting: {name}')
+                self.memory.dump(name, inst)
+        return inst
+
+    def get(self, name: str, default: Any = None) -> Any:
+        inst: Any = self.load(name)
+        return default if inst is None else inst
+
+    def exists(self, name: str) -> bool:
+        return self.memory.exists(name) or name in self._dirty or \
+            self.delegate.exists(name)
+
+    def dump(self, name: str, inst: Any):
+        self.memory.dump(name, inst)
+        if self.write_behind:
+            self._assert_writer()
+            with self._lock:
+                # failed items are no longer queued and are written again
+                queued: bool = name in self._dirty and \
+                    name not in self._failed
+                self._failed.discard(name)
+                self._dirty[name] = inst
+            if not queued:
+                self._queue.put(name)
+        else:
+            with self._io_lock:
+                self.delegate.dump(name, inst)
+
+    def delete(self, name: str = None):
+        if name is None:
+            self.clear()
+        else:
+            with self._io_lock:
+                with self._lock:
+                    self._dirty.pop(name, None)
+                self.memory.delete(name)
+                self.delegate.delete(name)
+
+    def keys(self) -> Iterable[str]:
+        with self._lock:
+            dirty: Tuple[str, ...] = tuple(self._dirty.keys())
+        keys: Iterable[str] = self.delegate.keys()
+        if len(dirty) > 0:
+            keys = set(keys)
+            keys.update(dirty)
+        return keys
+
+    def flush(self):
+        """Wait for all dirty items to be written to the delegate.  Items that
+        previously could not be written are retried.
+
+        :raises PersistableError: if the background thread could not write
+                                  an item
+
+        """
+        if self._pid != os.getpid():
+            return
+        with self._lock:
+            retry: Tuple[str, ...] = tuple(
+                filter(self._dirty.__contains__, self._failed))
+            self._failed.clear()
+            self._error = None
+        if len(retry) > 0:
+            if logger.isEnabledFor(logging.DEBUG):
+                self._debug(f'retrying {len(retry)} dirty items')
+            self._assert_writer()
+            name: str
+            for name in retry:
+                self._queue.put(name)
+        if self._writer is not None:
+            if logger.isEnabledFor(logging.DEBUG):
+                self._debug(f'flushing {len(self._dirty)} dirty items')
+            self._queue.join()
+            e: Exception = self._error
+            if e is not None:
+                raise PersistableError(f'Could not write dirty item: {e}') \
+                    from e
+
+    def clear(self):
+        self.flush()
+        with self._io_lock:
+            self.memory.clear()
+            super().clear()
+
+    def close(self):
+        """Flush dirty items, stop the background thread and close the
+        delegate.
+
+        """
+        try:
+            self.flush()
+        finally:
+            if self._writer is not None and self._pid == os.getpid():
+                self._queue.put(None)
+                self._writer.join()
+                self._writer = None
+            if callable(getattr(self.delegate, 'close', None)):
+                super().close()
+
+    def deallocate(self):
+        self.close()
+        super().deallocate()
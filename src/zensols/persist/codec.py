@@ -0,0 +1,331 @@
+"""Serialization of stash items and persisted work to and from bytes.
+
+"""
+__author__ = 'Paul Landes'
+
+from typing import Any, Tuple, List, Dict, Callable, BinaryIO, Union
+from dataclasses import dataclass, field
+from abc import ABC, abstractmethod
+import logging
+import struct
+import pickle
+import mmap
+from io import BytesIO
+from . import PersistableError
+
+logger = logging.getLogger(__name__)
+
+Buffer = Union[bytes, bytearray, memoryview]
+"""The bytes-like types given to :meth:`.Codec.loads`."""
+
+
+class Codec(ABC):
+    """Converts objects to and from bytes.  Stashes and :class:`.PersistedWork`
+    use instances of this class to read and write their data, so it can be set
+    per stash in the application configuration.
+
+    Subclasses must implement :meth:`dumps` and :meth:`loads`.  The file based
+    :meth:`dump` and :meth:`load` methods can be overridden when the codec can
+    stream directly to and from a file.
+
+    """
+    @abstractmethod
+    def dumps(self, inst: Any) -> bytes:
+        """Return ``inst`` encoded as bytes."""
+        pass
+
+    @abstractmethod
+    def loads(self, data: Buffer) -> Any:
+        """Return the object decoded from ``data``."""
+        pass
+
+    def dump(self, inst: Any, f: BinaryIO):
+        """Write ``inst`` to binary file ``f``."""
+        f.write(self.dumps(inst))
+
+    def load(self, f: BinaryIO) -> Any:
+        """Read an object from binary file ``f``."""
+        return self.loads(f.read())
+
+
+@dataclass
+class PickleCodec(Codec):
+    """Uses :mod:`pickle` to encode and decode objects.
+
+    When :obj:`out_of_band` is ``True``, protocol 5 (:pep:`574`) out-of-band
+    buffers (such as NumPy array data) are written after the pickle data
+    aligned to :obj:`ALIGNMENT` bytes rather than copied in to the pickle
+    stream.  On load, the buffers are given to the unpickler without copying.
+    Data that was not written out-of-band is always readable by this codec.
+
+    """
+    ALIGNMENT = 64
+    """The byte boundary of each out-of-band buffer."""
+
+    _OOB_MAGIC = b'ZSPKL5\x00\x00'
+    _OOB_HEADER = struct.Struct('<QQ')
+    _OOB_LEN = struct.Struct('<Q')
+
+    protocol: int = field(default=pickle.DEFAULT_PROTOCOL)
+    """The pickle protocol."""
+
+    out_of_band: bool = field(default=False)
+    """Whether to use out-of-band buffers, which requires protocol 5."""
+
+    def __post_init__(self):
+        if self.out_of_band and self.protocol < 5:
+            raise PersistableError(
+                f'Out-of-band buffers need protocol 5, got: {self.protocol}')
+
+    @classmethod
+    def _pad(cls, n: int) -> int:
+        return (cls.ALIGNMENT - (n % cls.ALIGNMENT)) % cls.ALIGNMENT
+
+    def _encode(self, inst: Any) -> Tuple[bytes, List[memoryview]]:
+        bufs: List[pickle.PickleBuffer] = []
+        data: bytes = pickle.dumps(
+            inst, protocol=self.protocol, buffer_callback=bufs.append)
+        return data, list(map(lambda b: b.raw(), bufs))
+
+    def _write_oob(self, inst: Any, write: Callable[[Buffer], Any]):
+        data, bufs = self._encode(inst)
+        head: List[bytes] = [
+            self._OOB_MAGIC, self._OOB_HEADER.pack(len(data), len(bufs))]
+        head.extend(map(lambda b: self._OOB_LEN.pack(b.nbytes), bufs))
+        head.append(data)
+        pos: int = sum(map(len, head))
+        write(b''.join(head))
+        buf: memoryview
+        for buf in bufs:
+            pad: int = self._pad(pos)
+            write(b'\x00' * pad)
+            write(buf)
+            pos += pad + buf.nbytes
+
+    def _read_oob(self, data: memoryview) -> Any:
+        pos: int = len(self._OOB_MAGIC)
+        plen, nbuf = self._OOB_HEADER.unpack_from(data, pos)
+        pos += self._OOB_HEADER.size
+        lens: List[int] = []
+        for _ in range(nbuf):
+            lens.append(self._OOB_LEN.unpack_from(data, pos)[0])
+            pos += self._OOB_LEN.size
+        pdata: memoryview = data[pos:pos + plen]
+        pos += plen
+        bufs: List[memoryview] = []
+        blen: int
+        for blen in lens:
+            pos += self._pad(pos)
+            bufs.append(data[pos:pos + blen])
+            pos += blen
+        return pickle.loads(pdata, buffers=bufs)
+
+    def dumps(self, inst: Any) -> bytes:
+        if self.out_of_band:
+            bio = BytesIO()
+            self._write_oob(inst, bio.write)
+            return bio.getvalue()
+        return pickle.dumps(inst, protocol=self.protocol)
+
+    def loads(self, data: Buffer) -> Any:
+        if data[:len(self._OOB_MAGIC)] == self._OOB_MAGIC:
+            return self._read_oob(memoryview(data))
+        return pickle.loads(data)
+
+    def dump(self, inst: Any, f: BinaryIO):
+        if self.out_of_band:
+            self._write_oob(inst, f.write)
+        else:
+            pickle.dump(inst, f, protocol=self.protocol)
+
+    def load(self, f: BinaryIO) -> Any:
+        magic: bytes = f.read(len(self._OOB_MAGIC))
+        if magic == self._OOB_MAGIC:
+            # read in to a mutable buffer so out-of-band arrays are writable
+            f.seek(0, 2)
+            data = bytearray(f.tell())
+            f.seek(0)
+            f.readinto(data)
+            return self._read_oob(memoryview(data))
+        f.seek(0)
+        return pickle.load(f)
+
+
+@dataclass
+class MemoryMapCodec(PickleCodec):
+    """Like :class:`.PickleCodec` with out-of-band buffers, but files are
+    loaded by memory mapping them with :mod:`mmap`.  The out-of-band buffers,
+    such as the data of NumPy arrays, are read-only views of the mapped file
+    rather than copies on the heap.  This means processes that load the same
+    file share its pages through the operating system's page cache.
+
+    Arrays that are loaded are not writable and are valid for as long as they
+    are referenced, even after the file is deleted.  Data that was not written
+    with out-of-band buffers is loaded with :mod:`pickle` as usual.
+
+    """
+    protocol: int = field(default=5)
+    """The pickle protocol, which must be at least 5."""
+
+    out_of_band: bool = field(default=True)
+    """Whether to use out-of-band buffers, which must be ``True``."""
+
+    def __post_init__(self):
+        super().__post_init__()
+        if not self.out_of_band:
+            raise PersistableError('Memory mapping needs out-of-band buffers')
+
+    def load(self, f: BinaryIO) -> Any:
+        magic: bytes = f.read(len(self._OOB_MAGIC))
+        f.seek(0)
+        if magic != self._OOB_MAGIC:
+            return super().load(f)
+        mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        return self._read_oob(memoryview(mm))
+
+
+@dataclass
+class CompressionCodec(Codec):
+    """Compresses the output of another :obj:`codec`.  The :obj:`compressor`
+    is one of:
+
+      * ``gzip``, ``bz2``, ``lzma``: the standard library modules
+      * ``zstd``: the :mod:`compression.zstd` module (Python 3.14+) or the
+        ``zstandard`` package
+      * ``lz4``: the ``lz4`` package
+
+    """
+    compressor: str = field(default='gzip')
+    """The name of the compression algorithm (see class docs)."""
+
+    codec: Codec = field(default_factory=PickleCodec)
+    """The codec that encodes the object before compression."""
+
+    level: int = field(default=None)
+    """The compression level or ``None`` for the algorithm's default."""
+
+    def __post_init__(self):
+        self._compress, self._decompress = self._create_compressor()
+
+    def _create_compressor(self) -> Tuple[Callable, Callable]:
+        name: str = self.compressor
+        kwargs: Dict[str, Any] = {}
+        if name == 'gzip':
+            import gzip
+            if self.level is not None:
+                kwargs['compresslevel'] = self.level
+            return (lambda d: gzip.compress(d, mtime=0, **kwargs),
+                    gzip.decompress)
+        elif name == 'bz2':
+            import bz2
+            if self.level is not None:
+                kwargs['compresslevel'] = self.level
+            return (lambda d: bz2.compress(d, **kwargs), bz2.decompress)
+        elif name == 'lzma':
+            import lzma
+            if self.level is not None:
+                kwargs['preset'] = self.level
+            return (lambda d: lzma.compress(d, **kwargs), lzma.decompress)
+        elif name == 'zstd':
+            try:
+                from compression import zstd
+                if self.level is not None:
+                    kwargs['level'] = self.level
+                return (lambda d: zstd.compress(d, **kwargs), zstd.decompress)
+            except ModuleNotFoundError:
+                pass
+            try:
+                import zstandard
+            except ModuleNotFoundError as e:
+                raise PersistableError(
+                    "Module zstandard is not installed, use: " +
+                    "'pip install zstandard'") from e
+            comp = zstandard.ZstdCompressor(
+                level=3 if self.level is None else self.level)
+            decomp = zstandard.ZstdDecompressor()
+            return (comp.compress, decomp.decompress)
+        elif name == 'lz4':
+            try:
+                import lz4.frame
+            except ModuleNotFoundError as e:
+                raise PersistableError(
+                    "Module lz4 is not installed, use: 'pip install lz4'") \
+                    from e
+            if self.level is not None:
+                kwargs['compression_level'] = self.level
+            return (lambda d: lz4.frame.compress(d, **kwargs),
+                    lz4.frame.decompress)
+        raise PersistableError(f'Unknown compressor: {name}')
+
+    def dumps(self, inst: Any) -> bytes:
+        return self._compress(self.codec.dumps(inst))
+
+    def loads(self, data: Buffer) -> Any:
+        return self.codec.loads(self._decompress(data))
+
+    def __getstate__(self) -> Dict[str, Any]:
+        state: Dict[str, Any] = dict(self.__dict__)
+        del state['_compress']
+        del state['_decompress']
+        return state
+
+    def __setstate__(self, state: Dict[str, Any]):
+        self.__dict__.update(state)
+        self.__post_init__()
+
+
+@dataclass
+class NumpyCodec(Codec):
+    """Writes NumPy arrays in the ``.npy`` format and all other objects with
+    :obj:`codec`.  Arrays of type ``object`` are always given to :obj:`codec`
+    since they can not be stored without pickling.
+
+    """
+    _NPY_MAGIC = b'\x93NUMPY'
+
+    codec: Codec = field(default_factory=PickleCodec)
+    """The codec used for objects that are not NumPy arrays."""
+
+    def __post_init__(self):
+        try:
+            import numpy
+        except ModuleNotFoundError as e:
+            raise PersistableError(
+                "Module numpy is not installed, use: 'pip install numpy'") \
+                from e
+        self._np = numpy
+
+    def _is_array(self, inst: Any) -> bool:
+        return isinstance(inst, self._np.ndarray) and not inst.dtype.hasobject
+
+    def dumps(self, inst: Any) -> bytes:
+        if self._is_array(inst):
+            bio = BytesIO()
+            self._np.save(bio, inst, allow_pickle=False)
+            return bio.getvalue()
+        return self.codec.dumps(inst)
+
+    def loads(self, data: Buffer) -> Any:
+        if data[:len(self._NPY_MAGIC)] == self._NPY_MAGIC:
+            return self._np.load(BytesIO(data), allow_pickle=False)
+        return self.codec.loads(data)
+
+    def dump(self, inst: Any, f: BinaryIO):
+        if self._is_array(inst):
+            self._np.save(f, inst, allow_pickle=False)
+        else:
+            self.codec.dump(inst, f)
+
+    def load(self, f: BinaryIO) -> Any:
+        magic: bytes = f.read(len(self._NPY_MAGIC))
+        f.seek(0)
+        if magic == self._NPY_MAGIC:
+            return self._np.load(f, allow_pickle=False)
+        return self.codec.load(f)
+
+    def __getstate__(self) -> Dict[str, Any]:
+        return {'codec': self.codec}
+
+    def __setstate__(self, state: Dict[str, Any]):
+        self.__dict__.update(state)
+        self.__post_init__()
@@ -9,7 +9,7 @@ import collections
 from functools import reduce
 from pathlib import Path
 import shutil
-from . import PersistableError, DirectoryStash
+from . import PersistableError, Codec, DirectoryStash
 
 logger = logging.getLogger(__name__)
 
@@ -49,7 +49,8 @@ class DirectoryCompositeStash(DirectoryStash):
     COMPOSITE_DIRECTORY_NAME = 'comp'
 
     def __init__(self, path: Path, groups: Tuple[Set[str], ...],
-                 attribute_name: str, load_keys: Set[str] = None):
+                 attribute_name: str, load_keys: Set[str] = None,
+                 codec: Codec = None):
         """Initialize using the parent class's default pattern.
 
         :param path: the directory that will have to subdirectories with the
@@ -71,8 +72,14 @@ class DirectoryCompositeStash(DirectoryStash):
                           for all keys; this can be set after the creation of
                           the instance as well
 
+        :param codec: encodes and decodes the files of the item instance
+                      directory and the composite data directories, or
+                      ``None`` for the :class:`.DirectoryStash` default
+
         """
         super().__init__(path)
+        if codec is not None:
+            self.codec = codec
         self.attribute_name = attribute_name
         self.load_keys = load_keys
         if load_keys is not None and not isinstance(load_keys, set):
@@ -114,7 +121,7 @@ class DirectoryCompositeStash(DirectoryStash):
         for group in groups:
             name = '-'.join(sorted(group))
             path = comp_path / name
-            comp_stash = DirectoryStash(path)
+            comp_stash = DirectoryStash(path, codec=self.codec)
             comp_stash.group = group
             comp_stash.group_name = name
             for k in group:
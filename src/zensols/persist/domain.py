@@ -67,6 +67,45 @@ class chunks(object):
         return ds
 
 
+class split_chunks(object):
+    """An iterable that lazily splits an iterable of a known length in to
+    ``n`` chunks with sizes that differ by at most one.  Unlike :class:`chunks`
+    given the length divided by ``n``, this does not leave a smaller (or
+    missing) last chunk.  Elements past the length are returned in chunks no
+    larger than the first.
+
+    """
+    def __init__(self, iterable: iter, length: int, n: int):
+        """Initialize the chunker.
+
+        :param iterable: any iterable object
+
+        :param length: the number of elements in ``iterable``
+
+        :param n: the number of chunks
+
+        """
+        self.iterable = iterable
+        self.length = length
+        self.n = n
+
+    def __iter__(self):
+        data: iter = iter(self.iterable)
+        size, rem = divmod(self.length, self.n)
+        i: int
+        for i in range(self.n):
+            csize: int = size + (1 if i < rem else 0)
+            if csize == 0:
+                # fewer elements than chunks
+                break
+            chunk: list = list(it.islice(data, csize))
+            if len(chunk) == 0:
+                return
+            yield chunk
+        # an underestimated length leaves elements to drain
+        yield from chunks(data, max(1, size + (1 if rem > 0 else 0)))
+
+
 class Stash(ABC):
     """A dictionary-like pure virtual class for CRUDing data, most of which read
     and write to/from the file system.  One major difference is dictionaries
@@ -152,6 +191,42 @@ class Stash(ABC):
         """
         pass
 
+    def load_many(self, names: Iterable[str]) -> Iterable[Tuple[str, Any]]:
+        """Load the data of several keys.  This default implementation calls
+        :meth:`load` for each key, which is overridden by stashes that can do
+        better by batching the operation.
+
+        :param names: the keys of the data to load
+
+        :return: ``(key, item)`` tuples in the order of ``names``, which might
+                 be lazily evaluated
+
+        """
+        return map(lambda k: (k, self.load(k)), names)
+
+    def dump_many(self, items: Iterable[Tuple[str, Any]]):
+        """Persist several data values with their respective keys.  Each item
+        is persisted (or copied) before the next is taken from ``items``, so
+        the caller can free an item after it has been given.
+
+        :param items: ``(key, item)`` tuples to persist
+
+        """
+        name: str
+        inst: Any
+        for name, inst in items:
+            self.dump(name, inst)
+
+    def exists_many(self, names: Iterable[str]) -> Set[str]:
+        """Return the subset of keys ``names`` that have data."""
+        return set(filter(self.exists, names))
+
+    def delete_many(self, names: Iterable[str]):
+        """Delete the data of several keys."""
+        name: str
+        for name in names:
+            self.delete(name)
+
     def key_groups(self, n):
         "Return an iterable of groups of keys, each of size at least ``n``."
         return chunks(self.keys(), n)
@@ -361,6 +436,15 @@ class DelegateStash(CloseableStash, metaclass=ABCMeta):
             self._debug(
                 f'calling method <{meth}> on delegate {type(self.delegate)}')
 
+    def _is_pass_through(self, *meths: str) -> bool:
+        """Whether none of methods ``meths`` are overridden by a subclass,
+        which means batch operations can be given directly to the delegate.
+
+        """
+        cls: type = type(self)
+        return self.delegate is not None and all(map(
+            lambda m: getattr(cls, m) is getattr(DelegateStash, m), meths))
+
     def load(self, name: str) -> Any:
         self._debug_meth('load')
         if self.delegate is not None:
@@ -404,6 +488,38 @@ class DelegateStash(CloseableStash, metaclass=ABCMeta):
             return self.delegate.keys()
         return ()
 
+    def load_many(self, names: Iterable[str]) -> Iterable[Tuple[str, Any]]:
+        if self._is_pass_through('load'):
+            return self.delegate.load_many(names)
+        return super().load_many(names)
+
+    def dump_many(self, items: Iterable[Tuple[str, Any]]):
+        if self._is_pass_through('dump'):
+            self.delegate.dump_many(items)
+        else:
+            super().dump_many(items)
+
+    def exists_many(self, names: Iterable[str]) -> Set[str]:
+        if self._is_pass_through('exists'):
+            return self.delegate.exists_many(names)
+        return super().exists_many(names)
+
+    def delete_many(self, names: Iterable[str]):
+        if self._is_pass_through('delete'):
+            self.delegate.delete_many(names)
+        else:
+            super().delete_many(names)
+
+    def values(self) -> Iterable[Any]:
+        if self._is_pass_through('get', 'keys', '__getitem__'):
+            return self.delegate.values()
+        return super().values()
+
+    def items(self) -> Tuple[str, Any]:
+        if self._is_pass_through('get', 'keys', '__getitem__'):
+            return self.delegate.items()
+        return super().items()
+
     def clear(self):
         self._debug_meth('clear')
         if self.delegate is not None:
@@ -537,15 +653,21 @@ class PreemptiveStash(DelegateStash):
         return self._calculate_has_data()
 
     def _calculate_has_data(self) -> bool:
-        """Return ``True`` if the delegate has keys.
+        """Return ``True`` if the delegate has keys.  The length of the
+        delegate is used when it overrides ``len``, which is assumed to be
+        cheaper than getting its keys (i.e. :class:`.KeyIndexStash`).
 
         """
         if self._has_data is None:
-            try:
-                next(iter(self.delegate.keys()))
-                self._has_data = True
-            except StopIteration:
-                self._has_data = False
+            delegate: Stash = self.delegate
+            if type(delegate).__len__ is not Stash.__len__:
+                self._has_data = len(delegate) > 0
+            else:
+                try:
+                    next(iter(delegate.keys()))
+                    self._has_data = True
+                except StopIteration:
+                    self._has_data = False
         return self._has_data
 
     def _reset_has_data(self):
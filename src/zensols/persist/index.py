@@ -0,0 +1,306 @@
+"""A persistent index of stash keys, and a stash that maintains one.
+
+"""
+__author__ = 'Paul Landes'
+
+from typing import Dict, Iterable, Tuple, Set, List, Any, Optional, KeysView
+from dataclasses import dataclass, field
+import logging
+import os
+from pathlib import Path
+from zensols.util.lock import FileLock
+from . import PersistableError, DelegateStash
+
+logger = logging.getLogger(__name__)
+
+
+@dataclass
+class KeyIndex(object):
+    """A persistent, append only journal of keys.  Each added key is written as
+    a ``+<key>`` line and each removed key as a ``-<key>`` line.  The journal
+    is replayed in to an in memory ordered set, which makes :meth:`__len__`
+    and :meth:`__contains__` constant time operations (other than a
+    :func:`os.stat` to detect changes).
+
+    Other processes that append to the same file are picked up incrementally
+    by reading only the part of the journal that was written since the last
+    read.  Each record is written with a single system call to a file opened in
+    append mode, so concurrent appends from several processes do not
+    interleave.  Keys are converted to strings and can not contain newlines.
+
+    """
+    _ADD = '+'
+    _DEL = '-'
+
+    path: Path = field()
+    """The journal file of keys."""
+
+    def __post_init__(self):
+        self._reset()
+
+    def _reset(self):
+        self._keys: Dict[str, None] = {}
+        self._offset: int = 0
+        self._ino: Optional[int] = None
+        self._records: int = 0
+
+    def _stat(self) -> Optional[os.stat_result]:
+        try:
+            return self.path.stat()
+        except FileNotFoundError:
+            return None
+
+    def _refresh(self):
+        """Replay any records written since the last read."""
+        st: os.stat_result = self._stat()
+        if st is None:
+            if self._ino is not None:
+                # the journal was deleted out from under us
+                self._reset()
+            return
+        if st.st_ino != self._ino or st.st_size < self._offset:
+            # replaced (i.e. compacted) by this or another process
+            if logger.isEnabledFor(logging.DEBUG):
+                logger.debug(f'reloading key index: {self.path}')
+            self._reset()
+            self._ino = st.st_ino
+        if st.st_size > self._offset:
+            with open(self.path, 'rb') as f:
+                f.seek(self._offset)
+                data: bytes = f.read(st.st_size - self._offset)
+            # only consume completed records in case of a concurrent write
+            end: int = data.rfind(b'\n') + 1
+            if end > 0:
+                self._apply(data[:end].decode('utf-8').splitlines())
+                self._offset += end
+
+    def _apply(self, lines: Iterable[str]):
+        keys: Dict[str, None] = self._keys
+        line: str
+        for line in lines:
+            if len(line) == 0:
+                continue
+            key: str = line[1:]
+            if line[0] == self._ADD:
+                keys[key] = None
+            else:
+                keys.pop(key, None)
+            self._records += 1
+
+    def _write(self, op: str, keys: Iterable[str]):
+        recs: Tuple[str, ...] = tuple(keys)
+        if len(recs) == 0:
+            return
+        key: str
+        for key in recs:
+            if '\n' in key:
+                raise PersistableError(f'Keys can not have newlines: {key!r}')
+        data: bytes = ''.join(map(lambda k: f'{op}{k}\n', recs)).encode()
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        fd: int = os.open(self.path, os.O_WRONLY | os.O_APPEND | os.O_CREAT,
+                          0o644)
+        try:
+            os.write(fd, data)
+        finally:
+            os.close(fd)
+        self._refresh()
+
+    def add(self, key: str):
+        """Add ``key`` to the index if it is not already present."""
+        self.add_many((key,))
+
+    def add_many(self, keys: Iterable[str]):
+        """Add all ``keys`` with a single write to the journal."""
+        self._refresh()
+        present: Dict[str, None] = self._keys
+        self._write(self._ADD,
+                    filter(lambda k: k not in present, map(str, keys)))
+
+    def remove(self, key: str):
+        """Remove ``key`` from the index if it is present."""
+        self.remove_many((key,))
+
+    def remove_many(self, keys: Iterable[str]):
+        """Remove all ``keys`` with a single write to the journal."""
+        self._refresh()
+        present: Dict[str, None] = self._keys
+        self._write(self._DEL, filter(lambda k: k in present, map(str, keys)))
+
+    def exists_many(self, keys: Iterable[str]) -> Set[str]:
+        """Return the subset of ``keys`` in the index."""
+        self._refresh()
+        present: Dict[str, None] = self._keys
+        return set(filter(lambda k: str(k) in present, keys))
+
+    def keys(self) -> KeysView:
+        """Return a set-like snapshot of the keys in the order they were
+        added.
+
+        """
+        self._refresh()
+        return dict(self._keys).keys()
+
+    @property
+    def garbage(self) -> int:
+        """The number of journal records that no longer contribute a key, which
+        is the space :meth:`compact` reclaims.
+
+        """
+        self._refresh()
+        return self._records - len(self._keys)
+
+    def compact(self):
+        """Rewrite the journal with only the keys currently in the index.  The
+        file is replaced atomically, but appends from other processes during
+        the compaction are lost, so only call this when no other process
+        writes to the index.
+
+        """
+        self._refresh()
+        self.replace(tuple(self._keys))
+
+    def replace(self, keys: Iterable[str]):
+        """Atomically replace the journal with one that has only ``keys``.  The
+        journal file is created even when there are no keys.  Like
+        :meth:`compact`, appends from other processes during the replacement
+        are lost.
+
+        """
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        tmp: Path = self.path.parent / f'.{self.path.name}.tmp'
+        with open(tmp, 'w') as f:
+            f.writelines(map(lambda k: f'{self._ADD}{k}\n',
+                             dict.fromkeys(map(str, keys))))
+        os.replace(tmp, self.path)
+        self._reset()
+        self._refresh()
+
+    def clear(self):
+        """Remove all keys and the journal file."""
+        self.path.unlink(missing_ok=True)
+        self._reset()
+
+    def __contains__(self, key: str) -> bool:
+        self._refresh()
+        return str(key) in self._keys
+
+    def __len__(self) -> int:
+        self._refresh()
+        return len(self._keys)
+
+    def __iter__(self) -> Iterable[str]:
+        return iter(self.keys())
+
+
+@dataclass
+class KeyIndexStash(DelegateStash):
+    """A stash that keeps the keys of its :obj:`delegate` in a
+    :class:`.KeyIndex` updated by :meth:`dump` and :meth:`delete`.  Keys,
+    existence checks and the length of the stash are then answered from the
+    index rather than the delegate, which for a :class:`.DirectoryStash`, would
+    otherwise list the directory.  This also makes
+    :obj:`~zensols.persist.domain.PreemptiveStash.has_data` and the missing key
+    calculation of :class:`~zensols.multi.factory.MultiProcessRobustStash`
+    cheap when this stash is their delegate.
+
+    The index is created from the delegate's keys the first time it is used
+    when the index file does not exist.  Only one process creates it while
+    holding a :class:`~zensols.util.lock.FileLock`, and the others wait to use
+    it.  Use :meth:`rebuild_index` if the data of the delegate is modified
+    without this stash.
+
+    """
+    index_path: Path = field()
+    """The journal file of the key index."""
+
+    def __post_init__(self):
+        super().__post_init__()
+        self._index: Optional[KeyIndex] = None
+
+    @property
+    def index(self) -> KeyIndex:
+        """The index of the delegate's keys."""
+        if self._index is None:
+            index = KeyIndex(self.index_path)
+            if not self.index_path.exists():
+                with self._lock:
+                    # another process created it while waiting for the lock
+                    if not self.index_path.exists():
+                        self._build_index(index)
+            self._index = index
+        return self._index
+
+    @property
+    def _lock(self) -> FileLock:
+        path: Path = self.index_path
+        return FileLock(path.parent / f'.{path.name}.lock', remove=True)
+
+    def _build_index(self, index: KeyIndex) -> int:
+        keys: Tuple[str, ...] = tuple(self.delegate.keys())
+        index.replace(keys)
+        if logger.isEnabledFor(logging.INFO):
+            logger.info(f'indexed {len(keys)} keys in {self.index_path}')
+        return len(keys)
+
+    def rebuild_index(self) -> int:
+        """Recreate the key index from the keys of the delegate.  The journal
+        is replaced atomically, but keys added by other processes during the
+        rebuild are lost, so only call this when no other process writes to
+        the stash.
+
+        :return: the number of keys in the rebuilt index
+
+        """
+        with self._lock:
+            return self._build_index(self.index)
+
+    def exists(self, name: str) -> bool:
+        return name in self.index
+
+    def exists_many(self, names: Iterable[str]) -> Set[str]:
+        return self.index.exists_many(names)
+
+    def keys(self) -> Iterable[str]:
+        return self.index.keys()
+
+    def dump(self, name: str, inst: Any):
+        super().dump(name, inst)
+        self.index.add(name)
+
+    def dump_many(self, items: Iterable[Tuple[str, Any]]):
+        names: List[str] = []
+
+        def add_name(item: Tuple[str, Any]) -> Tuple[str, Any]:
+            names.append(item[0])
+            return item
+
+        try:
+            self.delegate.dump_many(map(add_name, items))
+        finally:
+            self.index.add_many(names)
+
+    def delete(self, name: str = None):
+        if name is None:
+            self.clear()
+        else:
+            super().delete(name)
+            self.index.remove(name)
+
+    def delete_many(self, names: Iterable[str]):
+        names = tuple(names)
+        self.delegate.delete_many(names)
+        self.index.remove_many(names)
+
+    def values(self) -> Iterable[Any]:
+        return map(lambda t: t[1], self.items())
+
+    def items(self) -> Tuple[str, Any]:
+        return filter(lambda t: t[1] is not None,
+                      self.delegate.load_many(tuple(self.keys())))
+
+    def clear(self):
+        super().clear()
+        self.index.clear()
+
+    def __len__(self) -> int:
+        return len(self.index)
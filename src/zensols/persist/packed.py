@@ -0,0 +1,421 @@
+"""A stash that appends items to a small number of large segment files.
+
+"""
+__author__ = 'Paul Landes'
+
+from typing import Any, Dict, Tuple, Set, Iterable, List, Optional, BinaryIO
+from dataclasses import dataclass, field
+import logging
+import os
+import re
+import struct
+import mmap
+from pathlib import Path
+from zensols.util.lock import FileLock
+from . import PersistableError, Codec, PickleCodec, CloseableStash
+
+logger = logging.getLogger(__name__)
+
+
+@dataclass
+class PackedStash(CloseableStash):
+    """A stash that appends encoded items as records to segment files in
+    :obj:`path` rather than creating a file for each item.  An in memory index
+    maps each key to the segment, offset and length of its record.  The index
+    is created by scanning the record headers of the segments, and afterward,
+    updated incrementally by reading only what was appended.
+
+    When :obj:`aligned` is ``True``, the payload of each record starts on a
+    :obj:`.PickleCodec.ALIGNMENT` byte boundary in the segment file.  With a
+    :class:`.MemoryMapCodec`, the arrays of loaded items are then aligned
+    read-only views of the memory mapped segment rather than heap copies.
+
+    Records are never changed in place.  Overwriting or deleting an item
+    appends a new record (a tombstone for deletes) and the space used by the
+    old record is reclaimed with :meth:`compact`.
+
+    Appends are serialized across processes with a :class:`.FileLock`, so
+    several processes (i.e. the children of a
+    :class:`~zensols.multi.stash.MultiProcessStash`) can dump to the same
+    stash concurrently.  Records written by other processes are available after
+    :meth:`refresh` is called, which is done for key and length access and when
+    a key is not found.
+
+    """
+    ATTR_EXP_META = ('path', 'segment_size')
+
+    _HEADER = struct.Struct('<BIQ')
+    _PUT = 1
+    _DEL = 0
+    _ALIGNED = 2
+    _SEGMENT_REGEX = re.compile(r'^seg-(\d+)\.pack$')
+
+    path: Path = field()
+    """The directory with the segment files."""
+
+    segment_size: int = field(default=1 << 30)
+    """The size in bytes after which a new segment file is started."""
+
+    use_mmap: bool = field(default=True)
+    """Whether to read records using memory mapped segment files."""
+
+    codec: Codec = field(default_factory=PickleCodec)
+    """Encodes and decodes the data of each record."""
+
+    aligned: bool = field(default=False)
+    """Whether to align record payloads (see class docs)."""
+
+    batch_size: int = field(default=1 << 22)
+    """The number of bytes of records buffered by :meth:`dump_many` before they
+    are appended to the segment with the lock held.
+
+    """
+
+    def __post_init__(self):
+        if not isinstance(self.path, Path):
+            raise PersistableError(
+                f'Expecting pathlib.Path but got: {self.path.__class__}')
+        self._reset()
+
+    def _reset(self):
+        self._pid: int = os.getpid()
+        # key -> (segment ID, payload offset, payload length)
+        self._index: Dict[str, Tuple[int, int, int]] = {}
+        # segment ID -> offset after the last complete record read
+        self._scanned: Dict[int, int] = {}
+        self._maps: Dict[int, mmap.mmap] = {}
+        self._append: Optional[Tuple[int, BinaryIO]] = None
+        self._garbage: int = 0
+
+    @property
+    def _lock(self) -> FileLock:
+        return FileLock(self.path / '.lock')
+
+    def _segment_path(self, seg: int) -> Path:
+        return self.path / f'seg-{seg:06d}.pack'
+
+    def _segments(self) -> List[int]:
+        """Return the sorted segment IDs found on the file system."""
+        if not self.path.is_dir():
+            return []
+        segs: List[int] = []
+        name: str
+        for name in os.listdir(self.path):
+            m: re.Match = self._SEGMENT_REGEX.match(name)
+            if m is not None:
+                segs.append(int(m.group(1)))
+        segs.sort()
+        return segs
+
+    def _assert_pid(self):
+        # open files and maps are not shared with forked processes
+        if self._pid != os.getpid():
+            self._reset()
+
+    def _read_at(self, seg: int, offset: int, length: int) -> bytes:
+        with open(self._segment_path(seg), 'rb') as f:
+            f.seek(offset)
+            return f.read(length)
+
+    def _scan(self, seg: int) -> int:
+        """Add the records appended to segment ``seg`` since the last scan to
+        the index.
+
+        :return: the offset after the last complete record in the segment
+
+        """
+        start: int = self._scanned.get(seg, 0)
+        path: Path = self._segment_path(seg)
+        size: int = path.stat().st_size
+        if size <= start:
+            return start
+        hsize: int = self._HEADER.size
+        index: Dict[str, Tuple[int, int, int]] = self._index
+        with open(path, 'rb') as f:
+            f.seek(start)
+            data: bytes = f.read(size - start)
+        pos: int = 0
+        dlen: int = len(data)
+        while pos + hsize <= dlen:
+            op, klen, plen = self._HEADER.unpack_from(data, pos)
+            poff: int = pos + hsize + klen
+            if op & self._ALIGNED:
+                poff += PickleCodec._pad(start + poff)
+            end: int = poff + plen
+            if end > dlen:
+                # incomplete record being written or left by a crash
+                break
+            key: str = data[pos + hsize:pos + hsize + klen].decode('utf-8')
+            prev: Tuple[int, int, int] = index.pop(key, None)
+            if prev is not None:
+                self._garbage += prev[2]
+            if op & self._PUT:
+                index[key] = (seg, start + poff, plen)
+            else:
+                self._garbage += poff - pos
+            pos = end
+        self._scanned[seg] = start + pos
+        return start + pos
+
+    def refresh(self):
+        """Update the index with records written by other processes."""
+        self._assert_pid()
+        segs: List[int] = self._segments()
+        if not self._scanned.keys() <= set(segs):
+            # segments were removed by a compaction in another process
+            self.close()
+            self._reset()
+        seg: int
+        for seg in segs:
+            self._scan(seg)
+
+    @staticmethod
+    def _close_map(mm: mmap.mmap):
+        try:
+            mm.close()
+        except BufferError:
+            # loaded items still reference the map, which is unmapped after
+            # they are garbage collected
+            pass
+
+    def _load_record(self, seg: int, offset: int, length: int) -> Any:
+        if not self.use_mmap:
+            return self.codec.loads(self._read_at(seg, offset, length))
+        mm: mmap.mmap = self._maps.get(seg)
+        if mm is None or len(mm) < offset + length:
+            if mm is not None:
+                self._close_map(mm)
+            with open(self._segment_path(seg), 'rb') as f:
+                mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+            self._maps[seg] = mm
+        return self.codec.loads(memoryview(mm)[offset:offset + length])
+
+    def load(self, name: str) -> Any:
+        self._assert_pid()
+        loc: Tuple[int, int, int] = self._index.get(name)
+        if loc is None:
+            self.refresh()
+            loc = self._index.get(name)
+        if loc is not None:
+            try:
+                return self._load_record(*loc)
+            except FileNotFoundError:
+                # the segment was compacted by another process
+                self.close()
+                self._reset()
+                self.refresh()
+                loc = self._index.get(name)
+                if loc is not None:
+                    return self._load_record(*loc)
+
+    def exists(self, name: str) -> bool:
+        self._assert_pid()
+        if name not in self._index:
+            self.refresh()
+        return name in self._index
+
+    def keys(self) -> Iterable[str]:
+        self.refresh()
+        return tuple(self._index)
+
+    def _open_append(self) -> Tuple[int, BinaryIO]:
+        """Return the file of the active segment to append.  This must be
+        called with the lock held.
+
+        """
+        segs: List[int] = self._segments()
+        seg: int = segs[-1] if len(segs) > 0 else 0
+        if self._append is not None:
+            aseg, f = self._append
+            if aseg != seg or os.fstat(f.fileno()).st_nlink == 0:
+                # another process rolled over or compacted the segment
+                f.close()
+                self._append = None
+        if self._append is None:
+            self.path.mkdir(parents=True, exist_ok=True)
+            path: Path = self._segment_path(seg)
+            if path.exists() and path.stat().st_size >= self.segment_size:
+                seg += 1
+                path = self._segment_path(seg)
+            self._append = (seg, open(path, 'ab'))
+        return self._append
+
+    def _record_head(self, pos: int, op: int, key: str, plen: int) -> bytes:
+        """Return the header, key and any alignment padding of a record
+        written at file position ``pos``.
+
+        """
+        kdata: bytes = key.encode('utf-8')
+        if self.aligned:
+            op |= self._ALIGNED
+        head: bytes = self._HEADER.pack(op, len(kdata), plen) + kdata
+        if self.aligned:
+            head += b'\x00' * PickleCodec._pad(pos + len(head))
+        return head
+
+    def _append_batch(self, records: List[Tuple[int, str, bytes]]):
+        """Append encoded ``(operation, key, payload)`` records to the active
+        segment with the lock held.
+
+        """
+        with self._lock:
+            seg, f = self._open_append()
+            # index what others wrote first so ours ends up last in the index
+            end: int = self._scan(seg)
+            pos: int = f.seek(0, os.SEEK_END)
+            if pos != end:
+                logger.warning(
+                    f'truncating incomplete record in segment {seg} ' +
+                    f'at {end} (size={pos})')
+                f.truncate(end)
+                pos = f.seek(end)
+            for op, key, payload in records:
+                head: bytes = self._record_head(pos, op, key, len(payload))
+                f.write(head)
+                f.write(payload)
+                pos += len(head) + len(payload)
+                if pos >= self.segment_size:
+                    f.flush()
+                    self._scan(seg)
+                    f.close()
+                    self._append = None
+                    seg, f = self._open_append()
+                    pos = f.seek(0, os.SEEK_END)
+            f.flush()
+            self._scan(seg)
+
+    def _write(self, records: Iterable[Tuple[int, str, bytes]]):
+        """Append ``(operation, key, payload)`` records to the active segment.
+        The records are consumed and buffered without the lock, which is held
+        only to append each batch of about :obj:`batch_size` bytes.  This
+        keeps the (possibly lazy and expensive) creation of the records from
+        serializing other processes writing to the stash.
+
+        """
+        self._assert_pid()
+        batch: List[Tuple[int, str, bytes]] = []
+        size: int = 0
+        rec: Tuple[int, str, bytes]
+        for rec in records:
+            batch.append(rec)
+            size += len(rec[1]) + len(rec[2])
+            if size >= self.batch_size:
+                self._append_batch(batch)
+                batch = []
+                size = 0
+        if len(batch) > 0:
+            self._append_batch(batch)
+
+    def dump(self, name: str, inst: Any):
+        if logger.isEnabledFor(logging.DEBUG):
+            self._debug(f'saving instance: {name} -> {type(inst)}')
+        self._write(((self._PUT, name, self.codec.dumps(inst)),))
+
+    def delete(self, name: str = None):
+        if name is None:
+            self.clear()
+        elif self.exists(name):
+            self._write(((self._DEL, name, b''),))
+
+    def dump_many(self, items: Iterable[Tuple[str, Any]]):
+        # encode lazily outside the lock so only a batch is in memory
+        self._write(map(lambda t: (self._PUT, t[0], self.codec.dumps(t[1])),
+                        items))
+
+    def exists_many(self, names: Iterable[str]) -> Set[str]:
+        self.refresh()
+        return set(filter(self._index.__contains__, names))
+
+    def delete_many(self, names: Iterable[str]):
+        present: Set[str] = self.exists_many(names)
+        if len(present) > 0:
+            self._write(map(lambda k: (self._DEL, k, b''), present))
+
+    @property
+    def garbage(self) -> int:
+        """The number of bytes used by overwritten and deleted records, which
+        is the space reclaimed by :meth:`compact`.
+
+        """
+        self.refresh()
+        return self._garbage
+
+    def compact(self):
+        """Write all current items to a new segment and remove all others.
+        Other processes continue to read from the unlinked segments they have
+        mapped, and reload their index when a removed segment is accessed.
+
+        """
+        with self._lock:
+            self.refresh()
+            segs: List[int] = self._segments()
+            if len(segs) == 0:
+                return
+            old: Dict[str, Tuple[int, int, int]] = dict(self._index)
+            self.close()
+            nseg: int = segs[-1] + 1
+            path: Path = self._segment_path(nseg)
+            tmp: Path = self.path / f'.{path.name}.tmp'
+            srcs: Dict[int, BinaryIO] = {}
+            try:
+                with open(tmp, 'wb') as f:
+                    pos: int = 0
+                    key: str
+                    loc: Tuple[int, int, int]
+                    for key, loc in sorted(old.items(), key=lambda t: t[1]):
+                        seg, offset, length = loc
+                        src: BinaryIO = srcs.get(seg)
+                        if src is None:
+                            src = open(self._segment_path(seg), 'rb')
+                            srcs[seg] = src
+                        src.seek(offset)
+                        head: bytes = self._record_head(
+                            pos, self._PUT, key, length)
+                        f.write(head)
+                        f.write(src.read(length))
+                        pos += len(head) + length
+            finally:
+                for src in srcs.values():
+                    src.close()
+            os.replace(tmp, path)
+            seg: int
+            for seg in segs:
+                self._segment_path(seg).unlink()
+            self._reset()
+            self._scan(nseg)
+        if logger.isEnabledFor(logging.INFO):
+            logger.info(f'compacted {len(segs)} segments in to {path} ' +
+                        f'with {len(old)} items')
+
+    def clear(self):
+        with self._lock:
+            self.close()
+            seg: int
+            for seg in self._segments():
+                self._segment_path(seg).unlink()
+            self._reset()
+
+    def close(self):
+        if self._append is not None:
+            self._append[1].close()
+        mm: mmap.mmap
+        for mm in self._maps.values():
+            self._close_map(mm)
+        self._append = None
+        self._maps.clear()
+
+    def __getstate__(self) -> Dict[str, Any]:
+        return {'path': self.path,
+                'segment_size': self.segment_size,
+                'use_mmap': self.use_mmap,
+                'codec': self.codec,
+                'aligned': self.aligned,
+                'batch_size': self.batch_size}
+
+    def __setstate__(self, state: Dict[str, Any]):
+        self.__dict__.update(state)
+        self._reset()
+
+    def __len__(self) -> int:
+        self.refresh()
+        return len(self._index)
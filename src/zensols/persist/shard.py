@@ -0,0 +1,203 @@
+"""A directory stash that spreads its files over hashed sub-directories.
+
+"""
+__author__ = 'Paul Landes'
+
+from typing import Any, Iterable, Set, List, Tuple
+from dataclasses import dataclass, field
+import logging
+import hashlib
+import shutil
+from pathlib import Path
+import parse
+from . import PersistableError, DirectoryStash, KeyIndex
+
+logger = logging.getLogger(__name__)
+
+
+@dataclass
+class ShardedDirectoryStash(DirectoryStash):
+    """Like :class:`.DirectoryStash` but distributes the pickled files over a
+    fan-out of sub-directories named by the hash of the key.  This keeps the
+    number of entries in each directory small for stashes with millions of
+    items.
+
+    The keys of the stash are kept in a :class:`.KeyIndex` file in the root
+    :obj:`path` directory, so :meth:`keys`, :meth:`exists` and ``len`` do not
+    need to scan the directories.
+
+    An existing (flat) :class:`.DirectoryStash` directory is converted in place
+    with :meth:`migrate`.
+
+    """
+    ATTR_EXP_META = ('path', 'pattern', 'levels', 'width')
+
+    levels: int = field(default=2)
+    """The depth of the shard sub-directories."""
+
+    width: int = field(default=2)
+    """The number of hexadecimal characters for each shard directory name,
+    which is 256 directories per level for the default of 2.
+
+    """
+    index_name: str = field(default='keys.idx')
+    """The name of the key index file in the root :obj:`path` directory."""
+
+    def __post_init__(self):
+        super().__post_init__()
+        if self.levels < 1 or self.width < 1:
+            raise PersistableError(
+                f'Levels and width must be positive: {self.levels}, ' +
+                f'{self.width}')
+        if (self.levels * self.width) > 64:
+            raise PersistableError(
+                f'Shard depth too large: {self.levels} * {self.width}')
+        self._shard_dirs: Set[Path] = set()
+        self._index = None
+
+    @property
+    def index(self) -> KeyIndex:
+        """The index of keys kept in the root directory."""
+        if self._index is None:
+            self._index = KeyIndex(self.path / self.index_name)
+        return self._index
+
+    def _shard_path(self, name: str) -> Path:
+        """Return the shard directory of the data with key ``name``."""
+        digest: str = hashlib.blake2s(str(name).encode()).hexdigest()
+        w: int = self.width
+        return self.path.joinpath(
+            *map(lambda i: digest[i * w:(i + 1) * w], range(self.levels)))
+
+    def _name_to_path(self, name: str) -> Path:
+        fname = self.pattern.format(**{'name': name})
+        return self._shard_path(name) / fname
+
+    def key_to_path(self, name: str) -> Path:
+        return self._name_to_path(name)
+
+    def _assert_shard_dir(self, path: Path):
+        parent: Path = path.parent
+        if parent not in self._shard_dirs:
+            parent.mkdir(parents=True, exist_ok=True)
+            self._shard_dirs.add(parent)
+
+    def load(self, name: str) -> Any:
+        path: Path = self.key_to_path(name)
+        inst: Any = None
+        try:
+            inst = self._load_file(path)
+        except FileNotFoundError:
+            pass
+        if logger.isEnabledFor(logging.DEBUG):
+            self._debug(f'loaded instance: {name} -> {type(inst)}')
+        return inst
+
+    def exists(self, name: str) -> bool:
+        return name in self.index
+
+    def keys(self) -> Iterable[str]:
+        return self.index.keys()
+
+    def dump(self, name: str, inst: Any):
+        if logger.isEnabledFor(logging.DEBUG):
+            self._debug(f'saving instance: {name} -> {type(inst)}')
+        path: Path = self.key_to_path(name)
+        self._assert_shard_dir(path)
+        self._dump_file(inst, path)
+        self.index.add(name)
+
+    def delete(self, name: str):
+        if logger.isEnabledFor(logging.DEBUG):
+            self._debug(f'deleting instance: {name}')
+        path: Path = self.key_to_path(name)
+        if path.exists():
+            path.unlink()
+        elif logger.isEnabledFor(logging.WARNING):
+            logger.warning(f'does not exist: {name}')
+        self.index.remove(name)
+
+    def dump_many(self, items: Iterable[Tuple[str, Any]]):
+        names: List[str] = []
+        try:
+            name: str
+            inst: Any
+            for name, inst in items:
+                path: Path = self._name_to_path(name)
+                self._assert_shard_dir(path)
+                self._dump_file(inst, path)
+                names.append(name)
+        finally:
+            # index what was written even when a later item fails
+            self.index.add_many(names)
+
+    def exists_many(self, names: Iterable[str]) -> Set[str]:
+        return self.index.exists_many(names)
+
+    def delete_many(self, names: Iterable[str]):
+        names: Tuple[str, ...] = tuple(names)
+        name: str
+        for name in names:
+            self._name_to_path(name).unlink(missing_ok=True)
+        self.index.remove_many(names)
+
+    def clear(self):
+        if logger.isEnabledFor(logging.INFO):
+            logger.info(f'deleting sharded directory: {self.path}')
+        if self.path.is_dir():
+            shutil.rmtree(self.path)
+        self._shard_dirs.clear()
+        self.index.clear()
+
+    def _path_to_key(self, path: Path) -> str:
+        if self._is_temp_file(path):
+            return None
+        p = parse.parse(self.pattern, path.name)
+        if p is not None:
+            return p.named.get('name')
+
+    def migrate(self) -> int:
+        """Move the files of a flat :class:`.DirectoryStash` with the same
+        :obj:`path` and :obj:`pattern` in to their respective shard
+        directories, and add their keys to the index.
+
+        :return: the number of files moved
+
+        """
+        if not self.path.is_dir():
+            return 0
+        moved: List[str] = []
+        path: Path
+        for path in self.path.iterdir():
+            if not path.is_file() or path.name == self.index_name:
+                continue
+            name: str = self._path_to_key(path)
+            if name is None:
+                continue
+            dst: Path = self.key_to_path(name)
+            self._assert_shard_dir(dst)
+            path.replace(dst)
+            moved.append(name)
+        self.index.add_many(moved)
+        if logger.isEnabledFor(logging.INFO):
+            logger.info(f'migrated {len(moved)} files in to shards')
+        return len(moved)
+
+    def rebuild_index(self) -> int:
+        """Recreate the key index by scanning the shard directories.  This is
+        useful to recover from files that were added or removed without using
+        this stash.
+
+        :return: the number of keys in the rebuilt index
+
+        """
+        pat: str = '/'.join(('*',) * (self.levels + 1))
+        paths: Iterable[Path] = filter(Path.is_file, self.path.glob(pat))
+        keys: Tuple[str, ...] = tuple(filter(
+            lambda k: k is not None, map(self._path_to_key, paths)))
+        self.index.clear()
+        self.index.add_many(keys)
+        return len(keys)
+
+    def __len__(self) -> int:
+        return len(self.index)
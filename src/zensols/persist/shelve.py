@@ -3,7 +3,7 @@
 """
 __author__ = 'Paul Landes'
 
-from typing import Any, Iterable, Optional, List
+from typing import Any, Iterable, Optional, List, Tuple, Set
 from dataclasses import dataclass, field
 import logging
 import itertools as it
@@ -116,6 +116,39 @@ class ShelveStash(CloseableStash):
         self._assert_auto_close()
         return ret
 
+    def load_many(self, names: Iterable[str]) -> Iterable[Tuple[str, Any]]:
+        try:
+            inst: sh.Shelf = self.shelve
+            return tuple(map(lambda k: (k, inst.get(k)), names))
+        finally:
+            self._assert_auto_close()
+
+    def dump_many(self, items: Iterable[Tuple[str, Any]]):
+        try:
+            inst: sh.Shelf = self.shelve
+            name: str
+            item: Any
+            for name, item in items:
+                inst[name] = item
+        finally:
+            self._assert_auto_close()
+
+    def exists_many(self, names: Iterable[str]) -> Set[str]:
+        try:
+            return set(filter(self.shelve.__contains__, names))
+        finally:
+            self._assert_auto_close()
+
+    def delete_many(self, names: Iterable[str]):
+        try:
+            inst: sh.Shelf = self.shelve
+            name: str
+            for name in names:
+                if name in inst:
+                    del inst[name]
+        finally:
+            self._assert_auto_close()
+
     def delete(self, name: str = None):
         "Delete the shelve data file."
         if logger.isEnabledFor(logging.DEBUG):
@@ -0,0 +1,214 @@
+"""A stash that persists items in a SQLite database.
+
+"""
+__author__ = 'Paul Landes'
+
+from typing import Any, Dict, List, Tuple, Set, Iterable, Optional
+from dataclasses import dataclass, field
+import logging
+import os
+import threading
+import sqlite3
+from pathlib import Path
+from . import PersistableError, Codec, PickleCodec, CloseableStash, chunks
+
+logger = logging.getLogger(__name__)
+
+
+@dataclass
+class SQLiteStash(CloseableStash):
+    """A stash that keeps its items as encoded blobs in a table of a SQLite
+    database.  The database uses write-ahead logging (WAL), so readers do not
+    block writers and several processes can read and write the same database
+    concurrently.  This makes it a good delegate of a
+    :class:`~zensols.multi.stash.MultiProcessStash`.
+
+    A connection is opened on first use by each process and kept open until
+    :meth:`close` is called.  Writers wait up to :obj:`timeout` seconds for
+    another process to finish its transaction.
+
+    Items given to :meth:`dump_many` are encoded and written in transactions of
+    :obj:`batch_size` items, so other processes are not blocked while the
+    caller creates items.
+
+    """
+    ATTR_EXP_META = ('path', 'table')
+
+    _MAX_PARAMS = 500
+
+    path: Path = field()
+    """The SQLite database file."""
+
+    table: str = field(default='stash')
+    """The name of the table with the items."""
+
+    codec: Codec = field(default_factory=PickleCodec)
+    """Encodes and decodes the items."""
+
+    timeout: float = field(default=60.)
+    """The number of seconds to wait for locks held by other connections."""
+
+    batch_size: int = field(default=100)
+    """The number of items written in each transaction by :meth:`dump_many`,
+    or ``None`` to write all of them in one transaction.
+
+    """
+    synchronous: str = field(default='NORMAL')
+    """The value of the ``synchronous`` pragma, which is durable except on
+    power loss in WAL mode when set to ``NORMAL``, and always durable with
+    ``FULL``.
+
+    """
+    def __post_init__(self):
+        if not isinstance(self.path, Path):
+            raise PersistableError(
+                f'Expecting pathlib.Path but got: {self.path.__class__}')
+        if not self.table.isidentifier():
+            raise PersistableError(f'Bad table name: {self.table}')
+        self._reset()
+
+    def _reset(self):
+        self._conn: Optional[Tuple[int, sqlite3.Connection]] = None
+        self._lock = threading.RLock()
+
+    @property
+    def connection(self) -> sqlite3.Connection:
+        """The connection of the current process, which is created and
+        initialized on first access.
+
+        """
+        conn: Tuple[int, sqlite3.Connection] = self._conn
+        pid: int = os.getpid()
+        if conn is None or conn[0] != pid:
+            # connections are not shared with forked processes
+            conn = (pid, self._connect())
+            self._conn = conn
+        return conn[1]
+
+    def _connect(self) -> sqlite3.Connection:
+        if logger.isEnabledFor(logging.DEBUG):
+            self._debug(f'connecting to {self.path}')
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        conn = sqlite3.connect(
+            str(self.path), timeout=self.timeout, isolation_level=None,
+            check_same_thread=False)
+        try:
+            conn.execute('pragma journal_mode=wal')
+            conn.execute(f'pragma synchronous={self.synchronous}')
+            conn.execute(
+                f'create table if not exists {self.table} ' +
+                '(key text primary key, value blob not null) without rowid')
+        except Exception:
+            conn.close()
+            raise
+        return conn
+
+    def _query(self, sql: str, params: Tuple[Any, ...] = ()) -> List[Tuple]:
+        with self._lock:
+            return self.connection.execute(sql, params).fetchall()
+
+    def _transact(self, sql: str, params: Iterable[Tuple[Any, ...]]):
+        """Execute ``sql`` for each of ``params`` in one transaction."""
+        with self._lock:
+            conn: sqlite3.Connection = self.connection
+            # take the write lock up front to avoid upgrade deadlocks
+            conn.execute('begin immediate')
+            try:
+                conn.executemany(sql, params)
+            except BaseException:
+                conn.execute('rollback')
+                raise
+            conn.execute('commit')
+
+    def load(self, name: str) -> Any:
+        rows: List[Tuple] = self._query(
+            f'select value from {self.table} where key = ?', (name,))
+        if len(rows) > 0:
+            return self.codec.loads(rows[0][0])
+
+    def load_many(self, names: Iterable[str]) -> Iterable[Tuple[str, Any]]:
+        group: List[str]
+        for group in chunks(names, self._MAX_PARAMS):
+            marks: str = ','.join('?' * len(group))
+            rows: Dict[str, bytes] = dict(self._query(
+                f'select key, value from {self.table} where key in ({marks})',
+                tuple(group)))
+            name: str
+            for name in group:
+                data: bytes = rows.get(name)
+                yield (name, None if data is None else self.codec.loads(data))
+
+    def exists(self, name: str) -> bool:
+        return len(self._query(
+            f'select 1 from {self.table} where key = ?', (name,))) > 0
+
+    def exists_many(self, names: Iterable[str]) -> Set[str]:
+        found: Set[str] = set()
+        group: List[str]
+        for group in chunks(names, self._MAX_PARAMS):
+            marks: str = ','.join('?' * len(group))
+            found.update(map(lambda r: r[0], self._query(
+                f'select key from {self.table} where key in ({marks})',
+                tuple(group))))
+        return found
+
+    def dump(self, name: str, inst: Any):
+        if logger.isEnabledFor(logging.DEBUG):
+            self._debug(f'saving instance: {name} -> {type(inst)}')
+        data: bytes = self.codec.dumps(inst)
+        with self._lock:
+            self.connection.execute(
+                f'insert or replace into {self.table} values (?, ?)',
+                (name, data))
+
+    def dump_many(self, items: Iterable[Tuple[str, Any]]):
+        sql: str = f'insert or replace into {self.table} values (?, ?)'
+        rows: Iterable[Tuple[str, bytes]] = map(
+            lambda t: (t[0], self.codec.dumps(t[1])), items)
+        if self.batch_size is None:
+            self._transact(sql, tuple(rows))
+        else:
+            group: List[Tuple[str, bytes]]
+            for group in chunks(rows, self.batch_size):
+                self._transact(sql, group)
+
+    def delete(self, name: str = None):
+        if name is None:
+            self.clear()
+        else:
+            with self._lock:
+                self.connection.execute(
+                    f'delete from {self.table} where key = ?', (name,))
+
+    def delete_many(self, names: Iterable[str]):
+        self._transact(f'delete from {self.table} where key = ?',
+                       map(lambda k: (k,), names))
+
+    def keys(self) -> Iterable[str]:
+        return tuple(map(lambda r: r[0], self._query(
+            f'select key from {self.table} order by key')))
+
+    def clear(self):
+        if self.path.exists():
+            with self._lock:
+                self.connection.execute(f'delete from {self.table}')
+
+    def close(self):
+        with self._lock:
+            conn: Tuple[int, sqlite3.Connection] = self._conn
+            self._conn = None
+            if conn is not None and conn[0] == os.getpid():
+                conn[1].close()
+
+    def __getstate__(self) -> Dict[str, Any]:
+        state: Dict[str, Any] = dict(self.__dict__)
+        del state['_conn']
+        del state['_lock']
+        return state
+
+    def __setstate__(self, state: Dict[str, Any]):
+        self.__dict__.update(state)
+        self._reset()
+
+    def __len__(self) -> int:
+        return self._query(f'select count(*) from {self.table}')[0][0]
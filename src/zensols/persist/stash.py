@@ -4,18 +4,20 @@
 __author__ = 'Paul Landes'
 
 import logging
-from typing import Tuple, Dict, Iterable, Optional, Any, Callable
+from typing import Tuple, Dict, Set, Iterable, Optional, Any, Callable
 from dataclasses import dataclass, field, InitVar
 from abc import ABCMeta
 from collections import OrderedDict
 from itertools import chain
 import parse
-import pickle
 from pathlib import Path
 import zensols.util.time as time
 from zensols.util import APIError
+from zensols.util.std import atomicwrite
 from . import (
     PersistableError,
+    Codec,
+    PickleCodec,
     Stash,
     ReadOnlyStash,
     DelegateStash,
@@ -143,6 +145,27 @@ class DictionaryStash(Stash):
     def keys(self):
         return self.data.keys()
 
+    def load_many(self, names: Iterable[str]) -> Iterable[Tuple[str, Any]]:
+        return map(lambda k: (k, self.load(k)), names)
+
+    def dump_many(self, items: Iterable[Tuple[str, Any]]):
+        self.data.update(items)
+
+    def exists_many(self, names: Iterable[str]) -> Set[str]:
+        return set(filter(self.data.__contains__, names))
+
+    def delete_many(self, names: Iterable[str]):
+        data: Dict[str, Any] = self.data
+        name: str
+        for name in names:
+            data.pop(name, None)
+
+    def values(self) -> Iterable[Any]:
+        return self.data.values()
+
+    def items(self) -> Tuple[str, Any]:
+        return self.data.items()
+
     def clear(self):
         self.data.clear()
         super().clear()
@@ -178,6 +201,15 @@ class LRUCacheStash(DictionaryStash):
         while len(data) > self._maxsize:
             data.popitem(last=False)
 
+    def load_many(self, names: Iterable[str]) -> Iterable[Tuple[str, Any]]:
+        return map(lambda k: (k, self.load(k)), names)
+
+    def dump_many(self, items: Iterable[Tuple[str, Any]]):
+        name: str
+        inst: Any
+        for name, inst in items:
+            self.dump(name, inst)
+
 
 @dataclass
 class CacheStash(DelegateStash):
@@ -205,6 +237,27 @@ class CacheStash(DelegateStash):
             item = default
         return item
 
+    def load_many(self, names: Iterable[str]) -> Iterable[Tuple[str, Any]]:
+        names: Tuple[str, ...] = tuple(names)
+        cached: Set[str] = self.cache_stash.exists_many(names)
+        missing: Tuple[str, ...] = tuple(filter(
+            lambda k: k not in cached, names))
+        items: Dict[str, Any] = dict(self.cache_stash.load_many(cached))
+        if len(missing) > 0:
+            if logger.isEnabledFor(logging.DEBUG):
+                self._debug(f'loading {len(missing)} from delegate, ' +
+                            'dumping to cache')
+            loaded: Dict[str, Any] = dict(self.delegate.load_many(missing))
+            self.cache_stash.dump_many(loaded.items())
+            items.update(loaded)
+        return map(lambda k: (k, items[k]), names)
+
+    def delete_many(self, names: Iterable[str]):
+        names: Tuple[str, ...] = tuple(names)
+        self.cache_stash.delete_many(self.cache_stash.exists_many(names))
+        if not isinstance(self.delegate, ReadOnlyStash):
+            self.delegate.delete_many(names)
+
     def delete(self, name: str = None):
         if self.cache_stash.exists(name):
             self.cache_stash.delete(name)
@@ -232,6 +285,16 @@ class DirectoryStash(Stash):
     """The file name portion with ``name`` populating to the key of the data
     value.
 
+    """
+    codec: Codec = field(default_factory=PickleCodec)
+    """Encodes and decodes the data in each file."""
+
+    fsync: bool = field(default=False)
+    """Whether to synchronize each file to disk before it replaces the previous
+    version, which guarantees the data survives a crash of the system at the
+    cost of much slower writes.  Without it, files are still replaced
+    atomically, so killed processes do not leave truncated files.
+
     """
     def __post_init__(self):
         if not isinstance(self.path, Path):
@@ -243,24 +306,35 @@ class DirectoryStash(Stash):
             self._debug(f'path {self.path}: {self.path.exists()}')
         self.path.mkdir(parents=True, exist_ok=True)
 
+    def _name_to_path(self, name: str) -> Path:
+        """Like :meth:`key_to_path` but without creating the directory."""
+        fname = self.pattern.format(**{'name': name})
+        return Path(self.path, fname)
+
     def key_to_path(self, name: str) -> Path:
         """Return a path to the pickled data with key ``name``.
 
         """
-        fname = self.pattern.format(**{'name': name})
         self.assert_path_dir()
-        return Path(self.path, fname)
+        return self._name_to_path(name)
 
     def _load_file(self, path: Path) -> Any:
         with open(path, 'rb') as f:
             try:
-                return pickle.load(f)
+                return self.codec.load(f)
             except Exception as e:
                 raise PersistableError(f"Can not read {path}: {e}") from e
 
+    @staticmethod
+    def _is_temp_file(path: Path) -> bool:
+        """Whether ``path`` is a file being written by :meth:`_dump_file`."""
+        return atomicwrite.is_temp_path(path)
+
     def _dump_file(self, inst: Any, path: Path):
-        with open(path, 'wb') as f:
-            pickle.dump(inst, f)
+        # write to a temporary file renamed only after it is complete so a
+        # killed process never leaves a truncated file
+        with atomicwrite(path, 'wb', fsync=self.fsync) as f:
+            self.codec.dump(inst, f)
 
     def load(self, name: str) -> Any:
         path = self.key_to_path(name)
@@ -279,6 +353,8 @@ class DirectoryStash(Stash):
 
     def keys(self) -> Iterable[str]:
         def path_to_key(path):
+            if self._is_temp_file(path):
+                return None
             p = parse.parse(self.pattern, path.name)
             # avoid files that don't match the pattern
             if p is not None:
@@ -311,6 +387,64 @@ class DirectoryStash(Stash):
             if logger.isEnabledFor(logging.WARNING):
                 logger.warning(f'does not exist: {name}')
 
+    def _try_load_file(self, path: Path) -> Any:
+        try:
+            return self._load_file(path)
+        except FileNotFoundError:
+            return None
+
+    def _is_native(self, *meths: str) -> bool:
+        """Whether none of methods ``meths`` are overridden by a subclass,
+        which means batch operations can read and write the files directly.
+
+        """
+        cls: type = type(self)
+        return all(map(
+            lambda m: getattr(cls, m) is getattr(DirectoryStash, m), meths))
+
+    def load_many(self, names: Iterable[str]) -> Iterable[Tuple[str, Any]]:
+        if not self._is_native('load'):
+            return super().load_many(names)
+        # open each file rather than checking for and then opening it
+        return map(lambda k: (k, self._try_load_file(self._name_to_path(k))),
+                   names)
+
+    def dump_many(self, items: Iterable[Tuple[str, Any]]):
+        if not self._is_native('dump'):
+            super().dump_many(items)
+            return
+        self.assert_path_dir()
+        name: str
+        inst: Any
+        for name, inst in items:
+            if logger.isEnabledFor(logging.DEBUG):
+                self._debug(f'saving instance: {name} -> {type(inst)}')
+            self._dump_file(inst, self._name_to_path(name))
+
+    def exists_many(self, names: Iterable[str]) -> Set[str]:
+        if not self._is_native('exists'):
+            return super().exists_many(names)
+        return set(filter(lambda k: self._name_to_path(k).is_file(), names))
+
+    def delete_many(self, names: Iterable[str]):
+        if not self._is_native('delete'):
+            super().delete_many(names)
+            return
+        name: str
+        for name in names:
+            self._name_to_path(name).unlink(missing_ok=True)
+
+    def values(self) -> Iterable[Any]:
+        if not self._is_native('load'):
+            return super().values()
+        return map(lambda t: t[1], self.items())
+
+    def items(self) -> Tuple[str, Any]:
+        if not self._is_native('load'):
+            return super().items()
+        return filter(lambda t: t[1] is not None,
+                      self.load_many(self.keys()))
+
     def close(self):
         pass
 
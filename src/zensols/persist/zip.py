@@ -3,15 +3,20 @@
 """
 __author__ = 'Paul Landes'
 
-from typing import Iterable, Union
+from typing import Iterable, Union, Tuple, List, Dict, Set, Optional, Any
 from dataclasses import dataclass
-from zipfile import ZipFile
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from zipfile import ZipFile, ZipInfo
 from pathlib import Path
-from . import PersistableError, persisted, PersistedWork, ReadOnlyStash
+from . import (
+    PersistableError, persisted, PersistedWork, ReadOnlyStash, CloseableStash
+)
 
 
 @dataclass(init=False)
-class ZipStash(ReadOnlyStash):
+class ZipStash(ReadOnlyStash, CloseableStash):
     """Acesss a zip file by using the entry file names as keys and the content
     of the entries as items.  The returned items are either byte arrays if
     created without an encoding, otherwise decode strings are returned.
@@ -19,11 +24,22 @@ class ZipStash(ReadOnlyStash):
     A root path can be specified so the zip file appears to have been created
     in a sub-directory.
 
+    The zip file is opened once for each process and left open until
+    :meth:`close` is called so the central directory is read only once.
+    Entries read with :meth:`load_many` are read in the order they appear in
+    the archive and decompressed by :obj:`workers` threads when set.
+
+    Entries compressed with Zstandard can only be read with Python 3.14 or
+    later, which adds support for it in :mod:`zipfile`.
+
     *Implementation note*: keys are cached to speed up access and cleared if
      the path set on the instance.
 
     """
-    def __init__(self, path: Path, root: str = None, encoding: str = None):
+    _ZSTD_METHOD = 93
+
+    def __init__(self, path: Path, root: str = None, encoding: str = None,
+                 workers: int = None):
         """See class docs.
 
         :param path: the zip file path
@@ -34,6 +50,10 @@ class ZipStash(ReadOnlyStash):
         :param encoding: if provided, returned items will be strings decoded
                          with this encoding (such as ``utf-8``)
 
+        :param workers: the number of threads used to decompress entries in
+                        :meth:`load_many`, or ``None`` to decompress in the
+                        calling thread
+
         """
         super().__init__()
         if root is not None and (root.startswith('/') or root.endswith('/')):
@@ -42,7 +62,11 @@ class ZipStash(ReadOnlyStash):
         self._path = path
         self._root = root
         self._encoding = encoding
+        self.workers = workers
         self._keys = PersistedWork('_keys', self)
+        self._key_set_pw = PersistedWork('_key_set_pw', self)
+        self._zip: Optional[Tuple[int, ZipFile]] = None
+        self._zip_lock = threading.Lock()
 
     @property
     def path(self) -> Path:
@@ -52,8 +76,26 @@ class ZipStash(ReadOnlyStash):
     @path.setter
     def path(self, path: Path):
         """The zip file path."""
+        self.close()
         self._path = path
         self._keys.clear()
+        self._key_set_pw.clear()
+
+    @property
+    def zip_file(self) -> ZipFile:
+        """The opened zip file of the current process.  The file handle is not
+        shared with forked child processes, which open their own.
+
+        """
+        pid: int = os.getpid()
+        handle: Tuple[int, ZipFile] = self._zip
+        if handle is None or handle[0] != pid:
+            with self._zip_lock:
+                handle = self._zip
+                if handle is None or handle[0] != pid:
+                    handle = (pid, ZipFile(self.path))
+                    self._zip = handle
+        return handle[1]
 
     def _map_name(self, name: str):
         """Create an absolute entry name from the item name (key)."""
@@ -61,15 +103,54 @@ class ZipStash(ReadOnlyStash):
             name = self._root + '/' + name
         return name
 
+    def _read(self, z: ZipFile, info: ZipInfo) -> Union[bytearray, str]:
+        try:
+            inst: bytearray = z.read(info)
+        except NotImplementedError as e:
+            meth: Any = info.compress_type
+            if meth == self._ZSTD_METHOD:
+                meth = 'zstd (needs Python 3.14+)'
+            raise PersistableError(
+                f"Can not read '{info.filename}' in {self.path} with " +
+                f'compression method {meth}: {e}') from e
+        if self._encoding is not None:
+            inst = inst.decode(self._encoding)
+        return inst
+
     def load(self, name: str) -> Union[bytearray, str]:
         if name in self._key_set():
-            name = self._map_name(name)
-            with ZipFile(self.path) as z:
-                with z.open(name) as myfile:
-                    inst: bytearray = myfile.read()
-            if self._encoding is not None:
-                inst = inst.decode(self._encoding)
-            return inst
+            z: ZipFile = self.zip_file
+            return self._read(z, z.getinfo(self._map_name(name)))
+
+    def load_many(self, names: Iterable[str]) -> \
+            Iterable[Tuple[str, Union[bytearray, str]]]:
+        names: Tuple[str, ...] = tuple(names)
+        keys: Set[str] = self._key_set()
+        z: ZipFile = self.zip_file
+        infos: List[ZipInfo] = list(map(
+            lambda k: z.getinfo(self._map_name(k)),
+            filter(keys.__contains__, set(names))))
+        # read in archive order to avoid seeking back and forth
+        infos.sort(key=lambda i: i.header_offset)
+        insts: Iterable[Union[bytearray, str]]
+        if self.workers is None or len(infos) < 2:
+            insts = map(lambda i: self._read(z, i), infos)
+        else:
+            with ThreadPoolExecutor(self.workers) as pool:
+                insts = tuple(pool.map(lambda i: self._read(z, i), infos))
+        rlen: int = 0 if self._root is None else len(self._root) + 1
+        items: Dict[str, Union[bytearray, str]] = dict(zip(
+            map(lambda i: i.filename[rlen:], infos), insts))
+        return tuple(map(lambda k: (k, items.get(k)), names))
+
+    def exists_many(self, names: Iterable[str]) -> Set[str]:
+        return set(filter(self._key_set().__contains__, names))
+
+    def values(self) -> Iterable[Union[bytearray, str]]:
+        return map(lambda t: t[1], self.items())
+
+    def items(self) -> Tuple[str, Union[bytearray, str]]:
+        return self.load_many(self.keys())
 
     def keys(self) -> Iterable[str]:
         return iter(self._key_set())
@@ -78,9 +159,8 @@ class ZipStash(ReadOnlyStash):
     def _key_set(self) -> Iterable[str]:
         root = self._root
         rlen = None if self._root is None else len(root)
-        keys = []
-        with ZipFile(self.path) as z:
-            keys.extend(filter(lambda n: not n.endswith('/'), z.namelist()))
+        keys = filter(lambda n: not n.endswith('/'),
+                      self.zip_file.namelist())
         if self._root is not None:
             keys = map(lambda k: k[rlen + 1:] if k.startswith(root) else None,
                        keys)
@@ -89,3 +169,23 @@ class ZipStash(ReadOnlyStash):
 
     def exists(self, name: str) -> bool:
         return name in self._key_set()
+
+    def close(self):
+        """Close the zip file if it was opened by this process."""
+        handle: Tuple[int, ZipFile] = self._zip
+        self._zip = None
+        if handle is not None and handle[0] == os.getpid():
+            handle[1].close()
+
+    def __getstate__(self) -> Dict[str, Any]:
+        state: Dict[str, Any] = dict(self.__dict__)
+        for attr in '_zip _zip_lock _keys _key_set_pw'.split():
+            del state[attr]
+        return state
+
+    def __setstate__(self, state: Dict[str, Any]):
+        self.__dict__.update(state)
+        self._keys = PersistedWork('_keys', self)
+        self._key_set_pw = PersistedWork('_key_set_pw', self)
+        self._zip = None
+        self._zip_lock = threading.Lock()
@@ -2,9 +2,13 @@
 
 """
 __author__ = 'Paul Landes'
-from typing import Tuple, Dict, Iterable, Any, Callable, Union, Protocol
+from typing import (
+    Tuple, Dict, Iterable, Any, Callable, Union, Protocol, ClassVar
+)
 from dataclasses import dataclass, field
 from pathlib import Path
+import sys
+from array import array
 import base64
 import hashlib
 import binascii
@@ -49,6 +53,19 @@ class Hasher(object):
     and file name, which uses :func:`~base64.b2a_urlsafe_b64encode`.
 
     """
+    binary: bool = field(default=False)
+    """Whether to hash the raw data of buffers (:class:`bytes`,
+    :class:`bytearray`, :class:`memoryview` and Numpy arrays) without copying
+    them, and lists and tuples of only :class:`int` or only :class:`float` as
+    packed machine values.  This is orders of magnitude faster for large data
+    than the default of hashing the string of each element, but creates
+    different hash values, so it is not the default to keep hashes created by
+    previous versions.
+
+    """
+    FILE_CHUNK_SIZE: ClassVar[int] = 1 << 20
+    """The number of bytes read at a time by :meth:`update_file`."""
+
     def __post_init__(self):
         if isinstance(self.short, bool):
             # bool = you’re explicitly choosing algo
@@ -100,9 +117,78 @@ class Hasher(object):
         if self._algo is None:
             self._algo, self._ascii_fn = self._create_algo()
 
+    def _update_array(self, arr: Any) -> bool:
+        """Hash a Numpy array as its type, shape and little-endian data.  Date
+        and time delta arrays are hashed as their (unit tagged) integers.
+
+        :return: ``False`` if the data type has no buffer format
+
+        """
+        if arr.dtype.hasobject:
+            return False
+        import numpy as np
+        if arr.dtype.byteorder == '>' or \
+           (arr.dtype.byteorder == '=' and sys.byteorder == 'big'):
+            arr = arr.astype(arr.dtype.newbyteorder('<'))
+        arr = np.ascontiguousarray(arr)
+        dtype: str = arr.dtype.str
+        if arr.dtype.kind in 'Mm':
+            # the buffer protocol has no format for datetime64/timedelta64
+            arr = arr.view('<i8')
+        try:
+            buf: memoryview = memoryview(arr).cast('B')
+        except (ValueError, TypeError):
+            return False
+        self._algo.update(f'A{dtype}{arr.shape}:'.encode())
+        self._algo.update(buf)
+        return True
+
+    def _update_numeric(self, data: Union[list, tuple]) -> bool:
+        """Hash a sequence of only ints or only floats as packed values."""
+        types = set(map(type, data))
+        if len(types) != 1:
+            return False
+        dtype: type = next(iter(types))
+        if dtype is float:
+            packed = array('d', data)
+        elif dtype is int:
+            try:
+                packed = array('q', data)
+            except OverflowError:
+                return False
+        else:
+            return False
+        if sys.byteorder == 'big':
+            packed.byteswap()
+        self._algo.update(f'{packed.typecode}{len(packed)}:'.encode())
+        self._algo.update(packed)
+        return True
+
+    def _update_binary(self, data: Any) -> bool:
+        """Hash data with the binary encoding (see :obj:`binary`).
+
+        :return: whether the data was hashed
+
+        """
+        if isinstance(data, (bytes, bytearray, memoryview)):
+            view = memoryview(data)
+            if not view.c_contiguous:
+                view = memoryview(view.tobytes())
+            self._algo.update(f'B{view.nbytes}:'.encode())
+            self._algo.update(view.cast('B'))
+            return True
+        if isinstance(data, (list, tuple)) and len(data) > 0:
+            return self._update_numeric(data)
+        if type(data).__module__ == 'numpy' and hasattr(data, 'dtype') and \
+           hasattr(data, 'shape'):
+            return self._update_array(data)
+        return False
+
     def _update(self, data: Any) -> str:
         algo = self._algo
-        if isinstance(data, str):
+        if self.binary and self._update_binary(data):
+            pass
+        elif isinstance(data, str):
             algo.update(data.encode())
         elif isinstance(data, (bool, float, int, Path)):
             algo.update(str(data).encode())
@@ -129,6 +215,9 @@ class Hasher(object):
           * :class:`~typing.Dict` with keys and values of types in this list
           * :class:`~typing.Iterable` with other data with types in this list
 
+        If :obj:`binary` is ``True``, buffers and numeric sequences are hashed
+        by their values in binary.
+
         :param data: the data used to update the hash value encapsulted in this
                      object instance
 
@@ -136,6 +225,26 @@ class Hasher(object):
         self._assert_algo()
         self._update(data)
 
+    def update_file(self, path: Path):
+        """Update the hash from the contents of a file, which is read in chunks
+        of :obj:`FILE_CHUNK_SIZE` bytes in to a reused buffer.  Unlike
+        :meth:`update`, which hashes the name of a :class:`~pathlib.Path`, this
+        hashes the file's data.
+
+        :param path: the file to hash
+
+        """
+        self._assert_algo()
+        algo: HashAlgorithm = self._algo
+        buf = bytearray(self.FILE_CHUNK_SIZE)
+        view = memoryview(buf)
+        with open(path, 'rb', buffering=0) as f:
+            while True:
+                n: int = f.readinto(buf)
+                if n == 0:
+                    break
+                algo.update(view[:n])
+
     def __call__(self, output_bytes: bool = False) -> Union[str, bytes]:
         """Create a hashed from ``text`` useful as file names representing the
         text provided.
@@ -0,0 +1,169 @@
+"""Advisory file locks used to coordinate processes.
+
+"""
+__author__ = 'Paul Landes'
+
+from typing import Optional
+import logging
+import os
+import time as tm
+from pathlib import Path
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+try:
+    import msvcrt
+except ImportError:
+    msvcrt = None
+
+logger = logging.getLogger(__name__)
+
+
+def _lock_file(fd: int, shared: bool, blocking: bool) -> bool:
+    """Lock the open file ``fd`` with the facility of the operating system.
+
+    :return: whether the lock was obtained
+
+    """
+    if fcntl is not None:
+        op: int = fcntl.LOCK_SH if shared else fcntl.LOCK_EX
+        if not blocking:
+            op |= fcntl.LOCK_NB
+        try:
+            fcntl.flock(fd, op)
+        except BlockingIOError:
+            return False
+    elif msvcrt is not None:
+        # Windows has no shared locks, so lock the first byte exclusively
+        os.lseek(fd, 0, os.SEEK_SET)
+        while True:
+            try:
+                msvcrt.locking(fd, msvcrt.LK_NBLCK, 1)
+                break
+            except OSError:
+                if not blocking:
+                    return False
+                tm.sleep(0.05)
+    return True
+
+
+def _unlock_file(fd: int):
+    if fcntl is not None:
+        fcntl.flock(fd, fcntl.LOCK_UN)
+    elif msvcrt is not None:
+        os.lseek(fd, 0, os.SEEK_SET)
+        msvcrt.locking(fd, msvcrt.LK_UNLCK, 1)
+
+
+class FileLock(object):
+    """An advisory :func:`fcntl.flock` lock on a file used to synchronize
+    processes.  Instances are used as a ``with`` statement context manager.
+    The lock file is created (along with its parent directories) if it does not
+    exist, and is left on the file system after the lock is released unless
+    :obj:`remove` is ``True``.
+
+    On Windows, :func:`msvcrt.locking` is used instead, which has no shared
+    locks.  On platforms with neither, locking has no effect.
+
+    Example::
+
+        from zensols.util.lock import FileLock
+
+        with FileLock(Path('data/.lock')):
+            # only one process at a time executes this code
+            ...
+
+    """
+    def __init__(self, path: Path, shared: bool = False,
+                 remove: bool = False):
+        """Initialize.
+
+        :param path: the lock file
+
+        :param shared: whether to obtain a shared (reader) rather than an
+                       exclusive lock
+
+        :param remove: whether to remove the lock file when the lock is
+                       released, which is only supported for exclusive locks
+
+        """
+        self.path = path
+        self.shared = shared
+        self.remove = remove
+        self._fd: Optional[int] = None
+        self.wait_time: float = 0
+        """The number of seconds waited to obtain the lock."""
+
+    @property
+    def locked(self) -> bool:
+        """Whether the lock is currently held by this instance."""
+        return self._fd is not None
+
+    def acquire(self, blocking: bool = True) -> bool:
+        """Obtain the lock.
+
+        :param blocking: if ``False`` return immediately if the lock is held by
+                         another process
+
+        :return: whether the lock was obtained
+
+        """
+        if self._fd is not None:
+            return True
+        t0: float = tm.time()
+        while True:
+            self.path.parent.mkdir(parents=True, exist_ok=True)
+            fd: int = os.open(self.path, os.O_RDWR | os.O_CREAT, 0o644)
+            try:
+                if not _lock_file(fd, self.shared, blocking):
+                    os.close(fd)
+                    return False
+                if not self.remove or self._is_current(fd):
+                    break
+            except BaseException:
+                os.close(fd)
+                raise
+            # the previous holder removed the file after we opened it, so
+            # others lock the new file
+            _unlock_file(fd)
+            os.close(fd)
+        self.wait_time = tm.time() - t0
+        self._fd = fd
+        if logger.isEnabledFor(logging.DEBUG):
+            logger.debug(f'acquired lock {self.path} in {self.wait_time:.3f}s')
+        return True
+
+    def _is_current(self, fd: int) -> bool:
+        """Whether the open file ``fd`` is (still) the lock file."""
+        try:
+            st: os.stat_result = self.path.stat()
+        except FileNotFoundError:
+            return False
+        return os.path.samestat(os.fstat(fd), st)
+
+    def release(self):
+        """Release the lock if it is held."""
+        if self._fd is not None:
+            fd: int = self._fd
+            self._fd = None
+            if self.remove:
+                try:
+                    self.path.unlink(missing_ok=True)
+                except OSError:
+                    # open files can not be removed on Windows
+                    pass
+            try:
+                _unlock_file(fd)
+            finally:
+                os.close(fd)
+
+    def __enter__(self) -> 'FileLock':
+        self.acquire()
+        return self
+
+    def __exit__(self, type, value, traceback):
+        self.release()
+
+    def __str__(self) -> str:
+        return f'{self.path} (shared={self.shared}, locked={self.locked})'
@@ -9,6 +9,8 @@ import logging
 from pathlib import Path
 from io import IOBase, TextIOBase, StringIO
 import sys
+import os
+import threading
 
 logger = logging.getLogger(__name__)
 
@@ -288,3 +290,90 @@ class openread(object):
     def __exit__(self, type, value, traceback):
         if self._fd is not None and not self._no_close:
             self._fd.close()
+
+
+class atomicwrite(object):
+    """Open a temporary file in the directory of a file for writing, which
+    replaces the file only when the ``with`` block completes without error.
+    The data is synchronized to disk before it is renamed over the file, so a
+    crash or killed process leaves the old file or the new file, but never a
+    partial one.  The temporary file is removed if the block raises an error.
+
+    Example::
+
+        with atomicwrite(Path('data.dat'), 'wb') as f:
+            pickle.dump(obj, f)
+
+    """
+    def __init__(self, path: Path, mode: str = 'w', fsync: bool = True,
+                 **open_kwargs):
+        """Initialize.
+
+        :param path: the file to (over)write
+
+        :param mode: the mode used to open the temporary file, which must be a
+                     write mode
+
+        :param fsync: whether to synchronize the file and its directory to
+                      disk
+
+        :param open_kwargs: keyword argument passed to :func:`open`
+
+        """
+        self.path = path
+        self.mode = mode
+        self.fsync = fsync
+        self._open_kwargs = open_kwargs
+        self._fd = None
+
+    @staticmethod
+    def temp_path(path: Path) -> Path:
+        """Return the unique (per process and thread) temporary file used to
+        write ``path``.
+
+        """
+        return path.parent / \
+            f'.{path.name}.{os.getpid()}-{threading.get_ident()}.tmp'
+
+    @staticmethod
+    def is_temp_path(path: Path) -> bool:
+        """Whether ``path`` is a temporary file created by this class."""
+        return path.name.startswith('.') and path.name.endswith('.tmp')
+
+    def _sync_dir(self):
+        try:
+            fd: int = os.open(self.path.parent, os.O_RDONLY)
+        except OSError:
+            # not supported on all platforms
+            return
+        try:
+            os.fsync(fd)
+        except OSError:
+            pass
+        finally:
+            os.close(fd)
+
+    def __enter__(self):
+        self._tmp: Path = self.temp_path(self.path)
+        self._fd = open(self._tmp, self.mode, **self._open_kwargs)
+        return self._fd
+
+    def __exit__(self, type, value, traceback):
+        fd = self._fd
+        self._fd = None
+        try:
+            if type is None:
+                fd.flush()
+                if self.fsync:
+                    os.fsync(fd.fileno())
+            fd.close()
+            if type is None:
+                os.replace(self._tmp, self.path)
+                if self.fsync:
+                    self._sync_dir()
+        except BaseException:
+            fd.close()
+            self._tmp.unlink(missing_ok=True)
+            raise
+        if type is not None:
+            self._tmp.unlink(missing_ok=True)
@@ -0,0 +1,105 @@
+import unittest
+import shutil
+from pathlib import Path
+from zensols.persist import (
+    DictionaryStash, CacheStash, DelegateStash, FactoryStash, DirectoryStash,
+    ShardedDirectoryStash, PackedStash, ShelveStash, ZipStash,
+)
+
+
+class CountStash(DictionaryStash):
+    def __init__(self):
+        super().__init__()
+        self.loads = 0
+
+    def load(self, name: str):
+        self.loads += 1
+        return super().load(name)
+
+
+class TestBatchStash(unittest.TestCase):
+    def setUp(self):
+        self.targ_dir = Path('target/batch')
+        if self.targ_dir.exists():
+            shutil.rmtree(self.targ_dir)
+
+    def _test_batch(self, stash):
+        stash.dump_many(map(lambda i: (str(i), i * 2), range(10)))
+        self.assertEqual(set(map(str, range(10))), set(stash.keys()))
+        self.assertEqual({'1', '3'}, stash.exists_many(('1', '3', 'x')))
+        self.assertEqual([('3', 6), ('x', None), ('0', 0)],
+                         list(stash.load_many(('3', 'x', '0'))))
+        self.assertEqual(set(map(lambda i: (str(i), i * 2), range(10))),
+                         set(stash.items()))
+        self.assertEqual(90, sum(stash.values()))
+        stash.delete_many(('1', '2', 'x'))
+        self.assertEqual(set(), stash.exists_many(('1', '2')))
+        self.assertEqual(8, len(stash))
+
+    def test_dictionary(self):
+        self._test_batch(DictionaryStash())
+
+    def test_directory(self):
+        self._test_batch(DirectoryStash(self.targ_dir))
+
+    def test_directory_override(self):
+        class ScaleStash(DirectoryStash):
+            def load(self, name: str):
+                inst = super().load(name)
+                return None if inst is None else inst // 10
+
+            def dump(self, name: str, inst):
+                super().dump(name, inst * 10)
+
+        # batch methods use the subclass's load and dump
+        self._test_batch(ScaleStash(self.targ_dir))
+        self.assertEqual(60, DirectoryStash(self.targ_dir).load('3'))
+
+    def test_sharded(self):
+        stash = ShardedDirectoryStash(self.targ_dir)
+        self._test_batch(stash)
+        self.assertEqual(8, len(ShardedDirectoryStash(self.targ_dir)))
+
+    def test_packed(self):
+        stash = PackedStash(self.targ_dir)
+        try:
+            self._test_batch(stash)
+        finally:
+            stash.close()
+
+    def test_shelve(self):
+        self._test_batch(ShelveStash(self.targ_dir / 'shelve'))
+
+    def test_delegate(self):
+        self._test_batch(DelegateStash(DictionaryStash()))
+
+    def test_cache(self):
+        delegate = CountStash()
+        delegate.dump_many((('a', 1), ('b', 2)))
+        stash = CacheStash(delegate)
+        self.assertEqual([('a', 1), ('b', 2)],
+                         list(stash.load_many(('a', 'b'))))
+        self.assertEqual(2, delegate.loads)
+        self.assertEqual([('b', 2), ('a', 1)],
+                         list(stash.load_many(('b', 'a'))))
+        self.assertEqual(2, delegate.loads)
+        stash.delete_many(('a',))
+        self.assertEqual({'b'}, stash.cache_stash.exists_many(('a', 'b')))
+        self.assertEqual({'b'}, delegate.exists_many(('a', 'b')))
+
+    def test_factory(self):
+        # overridden load is used rather than forwarding to the delegate
+        factory = DictionaryStash()
+        factory.dump_many((('a', 1), ('b', 2)))
+        stash = FactoryStash(DictionaryStash(), factory)
+        self.assertEqual([('a', 1), ('b', 2)],
+                         list(stash.load_many(('a', 'b'))))
+
+    def test_zip(self):
+        stash = ZipStash('test-resources/dconf.zip', encoding='utf-8')
+        keys = ('dconf/happy/a.conf', 'dconf/sad/b.conf', 'nada')
+        should = tuple(map(lambda k: (k, stash.load(k)), keys))
+        self.assertEqual(should, tuple(stash.load_many(keys)))
+        self.assertEqual(set(keys[:2]), stash.exists_many(keys))
+        self.assertEqual(4, len(tuple(stash.items())))
+        stash.close()
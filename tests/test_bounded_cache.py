@@ -0,0 +1,245 @@
+import unittest
+import threading
+import random
+from zensols.persist import (
+    PersistableError, BoundedLRUCacheStash, LFUCacheStash, TTLCacheStash,
+    TieredCacheStash, CacheStash, DictionaryStash,
+)
+
+
+class Sized(object):
+    def __init__(self, nbytes: int):
+        self.nbytes = nbytes
+
+
+class TestBoundedCache(unittest.TestCase):
+    def test_lru(self):
+        evicted = []
+        stash = BoundedLRUCacheStash(
+            maxsize=2, eviction_callback=lambda k, v: evicted.append(k))
+        stash.dump('a', 1)
+        stash.dump('b', 2)
+        self.assertEqual(1, stash.load('a'))
+        stash.dump('c', 3)
+        self.assertEqual(['b'], evicted)
+        self.assertEqual(('a', 'c'), stash.keys())
+        self.assertEqual(None, stash.load('b'))
+        self.assertEqual(1, stash.stats.hits)
+        self.assertEqual(1, stash.stats.misses)
+        self.assertEqual(1, stash.stats.evictions)
+        self.assertEqual(0.5, stash.stats.hit_ratio)
+
+    def test_bytes(self):
+        stash = BoundedLRUCacheStash(maxbytes=100)
+        stash.dump('a', Sized(40))
+        stash.dump('b', Sized(40))
+        self.assertEqual(80, stash.nbytes)
+        stash.dump('c', Sized(40))
+        self.assertEqual(('b', 'c'), stash.keys())
+        self.assertEqual(80, stash.nbytes)
+        # too large to cache at all, which leaves the rest cached
+        stash.dump('d', Sized(101))
+        self.assertEqual(('b', 'c'), stash.keys())
+        stash.delete('b')
+        self.assertEqual(40, stash.nbytes)
+        stash.clear()
+        self.assertEqual(0, stash.nbytes)
+        self.assertEqual(0, len(stash))
+
+    def test_lfu(self):
+        stash = LFUCacheStash(maxsize=3)
+        stash.dump_many((('a', 1), ('b', 2), ('c', 3)))
+        for _ in range(3):
+            stash.load('a')
+        stash.load('c')
+        stash.dump('d', 4)
+        self.assertEqual({'a', 'c', 'd'}, set(stash.keys()))
+        stash.dump('e', 5)
+        # d and e have one use, but d is older
+        self.assertEqual({'a', 'c', 'e'}, set(stash.keys()))
+        stash.delete('e')
+        stash.delete('c')
+        stash.dump_many((('f', 6), ('g', 7)))
+        self.assertEqual({'a', 'f', 'g'}, set(stash.keys()))
+
+    def test_lfu_reference(self):
+        rand = random.Random(0)
+        stash = LFUCacheStash(maxsize=8)
+        # key -> (use count, time of last use)
+        counts = {}
+        for tick in range(2000):
+            key = str(rand.randrange(20))
+            op = rand.random()
+            if op < 0.1:
+                stash.delete(key)
+                counts.pop(key, None)
+            elif key in counts and op < 0.6:
+                stash.load(key)
+                counts[key] = (counts[key][0] + 1, tick)
+            else:
+                # the least used, then least recently used, is evicted
+                stash.dump(key, 1)
+                counts[key] = (1, tick)
+                if len(counts) > 8:
+                    del counts[min(counts.items(), key=lambda t: t[1])[0]]
+            self.assertEqual(set(counts.keys()), set(stash.keys()))
+        stash.clear()
+        self.assertEqual({0: 0}, stash._next)
+
+    def test_ttl(self):
+        now = [0.]
+        expired = []
+        stash = TTLCacheStash(
+            ttl=10, timer=lambda: now[0],
+            eviction_callback=lambda k, v: expired.append(k))
+        stash.dump('a', 1)
+        now[0] = 5
+        stash.dump('b', 2)
+        self.assertEqual(1, stash.load('a'))
+        now[0] = 10
+        self.assertFalse(stash.exists('a'))
+        self.assertEqual(None, stash.load('a'))
+        self.assertEqual(['a'], expired)
+        self.assertEqual(('b',), stash.keys())
+        now[0] = 20
+        self.assertEqual(0, len(stash))
+        self.assertEqual(2, stash.stats.expirations)
+
+    def test_cache_stash(self):
+        delegate = DictionaryStash()
+        delegate.dump_many(map(lambda i: (str(i), i), range(10)))
+        cache = LFUCacheStash(maxsize=5)
+        stash = CacheStash(delegate, cache_stash=cache)
+        self.assertEqual(sum(range(10)), sum(stash.values()))
+        self.assertEqual(5, len(cache))
+
+    def test_threads(self):
+        stash = BoundedLRUCacheStash(maxsize=50)
+
+        def work(n: int):
+            for i in range(500):
+                key = str((i * n) % 80)
+                stash.dump(key, i)
+                stash.load(key)
+
+        threads = tuple(map(lambda n: threading.Thread(target=work, args=(n,)),
+                            range(1, 5)))
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+        self.assertEqual(50, len(stash))
+        self.assertEqual(50, len(stash._order))
+
+
+class SlowStash(DictionaryStash):
+    def __init__(self):
+        super().__init__()
+        self.event = threading.Event()
+        self.dumps = 0
+
+    def dump(self, name: str, inst):
+        self.event.wait()
+        self.dumps += 1
+        super().dump(name, inst)
+
+
+class TestTieredCache(unittest.TestCase):
+    def test_write_through(self):
+        disk = DictionaryStash()
+        stash = TieredCacheStash(disk, memory=BoundedLRUCacheStash(maxsize=2))
+        for i in range(4):
+            stash.dump(str(i), i)
+        self.assertEqual(4, len(disk))
+        self.assertEqual(('2', '3'), stash.memory.keys())
+        # promote from disk
+        self.assertEqual(0, stash.load('0'))
+        self.assertEqual(('3', '0'), stash.memory.keys())
+        self.assertEqual(4, len(stash))
+        stash.delete('3')
+        self.assertFalse(stash.exists('3'))
+        self.assertFalse(disk.exists('3'))
+        stash.close()
+
+    def test_write_behind(self):
+        disk = SlowStash()
+        stash = TieredCacheStash(disk, memory=BoundedLRUCacheStash(maxsize=2),
+                                 write_behind=True)
+        for i in range(4):
+            stash.dump(str(i), i)
+        # evicted but not yet written
+        self.assertEqual(0, len(disk.data))
+        self.assertEqual(('2', '3'), stash.memory.keys())
+        self.assertEqual(0, stash.load('0'))
+        self.assertTrue(stash.exists('1'))
+        self.assertEqual({'0', '1', '2', '3'}, set(stash.keys()))
+        disk.event.set()
+        stash.flush()
+        self.assertEqual(4, len(disk.data))
+        self.assertEqual(4, disk.dumps)
+        stash.dump('4', 4)
+        stash.close()
+        self.assertEqual(4, disk.data['4'])
+        self.assertEqual(None, stash._writer)
+
+    def test_write_error(self):
+        class BadStash(DictionaryStash):
+            def dump(self, name, inst):
+                raise ValueError('bad disk')
+
+        stash = TieredCacheStash(BadStash(), write_behind=True)
+        with self.assertLogs('zensols.persist.cache', 'ERROR'):
+            stash.dump('a', 1)
+            with self.assertRaisesRegex(PersistableError, 'bad disk'):
+                stash.flush()
+            # failed items are retried and raise until they are written
+            with self.assertRaisesRegex(PersistableError, 'bad disk'):
+                stash.flush()
+            with self.assertRaisesRegex(PersistableError, 'bad disk'):
+                stash.close()
+        self.assertEqual({'a': 1}, stash._dirty)
+        self.assertEqual(None, stash._writer)
+
+    def test_write_retry(self):
+        class FlakyStash(DictionaryStash):
+            fail = True
+
+            def dump(self, name, inst):
+                if self.fail:
+                    raise ValueError('bad disk')
+                super().dump(name, inst)
+
+        disk = FlakyStash()
+        stash = TieredCacheStash(disk, write_behind=True)
+        with self.assertLogs('zensols.persist.cache', 'ERROR'):
+            stash.dump('a', 1)
+            with self.assertRaisesRegex(PersistableError, 'bad disk'):
+                stash.flush()
+        disk.fail = False
+        stash.flush()
+        self.assertEqual(1, disk.load('a'))
+        self.assertEqual({}, stash._dirty)
+        stash.close()
+
+    def test_dump_while_writing(self):
+        class BlockingStash(DictionaryStash):
+            def __init__(self):
+                super().__init__()
+                self.writing = threading.Event()
+                self.event = threading.Event()
+
+            def dump(self, name, inst):
+                self.writing.set()
+                self.event.wait()
+                super().dump(name, inst)
+
+        disk = BlockingStash()
+        stash = TieredCacheStash(disk, write_behind=True)
+        stash.dump('a', 1)
+        disk.writing.wait()
+        # dumped again while the writer is in the delegate's dump
+        stash.dump('a', 2)
+        disk.event.set()
+        stash.close()
+        self.assertEqual(2, disk.load('a'))
+        self.assertEqual({}, stash._dirty)
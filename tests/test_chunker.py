@@ -1,5 +1,5 @@
 import unittest
-from zensols.persist import chunks
+from zensols.persist import chunks, split_chunks
 
 
 class TestChunker(unittest.TestCase):
@@ -12,3 +12,19 @@ class TestChunker(unittest.TestCase):
         self.assertEqual(([0],), tuple(chunks(range(1), 3)))
         self.assertEqual(([1, 2, 3], [4, 5, 6], [7, 8, 9], [10]),
                          tuple(chunks(map(lambda x: x + 1, range(10)), 3)))
+
+    def test_split(self):
+        def split(data, length, n):
+            return tuple(map(len, split_chunks(data, length, n)))
+
+        self.assertEqual((3, 2, 2, 2), split(range(9), 9, 4))
+        self.assertEqual((3, 3, 3), split(iter(range(9)), 9, 3))
+        self.assertEqual((1, 1), split(range(2), 2, 4))
+        self.assertEqual((), split(range(0), 0, 4))
+        # an inaccurate length
+        self.assertEqual((2, 2, 2), split(range(6), 4, 2))
+        self.assertEqual((2, 1), split(range(3), 4, 2))
+        self.assertEqual((1, 1, 1, 1, 1), split(range(5), 2, 4))
+        self.assertEqual((1, 1, 1), split(iter(range(3)), 0, 4))
+        self.assertEqual(([0, 1], [2, 3], [4]),
+                         tuple(split_chunks(iter(range(5)), 5, 3)))
@@ -0,0 +1,123 @@
+import unittest
+import shutil
+import pickle
+from pathlib import Path
+from zensols.persist import (
+    PersistableError, persisted, DirectoryStash, PackedStash,
+    PickleCodec, CompressionCodec, NumpyCodec, MemoryMapCodec,
+    DirectoryCompositeStash,
+)
+try:
+    import numpy as np
+except ModuleNotFoundError:
+    np = None
+
+TARG_DIR = Path('target/codec')
+
+
+class Computed(object):
+    def __init__(self, n: int):
+        self.n = n
+
+    @property
+    @persisted('_data', TARG_DIR / 'data.dat.gz',
+               codec=CompressionCodec('gzip'))
+    def data(self):
+        return list(range(self.n))
+
+
+class Item(object):
+    pass
+
+
+class TestCodec(unittest.TestCase):
+    def setUp(self):
+        if TARG_DIR.exists():
+            shutil.rmtree(TARG_DIR)
+        TARG_DIR.mkdir(parents=True)
+        self.data = {'a': [1, 2, 3], 'b': 'text' * 100}
+
+    def _test_codec(self, codec, stash_class=DirectoryStash):
+        self.assertEqual(self.data, codec.loads(codec.dumps(self.data)))
+        stash = stash_class(TARG_DIR / 'stash', codec=codec)
+        stash.dump('d', self.data)
+        self.assertEqual(self.data, stash.load('d'))
+        stash.close()
+        stash = pickle.loads(pickle.dumps(stash))
+        self.assertEqual(self.data, stash.load('d'))
+        stash.close()
+
+    def test_pickle(self):
+        self._test_codec(PickleCodec())
+        self._test_codec(PickleCodec(protocol=5, out_of_band=True))
+        self._test_codec(PickleCodec(), PackedStash)
+        with self.assertRaisesRegex(PersistableError, r'^Out-of-band'):
+            PickleCodec(protocol=4, out_of_band=True)
+
+    def test_compress(self):
+        for comp in 'gzip bz2 lzma'.split():
+            codec = CompressionCodec(comp)
+            self._test_codec(codec)
+            self.assertTrue(len(codec.dumps(self.data)) <
+                            len(PickleCodec().dumps(self.data)))
+        self._test_codec(CompressionCodec(
+            'gzip', PickleCodec(protocol=5, out_of_band=True)), PackedStash)
+        with self.assertRaisesRegex(PersistableError, r'^Unknown compressor'):
+            CompressionCodec('nada')
+
+    def test_persisted(self):
+        self.assertEqual([0, 1, 2], Computed(3).data)
+        self.assertEqual([0, 1, 2], Computed(5).data)
+        with open(TARG_DIR / 'data.dat.gz', 'rb') as f:
+            self.assertEqual(b'\x1f\x8b', f.read(2))
+
+    @unittest.skipIf(np is None, 'numpy is not installed')
+    def test_numpy(self):
+        codec = NumpyCodec()
+        arr = np.arange(12, dtype=np.float32).reshape(3, 4)
+        self.assertTrue(codec.dumps(arr).startswith(b'\x93NUMPY'))
+        stash = DirectoryStash(TARG_DIR / 'np', codec=codec)
+        stash.dump('arr', arr)
+        stash.dump('obj', self.data)
+        self.assertTrue(np.array_equal(arr, stash.load('arr')))
+        self.assertEqual(self.data, stash.load('obj'))
+        codec = PickleCodec(protocol=5, out_of_band=True)
+        stash = DirectoryStash(TARG_DIR / 'oob', codec=codec)
+        stash.dump('arr', {'arr': arr})
+        loaded = stash.load('arr')['arr']
+        self.assertTrue(np.array_equal(arr, loaded))
+        self.assertTrue(loaded.flags.writeable)
+
+    @unittest.skipIf(np is None, 'numpy is not installed')
+    def test_memory_map(self):
+        codec = MemoryMapCodec()
+        arr = np.arange(100, dtype=np.float64)
+        for stash in (DirectoryStash(TARG_DIR / 'mm', codec=codec),
+                      PackedStash(TARG_DIR / 'pk', codec=codec, aligned=True)):
+            stash.dump('a', {'arr': arr, 'name': 'a'})
+            stash.dump('b', 'no buffers')
+            loaded = stash.load('a')
+            self.assertEqual('a', loaded['name'])
+            self.assertTrue(np.array_equal(arr, loaded['arr']))
+            self.assertFalse(loaded['arr'].flags.writeable)
+            self.assertEqual(
+                0, loaded['arr'].ctypes.data % PickleCodec.ALIGNMENT)
+            self.assertEqual('no buffers', stash.load('b'))
+            stash.close()
+        # the map outlives the closed stash while the array is referenced
+        self.assertEqual(99., loaded['arr'][-1])
+        # regular pickle files are still readable
+        DirectoryStash(TARG_DIR / 'mm').dump('c', [1])
+        self.assertEqual([1], DirectoryStash(
+            TARG_DIR / 'mm', codec=codec).load('c'))
+
+    @unittest.skipIf(np is None, 'numpy is not installed')
+    def test_composite(self):
+        item = Item()
+        item.agg = {'a': np.ones(5), 'b': np.zeros(3)}
+        stash = DirectoryCompositeStash(
+            TARG_DIR / 'comp', ({'a'}, {'b'}), 'agg', codec=MemoryMapCodec())
+        stash.dump('1', item)
+        loaded = stash.load('1')
+        self.assertTrue(np.array_equal(np.ones(5), loaded.agg['a']))
+        self.assertFalse(loaded.agg['b'].flags.writeable)
@@ -1,6 +1,17 @@
 import unittest
+from pathlib import Path
 from zensols.util import APIError
 from zensols.util.hasher import Hasher
+try:
+    import numpy as np
+except ModuleNotFoundError:
+    np = None
+
+
+def _hash(data, **kwargs) -> str:
+    h = Hasher(**kwargs)
+    h.update(data)
+    return h()
 
 
 class TestHasher(unittest.TestCase):
@@ -61,3 +72,77 @@ class TestHasher(unittest.TestCase):
         # >64 bytes should fail __post_init__ logic
         with self.assertRaises(APIError):
             Hasher(short=65)
+
+    def test_default_unchanged(self):
+        # hashes of previous versions are kept unless binary is used
+        h = Hasher()
+        h.update([1., 2.])
+        self.assertEqual(h(), _hash(['1.0', '2.0']))
+        self.assertEqual(_hash(b'ab'), _hash(['97', '98']))
+        self.assertNotEqual(_hash(b'ab'), _hash(b'ab', binary=True))
+
+    def test_binary_buffers(self):
+        data = b'some data' * 100
+        tok = _hash(data, binary=True)
+        self.assertEqual(tok, _hash(bytearray(data), binary=True))
+        self.assertEqual(tok, _hash(memoryview(data), binary=True))
+        # non-contiguous views hash their values
+        self.assertEqual(_hash(data[::2], binary=True),
+                         _hash(memoryview(data)[::2], binary=True))
+        self.assertNotEqual(tok, _hash(data + b'x', binary=True))
+
+    def test_binary_numeric(self):
+        tok = _hash([1., 2.5, 3.], binary=True)
+        self.assertEqual(tok, _hash((1., 2.5, 3.), binary=True))
+        self.assertNotEqual(tok, _hash([1, 2, 3], binary=True))
+        self.assertNotEqual(_hash([1, 2], binary=True),
+                            _hash([1, 2, 3], binary=True))
+        # mixed, boolean and large integers use the default encoding
+        self.assertEqual(_hash([1, 2.]), _hash([1, 2.], binary=True))
+        self.assertEqual(_hash([True]), _hash([True], binary=True))
+        self.assertEqual(_hash([1 << 70]), _hash([1 << 70], binary=True))
+        self.assertEqual(_hash({'a': [1, 2]}, binary=True),
+                         _hash({'a': (1, 2)}, binary=True))
+
+    @unittest.skipIf(np is None, 'numpy is not installed')
+    def test_binary_numpy(self):
+        arr = np.arange(12, dtype=np.float64).reshape(3, 4)
+        tok = _hash(arr, binary=True)
+        self.assertEqual(tok, _hash(arr.copy(), binary=True))
+        self.assertEqual(tok, _hash(np.asfortranarray(arr), binary=True))
+        self.assertEqual(tok, _hash(arr.astype('>f8'), binary=True))
+        self.assertNotEqual(tok, _hash(arr.reshape(4, 3), binary=True))
+        self.assertNotEqual(tok, _hash(arr.astype(np.float32), binary=True))
+        self.assertEqual(_hash(arr[:, ::2].copy(), binary=True),
+                         _hash(arr[:, ::2], binary=True))
+
+    @unittest.skipIf(np is None, 'numpy is not installed')
+    def test_binary_numpy_datetime(self):
+        dates = np.array(['2024-01-01', '2024-02-01'], dtype='datetime64[D]')
+        tok = _hash(dates, binary=True)
+        self.assertEqual(tok, _hash(dates.copy(), binary=True))
+        self.assertNotEqual(tok, _hash(dates + 1, binary=True))
+        # the same integers with a different unit are different dates
+        self.assertNotEqual(tok, _hash(dates.view('i8').astype(
+            'datetime64[s]'), binary=True))
+        self.assertNotEqual(tok, _hash(dates.view('i8'), binary=True))
+        deltas = np.array([1, 2], dtype='timedelta64[h]')
+        tok = _hash(deltas, binary=True)
+        self.assertEqual(tok, _hash(deltas.astype('>m8[h]'), binary=True))
+        self.assertNotEqual(tok, _hash(deltas * 2, binary=True))
+        self.assertNotEqual(tok, _hash(deltas.astype('m8[m]'), binary=True))
+
+    def test_file(self):
+        path = Path('target/hasher.dat')
+        path.parent.mkdir(parents=True, exist_ok=True)
+        data = bytes(range(256)) * 10
+        path.write_bytes(data)
+        h = Hasher()
+        h.FILE_CHUNK_SIZE = 100
+        h.update_file(path)
+        h2 = Hasher()
+        h2._assert_algo()
+        h2._algo.update(data)
+        self.assertEqual(h2(), h())
+        # paths given to update hash the name
+        self.assertNotEqual(h(), _hash(path))
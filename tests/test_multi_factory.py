@@ -88,6 +88,20 @@ class TestMultiProcessRobustStash(unittest.TestCase):
         nstash.invalidate()
         self.assertEqual(init_len, len(nstash))
 
+    def test_multi_indexed(self):
+        stash: Stash = self.fac('robust_indexed')
+        stash.prime()
+        index_stash = stash.delegate
+        self.assertEqual(9, len(index_stash.index))
+        index_stash.delete_many(('3', '5'))
+        self.assertEqual(7, len(tuple(index_stash.delegate.path.iterdir())))
+        self._create_factory()
+        nstash: Stash = self.fac('robust_indexed')
+        self.assertEqual(7, len(nstash.delegate))
+        nstash.invalidate()
+        self.assertEqual(9, len(nstash))
+        self.assertEqual(9, len(tuple(index_stash.delegate.path.iterdir())))
+
     def _test_multi_missing(self, fn, should_missing, stash_sec='robust'):
         keys: List[str] = ' 3 5 6'.split()
         stash: Stash = self.fac(stash_sec)
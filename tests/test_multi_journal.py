@@ -0,0 +1,45 @@
+import unittest
+import shutil
+from pathlib import Path
+from zensols.multi import ChunkJournal, CompletedIndexes
+
+
+class TestChunkJournal(unittest.TestCase):
+    def setUp(self):
+        targ = Path('target/journal')
+        if targ.exists():
+            shutil.rmtree(targ)
+        self.journal = ChunkJournal(targ / 'journal.jsonl')
+
+    def test_ranges(self):
+        self.assertEqual([(0, 3), (5, 6), (7, 9)],
+                         ChunkJournal.to_ranges((0, 1, 2, 5, 7, 8)))
+        self.assertEqual([], ChunkJournal.to_ranges(()))
+        completed = CompletedIndexes(((5, 8), (0, 2), (7, 10), (12, 13)))
+        self.assertEqual(8, len(completed))
+        self.assertEqual([0, 1, 5, 6, 7, 8, 9, 12],
+                         list(filter(lambda i: i in completed, range(15))))
+
+    def test_resume(self):
+        journal = self.journal
+        self.assertFalse(journal.exists)
+        journal.assign(0, [(0, 2)])
+        journal.assign(1, [(2, 4)])
+        journal.assign(2, [(4, 6)])
+        journal.complete(0, [(0, 2)], 2)
+        journal.complete(2, [(4, 6)], 2)
+        # a record truncated by a killed process
+        with open(journal.path, 'a') as f:
+            f.write('{"event": "comp')
+        self.assertTrue(journal.exists)
+        self.assertFalse(journal.is_finished)
+        self.assertEqual((1,), journal.in_flight)
+        with self.assertLogs('zensols.multi.journal', 'WARNING'):
+            completed = journal.resume()
+        self.assertEqual([0, 1, 4, 5],
+                         list(filter(lambda i: i in completed, range(8))))
+        self.assertEqual((), journal.in_flight)
+        journal.finish()
+        self.assertTrue(journal.is_finished)
+        journal.clear()
+        self.assertFalse(journal.exists)
@@ -3,11 +3,26 @@ from dataclasses import dataclass, field
 import unittest
 import shutil
 import os
+import threading
+import asyncio
+import json
+import csv
+from multiprocessing import Process
 from itertools import chain
 from pathlib import Path
+from zensols.util import APIError
 from zensols.config import IniConfig, ImportConfigFactory
-from zensols.persist import ReadOnlyStash
-from zensols.multi import MultiProcessStash
+from zensols.persist import ReadOnlyStash, Deallocatable
+from zensols.multi import (
+    MultiProcessStash, MultiProcessDefaultStash, StreamingPoolMultiProcessor,
+    AdaptivePoolMultiProcessor, ThreadPoolMultiProcessor,
+    AsyncioMultiProcessor, PoolMultiProcessor, BrokerMultiProcessor,
+    BrokerWorker, available_memory,
+)
+try:
+    import numpy as np
+except ModuleNotFoundError:
+    np = None
 
 
 class RangeStash(ReadOnlyStash):
@@ -34,6 +49,130 @@ class RangeMultiProcessStash(MultiProcessStash):
         yield (str(min(iset)), {'pid': os.getpid(), 'iset': iset})
 
 
+@dataclass
+class RangeStreamStash(MultiProcessDefaultStash):
+    n: int = field(default=0)
+
+    def _create_data(self) -> Iterable[Any]:
+        # fails if all data is consumed before chunks complete
+        for i in range(self.n):
+            if i > 12:
+                assert len(tuple(self.delegate.keys())) > 0
+            yield i
+
+    def _process(self, chunk: List[Any]) -> Iterable[Tuple[str, Any]]:
+        for i in chunk:
+            yield (str(i), i)
+
+
+@dataclass
+class RangeReuseStash(MultiProcessDefaultStash, Deallocatable):
+    n: int = field(default=0)
+
+    def __post_init__(self):
+        super().__post_init__()
+        self.chunks = 0
+
+    def _create_data(self) -> Iterable[Any]:
+        return range(self.n)
+
+    def _process(self, chunk: List[Any]) -> Iterable[Tuple[str, Any]]:
+        self.chunks += 1
+        for i in chunk:
+            yield (str(i), (os.getpid(), id(self), self.chunks))
+
+    def deallocate(self):
+        super().deallocate()
+        if self.is_child:
+            Path(f'target/dealloc-{os.getpid()}').touch()
+
+
+@dataclass
+class RangeThreadStash(MultiProcessDefaultStash):
+    n: int = field(default=0)
+
+    def _create_data(self) -> Iterable[Any]:
+        return range(self.n)
+
+    def _process(self, chunk: List[Any]) -> Iterable[Tuple[str, Any]]:
+        for i in chunk:
+            yield (str(i), (os.getpid(), threading.get_ident(), id(self)))
+
+
+@dataclass
+class RangeAsyncStash(RangeThreadStash):
+    async def _process_async(self, chunk: List[Any]) -> \
+            Iterable[Tuple[str, Any]]:
+        for i in chunk:
+            await asyncio.sleep(0)
+            yield (str(i), (os.getpid(), threading.get_ident(), id(self)))
+
+
+@dataclass
+class RangeLazyAsyncStash(RangeAsyncStash):
+    """Records the most chunks created but not yet processed."""
+    def __post_init__(self):
+        super().__post_init__()
+        self.created = 0
+        self.processed = 0
+        self.ahead = 0
+
+    def _create_chunk_processor(self, chunk_id: int, data: Any):
+        self.created += 1
+        self.ahead = max(self.ahead, self.created - self.processed)
+        return super()._create_chunk_processor(chunk_id, data)
+
+    async def _process_async(self, chunk: List[Any]) -> \
+            Iterable[Tuple[str, Any]]:
+        async for item in super()._process_async(chunk):
+            yield item
+        self.processed += 1
+
+
+@dataclass
+class RangeSizedStash(RangeThreadStash):
+    def _create_data(self) -> Iterable[Any]:
+        for i in range(self.n):
+            yield i
+
+    def _data_size(self) -> int:
+        return self.n
+
+
+class ExitProcessor(object):
+    chunk_id = 0
+
+    def process(self, stash=None):
+        os._exit(3)
+
+
+@dataclass
+class RangeCheckpointStash(MultiProcessDefaultStash):
+    n: int = field(default=0)
+
+    def _create_data(self) -> Iterable[Any]:
+        return range(self.n)
+
+    def _process(self, chunk: List[Any]) -> Iterable[Tuple[str, Any]]:
+        fail: bool = Path('target/fail').exists()
+        for i in chunk:
+            if fail and i == 13:
+                raise ValueError(f'failed on {i}')
+            yield (str(i), fail)
+
+
+@dataclass
+class RangeSharedStash(MultiProcessDefaultStash):
+    n: int = field(default=0)
+
+    def _create_data(self) -> Iterable[Any]:
+        return range(self.n)
+
+    def _process(self, chunk: List[Any]) -> Iterable[Tuple[str, Any]]:
+        for i in chunk:
+            yield (str(i), {'pid': os.getpid(), 'arr': np.arange(i + 1)})
+
+
 class TestMultiProcessStash(unittest.TestCase):
     def setUp(self):
         self.conf = IniConfig('test-resources/test-multi.conf')
@@ -55,3 +194,264 @@ class TestMultiProcessStash(unittest.TestCase):
             self.assertTrue(len(pids) > 1)
         vals = chain.from_iterable(map(lambda x: x['iset'], stash.values()))
         self.assertEqual(list(range(n_elems)), sorted(vals))
+
+    def test_stream(self):
+        stash = self.fac('range_stream')
+        self.assertEqual(StreamingPoolMultiProcessor, stash.processor_class)
+        with self.assertLogs('zensols.multi.stash', 'INFO') as cm:
+            self.assertEqual(20, len(stash))
+        self.assertEqual(set(map(str, range(20))), set(stash.keys()))
+        self.assertEqual(sum(range(20)), sum(stash.values()))
+        prog = tuple(filter(lambda m: 'completed 10 chunks with 20 items' in m,
+                            cm.output))
+        self.assertEqual(1, len(prog))
+
+    def test_adaptive(self):
+        stash = self.fac('range_adaptive')
+        self.assertEqual(40, len(stash))
+        self.assertEqual(set(map(str, range(40))), set(stash.keys()))
+
+    def test_adaptive_sizes(self):
+        now = [0.]
+        proc = AdaptivePoolMultiProcessor(
+            'test', min_chunk_size=2, target_seconds=1, timer=lambda: now[0])
+        proc._invoke_pool(None, lambda x: 0, ())
+        data = proc._create_chunks(tuple(range(400)), 100, 4)
+        sizes = []
+        # no throughput measured yet
+        for _ in range(3):
+            sizes.append(len(next(data)))
+        self.assertEqual([2, 2, 2], sizes)
+        # 0.1 seconds per item for each of the 4 workers
+        now[0] = 1.
+        proc._chunk_complete(1, 40)
+        # at most double the last size
+        self.assertEqual(4, len(next(data)))
+        self.assertEqual(8, len(next(data)))
+        self.assertEqual(10, len(next(data)))
+        # twice as fast
+        now[0] = 2.
+        proc._chunk_complete(2, 160)
+        self.assertEqual(20, len(next(data)))
+        # guided self-scheduling limits the rest as the data runs out
+        sizes = list(map(len, data))
+        self.assertEqual(400 - 48, sum(sizes))
+        self.assertEqual(sizes, sorted(sizes, reverse=True))
+        self.assertEqual(2, sizes[-2])
+        # singleton workers are not adapted
+        chunks = tuple(proc._create_chunks(range(10), 5, 1))
+        self.assertEqual([5, 5], list(map(len, chunks)))
+
+    def _test_in_process(self, stash: MultiProcessStash):
+        self.assertEqual(20, len(stash))
+        self.assertEqual(set(map(str, range(20))), set(stash.keys()))
+        vals = tuple(stash.values())
+        # processed by the parent stash in this process
+        self.assertEqual({(os.getpid(), id(stash))},
+                         set(map(lambda v: (v[0], v[2]), vals)))
+        return set(map(lambda v: v[1], vals))
+
+    def test_thread(self):
+        stash = self.fac('range_thread')
+        self.assertEqual(ThreadPoolMultiProcessor, stash.processor_class)
+        threads = self._test_in_process(stash)
+        self.assertFalse(threading.get_ident() in threads)
+
+    def test_async(self):
+        stash = self.fac('range_async')
+        self.assertEqual(AsyncioMultiProcessor, stash.processor_class)
+        threads = self._test_in_process(stash)
+        self.assertEqual({threading.get_ident()}, threads)
+
+    def test_async_lazy(self):
+        stash = self.fac('range_async_lazy')
+        self.assertEqual(20, len(stash))
+        self.assertEqual(10, stash.created)
+        self.assertEqual(10, stash.processed)
+        # chunks are created only as workers free up
+        self.assertTrue(0 < stash.ahead <= stash.workers)
+
+    def test_async_running_loop(self):
+        stash = self.fac('range_async')
+
+        async def prime():
+            stash.prime()
+
+        asyncio.run(prime())
+        self.assertEqual(20, len(stash))
+        threads = set(map(lambda v: v[1], stash.values()))
+        self.assertFalse(threading.get_ident() in threads)
+
+    def test_sized(self):
+        stash = self.fac('range_sized')
+        with self.assertLogs('zensols.multi.stash', 'INFO') as cm:
+            self.assertEqual(9, len(stash))
+        self.assertFalse(any(map(lambda m: 'creating all data' in m,
+                                 cm.output)))
+        # split evenly rather than three chunks of 3 for four workers
+        self.assertEqual([2, 2, 2, 3], sorted(map(lambda c: c.items,
+                                                  stash.stats.chunks)))
+
+    def test_sized_chunk_size(self):
+        proc = PoolMultiProcessor('test')
+        proc.data_size = 50
+        # a chunk size given by the stash is kept
+        self.assertEqual([50], list(map(len, proc._create_chunks(
+            range(50), 100, 8))))
+        proc.split_evenly = True
+        self.assertEqual(8, len(tuple(proc._create_chunks(range(50), 7, 8))))
+
+    def test_checkpoint(self):
+        Path('target').mkdir()
+        Path('target/fail').touch()
+        stash = self.fac('range_checkpoint')
+        with self.assertRaisesRegex(ValueError, 'failed on 13'):
+            stash.prime()
+        journal = stash.journal
+        self.assertFalse(journal.is_finished)
+        # the pool might also not complete chunks sent with the failed chunk
+        in_flight = journal.in_flight
+        self.assertTrue(6 in in_flight)
+        # the item before the failure in the chunk was persisted
+        keys = set(stash.delegate.keys())
+        self.assertTrue('12' in keys)
+        self.assertFalse('13' in keys)
+        Path('target/fail').unlink()
+        stash = self.fac('range_checkpoint')
+        self.assertEqual(20, len(stash))
+        self.assertTrue(journal.is_finished)
+        # only the data of the incomplete chunks was processed again
+        should = set(map(str, chain.from_iterable(
+            map(lambda c: (2 * c, 2 * c + 1), in_flight))))
+        self.assertEqual(should,
+                         set(map(lambda t: t[0],
+                                 filter(lambda t: not t[1], stash.items()))))
+        stash.clear()
+        self.assertFalse(journal.exists)
+
+    def _test_shared(self, name: str):
+        stash = self.fac(name)
+        self.assertEqual(20, len(stash))
+        # persisted by the parent's in memory delegate
+        self.assertEqual(20, len(stash.delegate.keys()))
+        for i in range(20):
+            arr = stash[str(i)]['arr']
+            self.assertTrue(np.array_equal(np.arange(i + 1), arr))
+            # a view of the shared memory rather than a copy
+            self.assertFalse(arr.flags.owndata)
+
+    @unittest.skipIf(np is None, 'numpy is not installed')
+    def test_shared(self):
+        self._test_shared('range_shared')
+
+    @unittest.skipIf(np is None, 'numpy is not installed')
+    def test_shared_stream(self):
+        self._test_shared('range_shared_stream')
+
+    def test_metrics(self):
+        stash = self.fac('range_metrics')
+        self.assertEqual(None, stash.stats)
+        self.assertEqual(20, len(stash))
+        stats = stash.stats
+        self.assertEqual(7, len(stats.chunks))
+        self.assertEqual(list(range(7)),
+                         sorted(map(lambda c: c.chunk_id, stats.chunks)))
+        self.assertEqual(20, stats.items)
+        self.assertEqual(20, sum(map(lambda w: w.items, stats.worker_stats)))
+        for chunk in stats.chunks:
+            self.assertEqual(2 if chunk.chunk_id == 6 else 3, chunk.items)
+            self.assertTrue(chunk.duration >= 0)
+            self.assertEqual(None, chunk.result)
+        with open('target/metrics/stats.json') as f:
+            report = json.load(f)
+        self.assertEqual(20, report['items'])
+        self.assertEqual(7, len(report['chunks']))
+        self.assertTrue(report['chunks'][0]['max_rss'] > 0)
+        self.assertTrue('idle' in report['worker_stats'][0])
+        path = Path('target/metrics/stats.csv')
+        stats.write_report(path)
+        with open(path) as f:
+            rows = tuple(csv.DictReader(f))
+        self.assertEqual(7, len(rows))
+        self.assertEqual(20, sum(map(lambda r: int(r['items']), rows)))
+
+    def test_max_tasks(self):
+        stash = self.fac('range_max_tasks')
+        self.assertEqual(20, len(stash))
+        # a new process for each chunk
+        self.assertEqual(10, len(set(map(lambda v: v[0], stash.values()))))
+
+    def test_recycle(self):
+        stash = self.fac('range_recycle')
+        with self.assertLogs('zensols.multi.stash', 'INFO') as cm:
+            self.assertEqual(20, len(stash))
+        recycles = tuple(filter(lambda m: 'recycling worker processes' in m,
+                                cm.output))
+        # the pool is recycled after each window of chunks
+        self.assertEqual(4, len(recycles))
+        pids = set(map(lambda v: v[0], stash.values()))
+        self.assertTrue(len(pids) > 2)
+        # each recycled worker deallocates its stash, including those that
+        # did not get a chunk
+        self.assertTrue(pids.issubset(set(map(
+            lambda p: int(p.name.split('-')[1]),
+            Path('target').glob('dealloc-*')))))
+
+    def test_worker_memory(self):
+        avail = available_memory()
+        self.assertTrue(avail > 0)
+        proc = PoolMultiProcessor('test', worker_memory=avail // 3)
+        self.assertEqual(3, proc._cap_workers(8))
+        self.assertEqual(2, proc._cap_workers(2))
+        proc = PoolMultiProcessor('test', worker_memory=avail * 2)
+        self.assertEqual(1, proc._cap_workers(8))
+
+    def test_broker(self):
+        stash = self.fac('range_broker')
+        self.assertEqual(BrokerMultiProcessor, stash.processor_class)
+        self.assertEqual(20, len(stash))
+        self.assertEqual(set(map(str, range(20))), set(stash.keys()))
+        pids = set(map(lambda v: v[0], stash.values()))
+        # processed by the worker processes rather than this one
+        self.assertFalse(os.getpid() in pids)
+        self.assertEqual(10, len(stash.stats.chunks))
+
+    def test_broker_remote(self):
+        # a worker started before the broker as it would be on another host
+        worker = BrokerWorker('127.0.0.1', 50321, 'test', wait=30)
+        proc = Process(target=worker.run)
+        proc.start()
+        try:
+            stash = self.fac('range_broker_remote')
+            self.assertEqual(20, len(stash))
+            proc.join(30)
+            self.assertEqual(0, proc.exitcode)
+            self.assertEqual({proc.pid},
+                             set(map(lambda v: v[0], stash.values())))
+        finally:
+            if proc.is_alive():
+                proc.terminate()
+
+    def test_broker_no_workers(self):
+        proc = BrokerMultiProcessor('test', local_workers=0, timeout=0.5)
+        with self.assertRaisesRegex(APIError, 'no chunk completed in 0.5s'):
+            proc._invoke_work(1, 2, (ExitProcessor(),), None)
+
+    def test_broker_lost_worker(self):
+        proc = BrokerMultiProcessor('test', timeout=None)
+        with self.assertRaisesRegex(APIError, 'exited with 3'):
+            proc._invoke_work(1, 2, (ExitProcessor(),), None)
+
+    def test_reuse(self):
+        stash = self.fac('range_reuse')
+        self.assertEqual(20, len(stash))
+        by_pid = {}
+        for pid, sid, chunks in stash.values():
+            by_pid.setdefault(pid, set()).add((sid, chunks))
+        n_chunks = 0
+        for insts in by_pid.values():
+            # one stash instance per process that processed all its chunks
+            self.assertEqual(1, len(set(map(lambda t: t[0], insts))))
+            n_chunks += max(map(lambda t: t[1], insts))
+        self.assertEqual(10, n_chunks)
+        self.assertEqual(2, len(tuple(Path('target').glob('dealloc-*'))))
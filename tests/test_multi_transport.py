@@ -0,0 +1,39 @@
+import unittest
+import pickle
+from zensols.multi import SharedMemoryResult
+try:
+    import numpy as np
+except ModuleNotFoundError:
+    np = None
+
+
+@unittest.skipIf(np is None, 'numpy is not installed')
+class TestSharedMemoryResult(unittest.TestCase):
+    def test_round_trip(self):
+        arr = np.arange(10.)
+        farr = np.ones((3, 4), order='F')
+        sliced = np.arange(6).reshape(2, 3)[:, ::2]
+        res = SharedMemoryResult.create(
+            (('a', arr), ('b', {'f': farr, 's': 'str'}), ('c', sliced)),
+            chunk_id=3, ranges=[(0, 3)])
+        self.assertEqual(3, len(res))
+        # only the segment name and offsets are sent to the parent
+        res = pickle.loads(pickle.dumps(res))
+        path = SharedMemoryResult.SHM_PATH / res.name
+        self.assertTrue(path.exists())
+        items = dict(res.load())
+        self.assertFalse(path.exists())
+        self.assertEqual(3, res.chunk_id)
+        self.assertTrue(np.array_equal(arr, items['a']))
+        self.assertFalse(items['a'].flags.owndata)
+        self.assertTrue(np.array_equal(farr, items['b']['f']))
+        self.assertEqual('str', items['b']['s'])
+        self.assertTrue(np.array_equal(sliced, items['c']))
+        # the memory stays mapped after the segment is removed
+        items['a'][0] = 5
+        self.assertEqual(5, items['a'][0])
+
+    def test_empty(self):
+        res = SharedMemoryResult.create(())
+        self.assertEqual(None, res.name)
+        self.assertEqual([], list(res.load()))
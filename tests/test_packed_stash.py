@@ -0,0 +1,107 @@
+import unittest
+import shutil
+from pathlib import Path
+from multiprocessing import Pool
+from zensols.util.lock import FileLock
+from zensols.persist import PackedStash
+
+TARG_DIR = Path('target/packed')
+
+
+def _dump_range(start: int):
+    stash = PackedStash(TARG_DIR)
+    for i in range(start, start + 20):
+        stash.dump(str(i), {'i': i})
+    stash.close()
+    return start
+
+
+class TestPackedStash(unittest.TestCase):
+    def setUp(self):
+        if TARG_DIR.exists():
+            shutil.rmtree(TARG_DIR)
+
+    def _test_crud(self, stash: PackedStash):
+        self.assertEqual(0, len(stash))
+        self.assertEqual(None, stash.load('a'))
+        stash.dump('a', 1)
+        stash.dump('b', [2])
+        self.assertTrue(stash.exists('a'))
+        self.assertEqual(1, stash.load('a'))
+        self.assertEqual([2], stash['b'])
+        stash.dump('a', 'one')
+        self.assertEqual('one', stash.load('a'))
+        self.assertEqual({'a', 'b'}, set(stash.keys()))
+        stash.delete('b')
+        self.assertFalse(stash.exists('b'))
+        self.assertEqual(None, stash.load('b'))
+        self.assertEqual(1, len(stash))
+        self.assertTrue(stash.garbage > 0)
+        # a new instance recreates the index from the segment
+        stash2 = PackedStash(TARG_DIR)
+        self.assertEqual(('a',), tuple(stash2.keys()))
+        self.assertEqual('one', stash2.load('a'))
+        stash.compact()
+        self.assertEqual(0, stash.garbage)
+        self.assertEqual('one', stash.load('a'))
+        self.assertEqual(1, len(tuple(TARG_DIR.glob('*.pack'))))
+        # the other instance reloads after the compaction
+        self.assertEqual('one', stash2.load('a'))
+        stash2.close()
+        stash.clear()
+        self.assertEqual(0, len(stash))
+        stash.close()
+
+    def test_crud(self):
+        self._test_crud(PackedStash(TARG_DIR))
+
+    def test_crud_no_mmap(self):
+        self._test_crud(PackedStash(TARG_DIR, use_mmap=False))
+
+    def test_delete_keys(self):
+        stash = PackedStash(TARG_DIR)
+        stash.dump_many(map(lambda i: (str(i), i), range(5)))
+        for k in stash.keys():
+            stash.delete(k)
+        self.assertEqual(0, len(stash))
+        stash.close()
+
+    def test_segments(self):
+        stash = PackedStash(TARG_DIR, segment_size=100)
+        for i in range(10):
+            stash.dump(str(i), 'x' * 30)
+        self.assertTrue(len(tuple(TARG_DIR.glob('*.pack'))) > 3)
+        self.assertEqual(10, len(stash))
+        self.assertEqual('x' * 30, stash.load('7'))
+        stash.compact()
+        self.assertEqual(1, len(tuple(TARG_DIR.glob('*.pack'))))
+        self.assertEqual(set(map(str, range(10))), set(stash.keys()))
+        stash.close()
+
+    def test_concurrent(self):
+        with Pool(3) as pool:
+            pool.map(_dump_range, (0, 20, 40))
+        stash = PackedStash(TARG_DIR)
+        self.assertEqual(60, len(stash))
+        for i in range(60):
+            self.assertEqual({'i': i}, stash.load(str(i)))
+        stash.close()
+
+    def test_dump_many_unlocked(self):
+        stash = PackedStash(TARG_DIR, batch_size=100)
+        held = []
+
+        def items():
+            for i in range(10):
+                # creating items does not hold the lock of the stash
+                lock = FileLock(TARG_DIR / '.lock')
+                held.append(not lock.acquire(blocking=False))
+                lock.release()
+                yield (str(i), 'x' * 30)
+
+        stash.dump_many(items())
+        self.assertEqual(10, len(held))
+        self.assertFalse(any(held))
+        self.assertEqual(10, len(stash))
+        self.assertEqual('x' * 30, stash.load('9'))
+        stash.close()
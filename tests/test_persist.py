@@ -1,14 +1,25 @@
 import logging
 from pathlib import Path
+import os
+import sys
+import subprocess
+import time
 import shutil
+from multiprocessing import Process, Queue
 import pickle
 from io import BytesIO
 import unittest
+try:
+    import numpy as np
+except ModuleNotFoundError:
+    np = None
 from zensols.persist import (
     DelegateDefaults,
     persisted,
+    persisted_property,
     PersistedWork,
     PersistableContainer,
+    PersistableError,
     DirectoryStash,
     IncrementKeyDirectoryStash,
     ShelveStash,
@@ -124,6 +135,59 @@ class TransientPickle(PersistableContainer):
         return self.n
 
 
+class KeyedClass(PersistableContainer):
+    def __init__(self, n):
+        self.n = n
+        self.calls = 0
+
+    @persisted('_square', Path('target/square'), keyed=True, cache_size=2,
+               track_source=True)
+    def square(self, x, scale=1):
+        self.calls += 1
+        return x * x * scale + self.n
+
+    @persisted('_cube', keyed=True, transient=True)
+    def cube(self, x):
+        self.calls += 1
+        return x * x * x
+
+    @persisted('_size', keyed=True, transient=True)
+    def size(self, data):
+        self.calls += 1
+        return len(data)
+
+
+class FastClass(PersistableContainer):
+    def __init__(self, n):
+        self.n = n
+
+    @persisted_property('_someprop', Path('target/fast.dat'))
+    def someprop(self):
+        """Some property."""
+        self.n += 1
+        return self.n
+
+    @persisted_property('_tranprop', transient=True)
+    def tranprop(self):
+        self.n += 10
+        return self.n
+
+
+class SingleFlightClass(object):
+    @persisted('_work', Path('target/flight/work.dat'), mkdir=True,
+               single_flight=True)
+    def work(self):
+        with open('target/flight-calls', 'a') as f:
+            f.write('x')
+        time.sleep(0.5)
+        return os.getpid()
+
+
+def _single_flight(queue: Queue):
+    inst = SingleFlightClass()
+    queue.put((inst.work(), inst._work.lock_wait_time))
+
+
 class Raiser(object):
     def __getstate__(self):
         raise ValueError('attempt to pickle transient value')
@@ -342,6 +406,169 @@ class TestPersistWork(unittest.TestCase):
         self.assertEqual(14, sc3.someprop)
         self.assertEqual(TransientPickle, type(sc3))
 
+    def test_atomic(self):
+        path = Path('target/atomic.dat')
+
+        class Failer(object):
+            def fail(self):
+                raise ValueError('failed work')
+
+            def other(self):
+                # another process saves the work while this one creates it
+                with open(path, 'wb') as f:
+                    pickle.dump('first', f)
+                return 'second'
+
+        pw = PersistedWork(path, owner=Failer())
+        pw.worker = Failer.fail
+        with self.assertRaisesRegex(ValueError, 'failed work'):
+            pw(pw.owner)
+        # no empty file is left by the failed work
+        self.assertFalse(path.exists())
+        pw.worker = Failer.other
+        # the work of this process is used, but the file is not replaced
+        self.assertEqual('second', pw(pw.owner))
+        pw2 = PersistedWork(path, owner=Failer())
+        self.assertEqual('first', pw2(pw2.owner))
+        self.assertEqual([], list(path.parent.glob('.*.tmp')))
+
+    def test_fast_property(self):
+        self.assertEqual('Some property.', FastClass.someprop.__doc__)
+        fc = FastClass(1)
+        self.assertEqual(2, fc.someprop)
+        self.assertEqual(2, fc.someprop)
+        self.assertEqual(2, fc.__dict__['someprop'])
+        self.assertTrue(isinstance(fc._someprop, PersistedWork))
+        self.assertTrue(Path('target/fast.dat').is_file())
+        fc._someprop.set(5)
+        self.assertEqual(5, fc.someprop)
+        fc._someprop.clear()
+        self.assertFalse('someprop' in fc.__dict__)
+        self.assertEqual(3, fc.someprop)
+        self.assertEqual(13, fc.tranprop)
+        fc2 = self._freeze_thaw(fc)
+        self.assertEqual(3, fc2.someprop)
+        # transient values are created again after unpickling
+        self.assertFalse('tranprop' in fc2.__dict__)
+        self.assertEqual(23, fc2.tranprop)
+        fc2.deallocate()
+        self.assertFalse('someprop' in fc2.__dict__)
+
+    def test_single_flight(self):
+        queue = Queue()
+        procs = [Process(target=_single_flight, args=(queue,))
+                 for _ in range(3)]
+        for proc in procs:
+            proc.start()
+        res = [queue.get(timeout=30) for _ in procs]
+        for proc in procs:
+            proc.join()
+        # only one process did the work that the others loaded
+        self.assertEqual('x', Path('target/flight-calls').read_text())
+        self.assertEqual(1, len(set(map(lambda r: r[0], res))))
+        self.assertTrue(res[0][0] in set(map(lambda p: p.pid, procs)))
+        self.assertTrue(max(map(lambda r: r[1], res)) > 0.2)
+        # the lock file is removed
+        self.assertEqual(['work.dat'], sorted(map(
+            lambda p: p.name, Path('target/flight').iterdir())))
+
+    def test_keyed(self):
+        kc = KeyedClass(1)
+        self.assertEqual(5, kc.square(2))
+        self.assertEqual(10, kc.square(3))
+        self.assertEqual(5, kc.square(2))
+        self.assertEqual(2, kc.calls)
+        # keyword arguments are part of the key
+        self.assertEqual(9, kc.square(2, scale=2))
+        self.assertEqual(3, kc.calls)
+        # only the two most recently used values are in memory
+        self.assertEqual(2, len(kc._square._get_cache()))
+        self.assertEqual(8, kc.cube(2))
+        self.assertEqual(8, kc.cube(2))
+        self.assertEqual(4, kc.calls)
+        # ints and floats of the same value are different arguments
+        self.assertEqual(8., kc.cube(2.))
+        self.assertEqual(5, kc.calls)
+        # values are loaded from the stash by other instances
+        kc2 = KeyedClass(100)
+        self.assertEqual(5, kc2.square(2))
+        self.assertEqual(9, kc2.square(2, scale=2))
+        self.assertEqual(0, kc2.calls)
+        self.assertEqual(200, kc2.square(10))
+        self.assertEqual(1, kc2.calls)
+        kc2._square.clear()
+        self.assertEqual(104, kc2.square(2))
+        self.assertEqual(2, kc2.calls)
+        kc3 = self._freeze_thaw(kc2)
+        self.assertEqual(104, kc3.square(2))
+        self.assertEqual(2, kc3.calls)
+
+    def test_keyed_binary(self):
+        kc = KeyedClass(1)
+        self.assertEqual(2, kc.size(b'ab'))
+        self.assertEqual(2, kc.size(b'ab'))
+        self.assertEqual(1, kc.calls)
+        self.assertEqual(2, kc.size(b'ac'))
+        self.assertEqual(2, kc.calls)
+        self.assertEqual(2, kc.size(memoryview(b'ab')))
+        self.assertEqual(2, kc.calls)
+
+    def test_keyed_iterator(self):
+        kc = KeyedClass(1)
+        with self.assertRaisesRegex(PersistableError, 'only be iterated once'):
+            kc.size(iter([1, 2, 3]))
+        with self.assertRaisesRegex(PersistableError, 'only be iterated once'):
+            kc.size(map(str, range(3)))
+        self.assertEqual(0, kc.calls)
+        self.assertEqual(3, kc.size([1, 2, 3]))
+
+    def test_keyed_set(self):
+        code = ('from zensols.persist.annotation import KeyedPersistedWork\n'
+                'class Owner(object): pass\n'
+                "work = KeyedPersistedWork('target/setkey', Owner())\n"
+                "print(work._create_key(({'a', 'b', 'c', ('d', 1)},), {}))")
+        env = dict(os.environ)
+        env['PYTHONPATH'] = os.pathsep.join(filter(None, (
+            str(Path('src').absolute()), env.get('PYTHONPATH'))))
+        keys = set()
+        for seed in range(3):
+            env['PYTHONHASHSEED'] = str(seed)
+            keys.add(subprocess.run(
+                (sys.executable, '-c', code), env=env, check=True,
+                capture_output=True, text=True).stdout)
+        # the same key regardless of the hash seed
+        self.assertEqual(1, len(keys))
+        kc = KeyedClass(1)
+        self.assertEqual(2, kc.size({'a', 'b'}))
+        self.assertEqual(2, kc.size(frozenset({'b', 'a'})))
+        self.assertEqual(1, kc.calls)
+        self.assertEqual(2, kc.size(('a', 'b')))
+        self.assertEqual(2, kc.calls)
+
+    @unittest.skipIf(np is None, 'numpy is not installed')
+    def test_keyed_numpy(self):
+        kc = KeyedClass(1)
+        self.assertEqual(27, kc.cube(np.int64(3)))
+        self.assertEqual(27, kc.cube(np.int64(3)))
+        self.assertEqual(1, kc.calls)
+        self.assertEqual(4, kc.size(np.arange(4)))
+        self.assertEqual(4, kc.size(np.arange(4)))
+        self.assertEqual(2, kc.calls)
+        # the shape is part of the key
+        self.assertEqual(2, kc.size(np.arange(4).reshape(2, 2)))
+        self.assertEqual(3, kc.calls)
+
+    def test_keyed_source(self):
+        kc = KeyedClass(1)
+        self.assertEqual(5, kc.square(2))
+        path = Path('target/square')
+        self.assertEqual(2, len(tuple(path.iterdir())))
+        # a previous version of the method
+        (path / '_source.dat').write_bytes(pickle.dumps('old'))
+        kc2 = KeyedClass(2)
+        self.assertEqual(6, kc2.square(2))
+        self.assertEqual(1, kc2.calls)
+
     def test_dir_stash(self):
         path = self.targdir
         file_path = path / 'tmp5.dat'
@@ -361,6 +588,23 @@ class TestPersistWork(unittest.TestCase):
             s['tmp6']
         self.assertFalse(file_path.exists())
 
+    def test_dir_stash_atomic(self):
+        class Unpicklable(object):
+            def __reduce__(self):
+                raise ValueError('can not pickle')
+
+        path = self.targdir / 'atomic'
+        s = DirectoryStash(path, pattern='{name}')
+        s.dump('a', 1)
+        with self.assertRaisesRegex(ValueError, 'can not pickle'):
+            s.dump('a', Unpicklable())
+        # the old file is intact and the partial file removed
+        self.assertEqual(1, s.load('a'))
+        self.assertEqual(['a'], sorted(map(lambda p: p.name, path.iterdir())))
+        # files being written by other processes are not keys
+        (path / '.b.123-456.tmp').touch()
+        self.assertEqual(['a'], list(s.keys()))
+
     def test_increment_key_directory_stash(self):
         path = self.targdir / 'ids'
         if path.exists():
@@ -0,0 +1,173 @@
+import unittest
+import shutil
+from pathlib import Path
+from multiprocessing import Pool
+from zensols.persist import (
+    DirectoryStash, ShardedDirectoryStash, KeyIndex, KeyIndexStash,
+    PreemptiveStash,
+)
+
+TARG_DIR = Path('target/keyidx')
+
+
+def _create_index_stash() -> KeyIndexStash:
+    return KeyIndexStash(DirectoryStash(TARG_DIR / 'data'),
+                         index_path=TARG_DIR / 'keys.idx')
+
+
+def _dump_index_range(start: int) -> int:
+    stash = _create_index_stash()
+    stash.dump_many(map(lambda i: (str(i), i), range(start, start + 50)))
+    return start
+
+
+class TestShardedDirectoryStash(unittest.TestCase):
+    def setUp(self):
+        self.targ_dir = Path('target/shard')
+        if self.targ_dir.exists():
+            shutil.rmtree(self.targ_dir)
+
+    def test_dump_load(self):
+        stash = ShardedDirectoryStash(self.targ_dir)
+        self.assertEqual(0, len(stash))
+        self.assertFalse(stash.exists('a'))
+        self.assertEqual(None, stash.load('a'))
+        for i in range(10):
+            stash.dump(str(i), i * 2)
+        self.assertEqual(10, len(stash))
+        self.assertEqual(list(map(str, range(10))), list(stash.keys()))
+        self.assertTrue(stash.exists('3'))
+        self.assertEqual(6, stash.load('3'))
+        self.assertEqual(6, stash['3'])
+        path: Path = stash.key_to_path('3')
+        self.assertTrue(path.is_file())
+        self.assertEqual(2, len(path.relative_to(self.targ_dir).parts) - 1)
+        stash.delete('3')
+        self.assertFalse(stash.exists('3'))
+        self.assertFalse(path.exists())
+        self.assertEqual(9, len(stash))
+        # a new instance reads the persisted index
+        stash = ShardedDirectoryStash(self.targ_dir)
+        self.assertEqual(9, len(stash))
+        self.assertEqual(16, stash['8'])
+        stash.clear()
+        self.assertEqual(0, len(stash))
+        self.assertFalse(self.targ_dir.exists())
+
+    def test_delete_keys(self):
+        stash = ShardedDirectoryStash(self.targ_dir)
+        for i in range(5):
+            stash.dump(i, i)
+        self.assertEqual(('0', '1', '2', '3', '4'), tuple(stash.keys()))
+        self.assertTrue(stash.exists(3))
+        self.assertEqual({2, '4'}, stash.exists_many((2, '4', 5)))
+        self.assertEqual(3, stash.load('3'))
+        # keys are a snapshot that is not changed by deletes
+        for k in stash.keys():
+            stash.delete(k)
+        self.assertEqual(0, len(stash))
+
+    def test_migrate(self):
+        flat = DirectoryStash(self.targ_dir)
+        for i in range(5):
+            flat.dump(str(i), i)
+        self.assertEqual(5, len(tuple(self.targ_dir.iterdir())))
+        stash = ShardedDirectoryStash(self.targ_dir, levels=1)
+        self.assertEqual(5, stash.migrate())
+        self.assertEqual(5, len(stash))
+        self.assertEqual(set(map(str, range(5))), set(stash.keys()))
+        self.assertEqual(4, stash['4'])
+        self.assertEqual(0, len(tuple(self.targ_dir.glob('*.dat'))))
+        stash.index.clear()
+        self.assertEqual(0, len(stash))
+        self.assertEqual(5, stash.rebuild_index())
+        self.assertEqual(set(map(str, range(5))), set(stash.keys()))
+
+    def test_index_shared(self):
+        path = self.targ_dir / 'keys.idx'
+        idx1 = KeyIndex(path)
+        idx2 = KeyIndex(path)
+        idx1.add_many('a b c'.split())
+        self.assertEqual(3, len(idx2))
+        idx2.remove('b')
+        self.assertEqual(['a', 'c'], list(idx1.keys()))
+        self.assertEqual(2, idx1.garbage)
+        idx1.compact()
+        self.assertEqual(0, idx1.garbage)
+        self.assertEqual(['a', 'c'], list(idx2.keys()))
+        idx2.add('d')
+        self.assertTrue('d' in idx1)
+
+
+class TestKeyIndexStash(unittest.TestCase):
+    def setUp(self):
+        self.targ_dir = TARG_DIR
+        if self.targ_dir.exists():
+            shutil.rmtree(self.targ_dir)
+
+    def _create_stash(self) -> KeyIndexStash:
+        return _create_index_stash()
+
+    def test_index(self):
+        flat = DirectoryStash(self.targ_dir / 'data')
+        flat.dump('a', 1)
+        stash = self._create_stash()
+        # created from the delegate's keys on first use
+        self.assertEqual(['a'], list(stash.keys()))
+        stash.dump('b', 2)
+        stash.dump_many((('c', 3), ('d', 4)))
+        self.assertEqual(4, len(stash))
+        self.assertTrue(stash.exists('c'))
+        self.assertEqual({'a', 'd'}, stash.exists_many(('a', 'd', 'e')))
+        self.assertEqual(3, stash.load('c'))
+        stash.delete('a')
+        stash.delete_many(('b', 'e'))
+        self.assertEqual([('c', 3), ('d', 4)], sorted(stash.items()))
+        self.assertEqual(['c', 'd'], sorted(flat.keys()))
+        stash = self._create_stash()
+        self.assertEqual(['c', 'd'], list(stash.keys()))
+        flat.dump('e', 5)
+        self.assertFalse(stash.exists('e'))
+        self.assertEqual(3, stash.rebuild_index())
+        self.assertTrue(stash.exists('e'))
+        stash.clear()
+        self.assertEqual(0, len(stash))
+        self.assertEqual(0, len(tuple(flat.keys())))
+
+    def test_index_delete_keys(self):
+        stash = self._create_stash()
+        stash.dump_many(map(lambda i: (str(i), i), range(5)))
+        for k in stash.keys():
+            stash.delete(k)
+        self.assertEqual(0, len(stash))
+
+    def test_index_empty(self):
+        stash = self._create_stash()
+        self.assertEqual(0, len(stash))
+        # the journal is created without keys so it is not rebuilt again
+        self.assertTrue((self.targ_dir / 'keys.idx').is_file())
+
+    def test_index_concurrent(self):
+        with Pool(8) as pool:
+            pool.map(_dump_index_range, range(0, 400, 50))
+        stash = self._create_stash()
+        n_files = len(tuple((self.targ_dir / 'data').iterdir()))
+        self.assertEqual(400, n_files)
+        self.assertEqual(n_files, len(stash))
+        self.assertEqual(set(map(str, range(400))), set(stash.keys()))
+        # the lock file is removed
+        self.assertEqual(['data', 'keys.idx'], sorted(map(
+            lambda p: p.name, self.targ_dir.iterdir())))
+
+    def test_has_data(self):
+        class Keyless(KeyIndexStash):
+            def keys(self):
+                raise AssertionError('keys should not be used')
+
+        stash = Keyless(DirectoryStash(self.targ_dir / 'data'),
+                        index_path=self.targ_dir / 'keys.idx')
+        pstash = PreemptiveStash(stash)
+        self.assertFalse(pstash.has_data)
+        stash.dump('a', 1)
+        pstash._reset_has_data()
+        self.assertTrue(pstash.has_data)
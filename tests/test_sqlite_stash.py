@@ -0,0 +1,90 @@
+import unittest
+import shutil
+import pickle
+from pathlib import Path
+from multiprocessing import Pool
+from zensols.persist import PersistableError, SQLiteStash
+
+TARG_DIR = Path('target/sqlite')
+DB_PATH = TARG_DIR / 'stash.db'
+
+
+def _dump_range(start: int):
+    stash = SQLiteStash(DB_PATH, batch_size=7)
+    stash.dump_many(map(lambda i: (str(i), {'i': i}), range(start, start + 20)))
+    stash.close()
+    return start
+
+
+class TestSQLiteStash(unittest.TestCase):
+    def setUp(self):
+        if TARG_DIR.exists():
+            shutil.rmtree(TARG_DIR)
+
+    def test_crud(self):
+        stash = SQLiteStash(DB_PATH)
+        self.assertEqual(0, len(stash))
+        self.assertEqual(None, stash.load('a'))
+        self.assertFalse(stash.exists('a'))
+        stash.dump('b', [1, 2])
+        stash.dump('a', 'one')
+        self.assertTrue(stash.exists('a'))
+        self.assertEqual('one', stash['a'])
+        self.assertEqual(('a', 'b'), stash.keys())
+        stash.dump('a', 'two')
+        self.assertEqual('two', stash.load('a'))
+        self.assertEqual(2, len(stash))
+        stash.delete('a')
+        self.assertEqual(('b',), stash.keys())
+        stash.clear()
+        self.assertEqual(0, len(stash))
+        stash.close()
+        stash = SQLiteStash(DB_PATH)
+        self.assertEqual('wal', stash._query('pragma journal_mode')[0][0])
+        stash.close()
+
+    def test_batch(self):
+        stash = SQLiteStash(DB_PATH, batch_size=3)
+        stash.dump_many(map(lambda i: (str(i), i), range(1000)))
+        self.assertEqual(1000, len(stash))
+        keys = tuple(map(str, range(0, 1000, 2))) + ('nada',)
+        self.assertEqual(500, len(stash.exists_many(keys)))
+        items = tuple(stash.load_many(keys))
+        self.assertEqual(keys, tuple(map(lambda t: t[0], items)))
+        self.assertEqual(('nada', None), items[-1])
+        self.assertEqual(('998', 998), items[-2])
+        stash.delete_many(keys)
+        self.assertEqual(500, len(stash))
+        stash.close()
+
+    def test_rollback(self):
+        def items():
+            yield ('a', 1)
+            raise ValueError('stop')
+
+        stash = SQLiteStash(DB_PATH, batch_size=None)
+        with self.assertRaises(ValueError):
+            stash.dump_many(items())
+        self.assertEqual(0, len(stash))
+        stash.close()
+
+    def test_pickle(self):
+        stash = SQLiteStash(DB_PATH)
+        stash.dump('a', 1)
+        stash2 = pickle.loads(pickle.dumps(stash))
+        self.assertEqual(1, stash2.load('a'))
+        stash.close()
+        stash2.close()
+
+    def test_bad_table(self):
+        with self.assertRaisesRegex(PersistableError, r'^Bad table name'):
+            SQLiteStash(DB_PATH, table='a; drop')
+
+    def test_concurrent(self):
+        with Pool(3) as pool:
+            pool.map(_dump_range, (0, 20, 40))
+        stash = SQLiteStash(DB_PATH)
+        self.assertEqual(60, len(stash))
+        for i in range(60):
+            self.assertEqual({'i': i}, stash.load(str(i)))
+        stash.close()
@@ -46,3 +46,27 @@ class TestZipStash(unittest.TestCase):
         self.assertEqual(should, stash.load('a.conf'))
         self.assertEqual(should, stash.get('a.conf'))
         self.assertEqual(should, stash['a.conf'])
+
+    def test_load_many(self):
+        stash = ZipStash('test-resources/dconf.zip', root='dconf',
+                         encoding='utf-8', workers=2)
+        try:
+            keys = ('sad/b.conf', 'happy/a.conf', 'nada', 'happy/a.conf')
+            should = tuple(map(lambda k: (k, stash.load(k)), keys))
+            self.assertEqual(should, stash.load_many(keys))
+            self.assertEqual(None, should[2][1])
+            self.assertEqual(4, len(stash.items()))
+            z = stash.zip_file
+            self.assertTrue(z is stash.zip_file)
+        finally:
+            stash.close()
+        self.assertEqual(None, z.fp)
+
+    def test_pickle(self):
+        import pickle
+        stash = ZipStash('test-resources/dconf.zip', encoding='utf-8')
+        should = stash.load('dconf/happy/a.conf')
+        stash2 = pickle.loads(pickle.dumps(stash))
+        self.assertEqual(should, stash2.load('dconf/happy/a.conf'))
+        stash.close()
+        stash2.close()